@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import platform
+import tarfile
+import http.client
+import urllib.parse
+import subprocess as sub
+import functools
+import downloader
+
+print = functools.partial(print, flush=True)
+
+
+def default_dir():
+    return os.environ.get('ST_ARTIFACT_CACHE', os.path.join(
+        os.path.expanduser('~'), '.cache', 'st_artifacts'))
+
+
+def remote_url():
+    """Base url of optional remote cache. Artifacts are GET and PUT as <url>/<key>.tar.gz"""
+    return os.environ.get('ST_ARTIFACT_URL', '').rstrip('/')
+
+
+def compiler_id(msvc_version=''):
+    """Return string identifying the compiler that builds dependencies"""
+    if platform.system() == "Windows":
+        return 'msvc ' + os.path.basename(msvc_version.rstrip('/\\')) + \
+            ' ' + os.environ.get('VCToolsVersion', '')
+    compiler = os.environ.get('CC', 'cc')
+    try:
+        out = sub.run([compiler, '--version'], stdout=sub.PIPE, stderr=sub.DEVNULL,
+                      universal_newlines=True).stdout
+        return out.split('\n')[0]
+    except OSError:
+        return compiler
+
+
+def make_key(name, inputs):
+    """Return artifact key: name and hash of all build inputs"""
+    data = json.dumps(inputs, sort_keys=True)
+    return name + '-' + hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _put(url, path):
+    parts = urllib.parse.urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' \
+        else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=60)
+    try:
+        with open(path, 'rb') as f:
+            connection.request('PUT', parts.path, body=f, headers={
+                'Content-Length': str(os.path.getsize(path))})
+        response = connection.getresponse()
+        response.read()
+        if response.status >= 300:
+            raise RuntimeError('HTTP {}'.format(response.status))
+    finally:
+        connection.close()
+
+
+def restore(key, install_dir, cache_dir=None):
+    """Extract cached install tree into install_dir. Return False on miss"""
+    cache_dir = cache_dir or default_dir()
+    path = os.path.join(cache_dir, key + '.tar.gz')
+    if not os.path.exists(path) and len(remote_url()) > 0:
+        try:
+            downloader.Downloader(retries=2).fetch(
+                remote_url() + '/' + key + '.tar.gz', path)
+        except RuntimeError as e:
+            print('>> Artifact', key, 'is not available remotely:', e)
+    if not os.path.exists(path):
+        print('>> Artifact', key, 'is not cached')
+        return False
+    print('>> Restoring artifact', key)
+    os.makedirs(install_dir, exist_ok=True)
+    with tarfile.open(path) as arc:
+        arc.extractall(install_dir, **({'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}))
+    return True
+
+
+def installed_files(build_dir):
+    """Return files installed by `cmake --build . --target install`"""
+    with open(os.path.join(build_dir, 'install_manifest.txt'), 'r') as f:
+        return [l.strip() for l in f if len(l.strip()) > 0]
+
+
+def store(key, install_dir, files, cache_dir=None):
+    """Pack files of install_dir into cache and upload it if remote is set"""
+    cache_dir = cache_dir or default_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.tar.gz')
+    root = os.path.abspath(install_dir)
+    with tarfile.open(path + '.tmp', 'w:gz') as arc:
+        for f in sorted(files):
+            arc.add(f, os.path.relpath(os.path.abspath(f), root), recursive=False)
+    os.replace(path + '.tmp', path)
+    print('>> Stored artifact', key, '{:.1f} Mb'.format(os.path.getsize(path) / 1024 / 1024))
+
+    if len(remote_url()) > 0 and os.environ.get('ST_ARTIFACT_UPLOAD') == '1':
+        try:
+            _put(remote_url() + '/' + key + '.tar.gz', path)
+            print('>> Uploaded artifact', key)
+        except (OSError, RuntimeError, http.client.HTTPException) as e:
+            print('>> Failed to upload artifact', key, e)
@@ -1,4 +1,5 @@
 import common as c
+import artifacts
 from config import *
 import os
 import platform
@@ -12,15 +13,19 @@ if platform.system() == "Windows":
     env_cmd = c.get_msvc_env_cmd(bitness=bitness, msvc_version=msvc_version)
     c.apply_cmd_env(env_cmd)
 
-c.recreate_dir(build_dir)
+build_type_flag = 'debug' if build_type == 'debug' else 'release'
+qmake_flags = os.environ.get('QMAKE_FLAGS','') + ' CONFIG+=' + build_type_flag
+c.prepare_build_dir(build_dir, {
+    'flags': qmake_flags, 'qt': qt_version, 'project': c.md5sum(pro_file),
+    'compiler': artifacts.compiler_id(msvc_version)})
 os.chdir(build_dir)
 
 c.run('lupdate "{}"'.format(pro_file))
 c.run('lrelease "{}"'.format(pro_file))
 
 c.set_make_threaded()
-build_type_flag = 'debug' if build_type == 'debug' else 'release'
-qmake_flags = os.environ.get('QMAKE_FLAGS','') + ' CONFIG+=' + build_type_flag
+launcher = c.setup_compiler_cache(compiler_cache, compiler_cache_dir)
+qmake_flags += ' ' + c.get_qmake_launcher_args(launcher, qmake_flags)
 c.run('qmake {} "{}"'.format(qmake_flags, pro_file))
 make_cmd = c.get_make_cmd()
 c.run(make_cmd)
@@ -1,70 +1,111 @@
 import os
 import subprocess as sub
-import urllib.request
 from shutil import which
-import zipfile
 import tarfile
 import functools
 import shutil
-import multiprocessing
 import platform
 import re
 import ast
-import hashlib
+import json
+import digests
+import stamps
+import unpacker
+import downloader
+import tracing
+import jobs
+import packer
 
 
 print = functools.partial(print, flush=True)
 
 
 def run(cmd, capture_output=False, silent=False):
+    """Run shell command. Its time, cpu and peak memory are traced"""
     print('>> Running', cmd)
     if capture_output:
-        result = sub.run(cmd, check=True, shell=True, universal_newlines=True,
-                         stdout=sub.PIPE, stderr=sub.STDOUT)
+        result = tracing.call(cmd, universal_newlines=True,
+                              stdout=sub.PIPE, stderr=sub.STDOUT)
         if not silent:
             print(result.stdout)
     else:
         if not silent:
-            result = sub.run(cmd, check=True, shell=True)
+            result = tracing.call(cmd)
         else:
-            result = sub.run(cmd, check=True, shell=True,
-                             stdout=sub.DEVNULL, stderr=sub.DEVNULL)
+            result = tracing.call(cmd, stdout=sub.DEVNULL, stderr=sub.DEVNULL)
     return result
 
 
-def download(url, out, force=False):
-    print('>> Downloading', url, 'as', out)
-    if not force and os.path.exists(out):
-        print('>>', out, 'already exists')
-        return
-    out_path = os.path.dirname(out)
-    if len(out_path) > 0:
-        os.makedirs(out_path, exist_ok=True)
-    urllib.request.urlretrieve(url, out)
+# DOWNLOAD_SEGMENTS > 1 enables parallel ranges for big files
+loader = downloader.Downloader(
+    workers=int(os.getenv('DOWNLOAD_WORKERS', '4')),
+    segments=int(os.getenv('DOWNLOAD_SEGMENTS', '1')))
+
+
+def download(url, out, force=False, size=None, md5=None, sha256=None):
+    """Download url resuming partial file. Existing out is kept if it matches
+    given size and digests"""
+    with tracing.span('download', url):
+        loader.fetch(url, out, force, size, md5, sha256)
+
+
+def download_all(items):
+    """Download [(url, out) or dict of download() args] concurrently"""
+    loader.fetch_all(items, download)
 
 
-def extract(src, dest):
+def extract(src, dest, verify=None):
+    """Extract archive unless its stamp in dest says it is already extracted.
+    verify (or EXTRACT_VERIFY=1) also checks sizes of extracted files"""
     abs_path = os.path.abspath(src)
     print('>> Extracting', abs_path, 'to', dest)
     if len(dest) > 0:
         os.makedirs(dest, exist_ok=True)
+    dest_dir = dest if len(dest) > 0 else '.'
 
-    if which('cmake'):
-        out = run('cmake -E tar t "{}"'.format(abs_path),
-                  capture_output=True, silent=True)
-        files = out.stdout.split('\n')
-        already_exist = True
-        for file in files:
-            if not os.path.exists(os.path.join(dest, file)):
-                already_exist = False
-                break
-        if already_exist:
-            print('>> All files already exist')
-            return
-        sub.run('cmake -E tar xvf "{}"'.format(abs_path),
-                check=True, shell=True, cwd=dest)
+    if verify is None:
+        verify = os.getenv('EXTRACT_VERIFY') == '1'
+    if stamps.is_extracted(abs_path, dest_dir, verify):
+        print('>> All files already exist')
         return
 
+    with tracing.span('extract', abs_path):
+        members = _extract(src, abs_path, dest_dir)
+        stamps.write(abs_path, dest_dir, members)
+
+
+def download_and_extract(url, dest, name=None, verify=None):
+    """Extract tar or zip archive while it is downloaded without storing it.
+    Return top level folder of the archive"""
+    name = name or os.path.basename(url)
+    print('>> Downloading and extracting', url, 'to', dest)
+    dest_dir = dest if len(dest) > 0 else '.'
+    if verify is None:
+        verify = os.getenv('EXTRACT_VERIFY') == '1'
+    stamp = stamps.load_streamed(name, url, dest_dir, verify)
+    if stamp is not None:
+        print('>> All files already exist')
+        return stamp['top']
+
+    with tracing.span('download+extract', url):
+        with loader.stream(url) as stream:
+            members = unpacker.extract(stream, name, dest_dir)
+            md5 = stream.md5()
+        stamps.write_streamed(name, url, dest_dir, md5, members)
+    return stamps.load(name, dest_dir)['top']
+
+
+def _extract(src, abs_path, dest):
+    """Extract archive and return extracted names if known"""
+    if unpacker.kind(src) is not None:  # no inner .tar staging
+        with open(abs_path, 'rb') as f:
+            return unpacker.extract(f, src, dest)
+
+    if which('cmake'):
+        out = tracing.call('cmake -E tar xvf "{}"'.format(abs_path), cwd=dest,
+                           stdout=sub.PIPE, universal_newlines=True)
+        return [l[2:] for l in out.stdout.split('\n') if l.startswith('x ')]
+
     is_tar_smth = src.endswith('.tar', 0, src.rfind('.'))
     if which('7z'):
         sub.run('7z x "{}" -o"{}"'.format(abs_path, dest),
@@ -74,14 +115,14 @@ def extract(src, dest):
             inner_name = abs_path[:abs_path.rfind('.')]
             sub.run('7z x "{}" -o"{}"'.format(inner_name, dest),
                     check=True, shell=True, input=b'S\n')
-        return
+        return None
 
     if src.endswith('.tar') or is_tar_smth:
         path = abs_path if platform.system() != "Windows" else os.path.relpath(abs_path)
         if which('tar'):
             sub.run('tar xf "{}" --keep-newer-files -C "{}"'.format(path, dest),
                     check=True, shell=True)
-            return
+            return None
 
     raise RuntimeError('No archiver to extract {} file'.format(src))
 
@@ -107,22 +148,12 @@ def get_archive_top_dir(path):
 
 
 def archive(files, out):
-    print('>> Archiving', files, 'into', out)
-    if out.endswith('.zip'):
-        arc = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
-        for f in files:
-            arc.write(f)
-        arc.close()
-        return
-
-    if out.endswith('.tar.gz'):
-        arc = tarfile.open(out, 'w|gz')
-        for f in files:
-            arc.add(f)
-        arc.close()
-        return
-
-    raise RuntimeError('No archiver to create {} file'.format(out))
+    """Pack files into zip or tar.gz compressing them in parallel.
+    ARCHIVE_WORKERS limits threads, all cpus are used by default"""
+    print('>> Archiving', len(files), 'files into', out)
+    workers = int(os.getenv('ARCHIVE_WORKERS', '0')) or jobs.cpu_count()
+    with tracing.span('archive', out):
+        packer.archive(files, out, workers)
 
 
 def symlink(src, dest):
@@ -140,6 +171,32 @@ def recreate_dir(path):
     os.mkdir(path)
 
 
+def prepare_build_dir(path, inputs):
+    """Create build dir keeping results of previous builds for incremental
+    rebuild. It is cleaned only if inputs (flags, compiler, project files
+    digests) changed since previous build or CLEAN_BUILD=1 is set.
+    Return True if previous build dir is reused"""
+    stamp = os.path.join(path, '.build-inputs.json')
+    previous = None
+    try:
+        with open(stamp, 'r') as f:
+            previous = json.load(f)
+    except (OSError, ValueError):  # missing or truncated by interrupted build
+        pass
+    if os.getenv('CLEAN_BUILD') != '1' and previous == inputs:
+        print('>> Reusing build dir', path)
+        return True
+
+    reason = 'clean build is requested' if os.getenv('CLEAN_BUILD') == '1' \
+        else 'inputs changed' if previous is not None else 'no previous build'
+    print('>> Cleaning build dir', path, '({})'.format(reason))
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    with open(stamp, 'w') as f:
+        json.dump(inputs, f, sort_keys=True)
+    return False
+
+
 def add_to_path(entry, prepend=True):
     path_separator = ';' if platform.system() == "Windows" else ':'
     os.environ['PATH'] = entry + path_separator + os.environ['PATH']
@@ -165,12 +222,89 @@ def get_make_cmd():
     return 'nmake' if platform.system() == "Windows" else 'make'
 
 
-def set_make_threaded():
-    """Adjust environment to run threaded make command"""
+def set_make_threaded(compile_mb=jobs.compile_mb, link_mb=jobs.link_mb):
+    """Adjust environment to run threaded make command. Job count respects
+    cgroup cpu quota and memory that jobs of given cost in Mb may take.
+    MAKE_JOBS is set by release.py when steps share cpus, memory is shared
+    in the same proportion. Return allowed number of concurrent link jobs"""
+    cpus = jobs.cpu_count()
+    memory = jobs.available_memory_mb()
+    if 'MAKE_JOBS' in os.environ:
+        share = int(os.environ['MAKE_JOBS'])
+        if memory is not None:
+            memory *= min(1.0, share / int(os.getenv('MAKE_CPU_BUDGET', cpus)))
+        cpus = min(cpus, share)
+    count, link_count = jobs.plan(cpus, memory, compile_mb, link_mb)
+    print('>> Using {} jobs, {} link jobs ({} cpus, {} Mb memory)'.format(
+        count, link_count, cpus, 'unknown' if memory is None else int(memory)))
     if platform.system() == "Windows":
-        os.environ['CL'] = '/MP'
+        os.environ['CL'] = '/MP{}'.format(count)
     else:
-        os.environ['MAKEFLAGS'] = '-j{}'.format(multiprocessing.cpu_count())
+        os.environ['MAKEFLAGS'] = '-j{}'.format(count)
+    return link_count
+
+
+def get_cmake_job_pool_args(link_jobs):
+    """Return cmake args limiting concurrent links. Used by Ninja generator"""
+    return '-DCMAKE_JOB_POOLS=link={} -DCMAKE_JOB_POOL_LINK=link'.format(link_jobs)
+
+
+def setup_compiler_cache(tool, cache_dir):
+    """Point compiler cache to shared dir. Return launcher command or ''"""
+    if len(tool) == 0:
+        return ''
+    if not which(tool):
+        print('>> Compiler cache', tool, 'is not found')
+        return ''
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['SCCACHE_DIR' if tool == 'sccache' else 'CCACHE_DIR'] = cache_dir
+    return tool
+
+
+def get_cmake_launcher_args(launcher):
+    if len(launcher) == 0:
+        return ''
+    return '-DCMAKE_C_COMPILER_LAUNCHER={0} -DCMAKE_CXX_COMPILER_LAUNCHER={0}'.format(
+        launcher)
+
+
+def get_qmake_launcher_args(launcher, qmake_flags):
+    """Return qmake assignments prefixing compilers (default or from qmake_flags)"""
+    if len(launcher) == 0:
+        return ''
+    compilers = {'Windows': ('cl', 'cl'), 'Darwin': ('clang', 'clang++')}.get(
+        platform.system(), ('gcc', 'g++'))
+    result = []
+    for variable, default in zip(('QMAKE_CC', 'QMAKE_CXX'), compilers):
+        match = re.search(variable + r'=(\S+)', qmake_flags)
+        compiler = match.group(1) if match else default
+        result.append('"{}={} {}"'.format(variable, launcher, compiler))
+    return ' '.join(result)
+
+
+def compiler_cache_stats(tool):
+    """Return (hits, misses) of compiler cache or None if unknown"""
+    if len(tool) == 0 or not which(tool):
+        return None
+    if tool == 'sccache':
+        out = sub.run([tool, '--show-stats', '--stats-format', 'json'],
+                      stdout=sub.PIPE, universal_newlines=True)
+        if out.returncode != 0:
+            return None
+        stats = json.loads(out.stdout)['stats']
+        return (sum(stats['cache_hits']['counts'].values()),
+                sum(stats['cache_misses']['counts'].values()))
+    out = sub.run([tool, '--print-stats'], stdout=sub.PIPE, universal_newlines=True)
+    if out.returncode != 0:  # ccache < 4
+        return None
+    stats = dict(l.split('\t', 1) for l in out.stdout.split('\n') if '\t' in l)
+    hits = int(stats.get('direct_cache_hit', 0)) + int(stats.get('preprocessed_cache_hit', 0))
+    return hits, int(stats.get('cache_miss', 0))
+
+
+def zero_compiler_cache_stats(tool):
+    if len(tool) > 0 and which(tool):
+        sub.run([tool, '--zero-stats'], stdout=sub.DEVNULL)
 
 
 def is_inside_docker():
@@ -206,8 +340,4 @@ def apply_cmd_env(cmd):
 def md5sum(path):
     if not os.path.exists(path):
         return ''
-    md5 = hashlib.md5()
-    with open(path, 'rb') as f:
-        md5.update(f.read())
-        return md5.hexdigest()
-    return ''
+    return digests.md5(path)
@@ -12,7 +12,10 @@ qt_modules = ['qtbase', 'qttools', 'icu',
 qt_dir = path.abspath('qt')
 ssl_dir = path.abspath('ssl')
 
-build_dir = path.abspath('build')
+# persistent build dirs of app, tests and each dependency (in a subdir)
+build_dir = path.abspath(getenv('ST_BUILD_DIR', 'build'))
+test_build_dir = path.abspath(getenv('ST_TEST_BUILD_DIR', 'build-tests'))
+dependency_build_dir = path.abspath(getenv('ST_DEPS_BUILD_DIR', 'build-deps'))
 dependencies_dir = path.abspath('deps')
 pro_file = path.abspath(path.dirname(__file__) +
                         '/../../screen-translator.pro')
@@ -33,3 +36,7 @@ bitness = '32' if os_name == 'win32' else '64'
 msvc_version = getenv('MSVC_VERSION', 'C:/Program Files (x86)/Microsoft Visual Studio/2019/Community')
 
 build_type = 'release' # 'debug'
+
+# opt-in compiler cache: 'ccache' or 'sccache'
+compiler_cache = getenv('COMPILER_CACHE', '')
+compiler_cache_dir = path.abspath(getenv('COMPILER_CACHE_DIR', 'compiler_cache'))
@@ -0,0 +1,115 @@
+import os
+import hashlib
+import sqlite3
+import time
+import threading
+
+chunk_size = 1024 * 1024
+# files modified more recently may still change within the same mtime tick
+min_age_ns = 2 * 1000 * 1000 * 1000
+
+
+def default_path():
+    return os.environ.get('ST_DIGEST_CACHE', os.path.join(
+        os.path.expanduser('~'), '.cache', 'st_digests.sqlite'))
+
+
+def compute(path, algorithms=('md5',)):
+    """Return {algorithm: hexdigest} of file reading it by chunks"""
+    hashers = [hashlib.new(a) for a in algorithms]
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            for h in hashers:
+                h.update(chunk)
+    return {a: h.hexdigest() for a, h in zip(algorithms, hashers)}
+
+
+def stat_key(path):
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class DigestCache:
+    """On-disk file digests keyed on (device, inode, size, mtime_ns).
+    Safe to be used by several processes at once"""
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else default_path()
+        self.db = None
+        try:
+            dir = os.path.dirname(self.path)
+            if len(dir) > 0:
+                os.makedirs(dir, exist_ok=True)
+            self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.db.execute('pragma journal_mode=wal')
+            self.db.execute('create table if not exists digests ('
+                            'dev integer, ino integer, size integer, mtime integer, '
+                            'algorithm text, digest text, '
+                            'primary key (dev, ino, algorithm))')
+        except sqlite3.Error as e:
+            print('>> Digest cache {} is not available: {}'.format(self.path, e))
+            self.db = None
+
+    def lookup(self, path, algorithms=('md5',)):
+        """Return cached {algorithm: hexdigest} or None if any is missing or stale"""
+        if self.db is None:
+            return None
+        key = stat_key(path)
+        rows = self.db.execute(
+            'select algorithm, digest from digests where dev=? and ino=? '
+            'and size=? and mtime=?', key).fetchall()
+        cached = dict(rows)
+        if not all(a in cached for a in algorithms):
+            return None
+        return {a: cached[a] for a in algorithms}
+
+    def store(self, path, key, digests):
+        """Save digests computed for file that had given stat_key before hashing"""
+        if self.db is None:
+            return
+        if stat_key(path) != key or time.time_ns() - key[3] < min_age_ns:
+            return  # changed while hashing or may change unnoticed
+        try:
+            with self.db:
+                self.db.execute('begin immediate')
+                self.db.executemany(
+                    'insert or replace into digests values (?, ?, ?, ?, ?, ?)',
+                    [key + (a, d) for a, d in digests.items()])
+        except sqlite3.Error as e:
+            print('>> Failed to update digest cache: {}'.format(e))
+
+    def digests(self, path, algorithms=('md5',)):
+        """Return {algorithm: hexdigest} of file using cached values when possible"""
+        cached = self.lookup(path, algorithms)
+        if cached is not None:
+            return cached
+        key = stat_key(path)
+        result = compute(path, algorithms)
+        self.store(path, key, result)
+        return result
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+# sqlite connection may only be used by the thread that created it
+_shared = threading.local()
+
+
+def shared():
+    if not hasattr(_shared, 'cache'):
+        _shared.cache = DigestCache()
+    return _shared.cache
+
+
+def md5(path):
+    return shared().digests(path, ('md5',))['md5']
+
+
+def sha256(path):
+    return shared().digests(path, ('sha256',))['sha256']
@@ -0,0 +1,393 @@
+import sys
+import os
+import time
+import threading
+import functools
+import hashlib
+import http.client
+import urllib.parse
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import digests
+
+print = functools.partial(print, flush=True)
+
+chunk_size = 1024 * 1024
+redirect_codes = (301, 302, 303, 307, 308)
+user_agent = 'ScreenTranslator-ci'
+# stores If-Range value of partial file next to it
+validator_suffix = '.validator'
+
+
+class RetryableError(RuntimeError):
+    pass
+
+
+def check(path, size=None, md5=None, sha256=None):
+    """Return description of mismatch between file and expectations or None"""
+    if size is not None and os.path.getsize(path) != size:
+        return 'size {} != {}'.format(os.path.getsize(path), size)
+    expected = {a: d for a, d in (('md5', md5), ('sha256', sha256)) if d}
+    if len(expected) == 0:
+        return None
+    actual = digests.compute(path, tuple(expected.keys()))
+    for algorithm, digest in expected.items():
+        if actual[algorithm] != digest.lower():
+            return '{} {} != {}'.format(algorithm, actual[algorithm], digest)
+    return None
+
+
+def response_validator(response):
+    """Return strong ETag or Last-Modified of response usable in If-Range"""
+    etag = response.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.getheader('Last-Modified')
+
+
+def load_validator(path):
+    """Return validator saved for partial file at path or None"""
+    try:
+        with open(path + validator_suffix) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def save_validator(path, value):
+    if value:
+        with open(path + validator_suffix, 'w') as f:
+            f.write(value)
+    elif os.path.exists(path + validator_suffix):
+        os.remove(path + validator_suffix)
+
+
+def remove_partial(path):
+    """Remove partial file and its validator"""
+    for name in (path, path + validator_suffix):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+class ConnectionPool:
+    """Keeps idle keep-alive connections per host"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, parts):
+        with self.lock:
+            idle = self.idle.get((parts.scheme, parts.netloc))
+            if idle:
+                return idle.pop()
+        if parts.scheme == 'https':
+            return http.client.HTTPSConnection(parts.netloc, timeout=self.timeout)
+        if parts.scheme == 'http':
+            return http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+        raise RuntimeError('Unsupported url scheme ' + parts.scheme)
+
+    def put(self, parts, connection, response):
+        if response.will_close:
+            connection.close()
+            return
+        with self.lock:
+            self.idle.setdefault((parts.scheme, parts.netloc), []).append(connection)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+class Downloader:
+    """Downloads files over reused connections, resumes partial files with
+    Range requests and optionally splits large files into parallel segments.
+    Partial file is resumed only if the server confirms with If-Range that
+    it did not change since the partial file was started"""
+
+    def __init__(self, workers=4, segments=1, segment_size=8 * 1024 * 1024,
+                 retries=5, timeout=60, backoff=1.0):
+        self.workers = workers
+        self.segments = segments
+        self.segment_size = segment_size
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(timeout)
+
+    def open(self, url, headers={}):
+        """Return (response, connection, parts) following redirects"""
+        for _ in range(10):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            connection = self.pool.get(parts)
+            try:
+                connection.request('GET', path, headers=dict(
+                    headers, **{'User-Agent': user_agent}))
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise RetryableError('{}: {}'.format(url, e))
+            if response.status in redirect_codes:
+                response.read()
+                self.pool.put(parts, connection, response)
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status == 429 or response.status >= 500:
+                connection.close()
+                raise RetryableError('{}: HTTP {}'.format(url, response.status))
+            return response, connection, parts
+        raise RuntimeError('Too many redirects for ' + url)
+
+    def retry(self, url, action):
+        """Return result of action repeating it after retryable errors"""
+        attempt = 0
+        while True:
+            try:
+                return action()
+            except RetryableError as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise RuntimeError('Failed to download {}: {}'.format(url, e))
+                delay = min(self.backoff * 2 ** (attempt - 1), 30)
+                print('>> Retrying after', e, 'in {:.1f}s'.format(delay))
+                time.sleep(delay)
+
+    def probe(self, url):
+        """Return (size, accepts ranges, validator). Size is None when unknown"""
+        return self.retry(url, lambda: self._probe_once(url))
+
+    def _probe_once(self, url):
+        response, connection, parts = self.open(url, {'Range': 'bytes=0-0'})
+        if response.status == 206:
+            try:
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise RetryableError('{}: {}'.format(url, e))
+            self.pool.put(parts, connection, response)
+            total = response.getheader('Content-Range', '').rpartition('/')[2]
+            return (int(total) if total.isdigit() else None), True, \
+                response_validator(response)
+        length = response.getheader('Content-Length')
+        connection.close()  # do not read the whole body
+        if response.status != 200:
+            raise RuntimeError('{}: HTTP {}'.format(url, response.status))
+        return (int(length) if length else None), False, response_validator(response)
+
+    def fetch_range(self, url, path, start=0, end=None):
+        """Download bytes [start, end) of url appending to partial file at path"""
+        self.retry(url, lambda: self._fetch_once(url, path, start, end))
+
+    def _fetch_once(self, url, path, start, end):
+        have = os.path.getsize(path) if os.path.exists(path) else 0
+        validator = load_validator(path) if have > 0 else None
+        if validator is None:
+            have = 0  # can not tell if partial file is of the served version
+        offset = start + have
+        if end is not None and offset >= end:
+            return
+        headers = {}
+        if offset > 0 or end is not None:
+            last = '' if end is None else str(end - 1)
+            headers['Range'] = 'bytes={}-{}'.format(offset, last)
+            if validator is not None:
+                headers['If-Range'] = validator
+        response, connection, parts = self.open(url, headers)
+        if response.status == 416 and end is None and have > 0:
+            response.read()  # partial file is longer than the served one
+            self.pool.put(parts, connection, response)
+            print('>> Restarting', url, 'partial file does not match')
+            remove_partial(path)
+            return self._fetch_once(url, path, start, end)
+        if response.status == 200 and 'Range' in headers:
+            if end is not None or start != 0:
+                connection.close()
+                if validator is not None:
+                    remove_partial(path)
+                    raise RuntimeError('{}: changed during download'.format(url))
+                raise RuntimeError('{}: server does not support ranges'.format(url))
+            have = 0  # restart whole file
+        elif response.status not in (200, 206):
+            connection.close()
+            raise RuntimeError('{}: HTTP {}'.format(url, response.status))
+        if have == 0:
+            save_validator(path, response_validator(response))
+
+        length = response.getheader('Content-Length')
+        expected = int(length) if length else None
+        received = 0
+        try:
+            with open(path, 'ab' if have > 0 else 'wb') as f:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise RetryableError('{}: {}'.format(url, e))
+        if expected is not None and received < expected:
+            connection.close()
+            raise RetryableError('{}: connection dropped after {} of {} bytes'.format(
+                url, received, expected))
+        self.pool.put(parts, connection, response)
+
+    def stream(self, url):
+        """Return file-like object reading url that resumes after drops"""
+        return Stream(self, url)
+
+    def fetch_segments(self, url, path, size, validator=None):
+        """Download size bytes of url in parallel ranges into path.
+        Segments left by previous attempt are dropped unless they were
+        started for the same validator"""
+        count = max(1, min(self.segments, size // self.segment_size))
+        step = size // count
+        bounds = [(i * step, size if i == count - 1 else (i + 1) * step)
+                  for i in range(count)]
+        names = ['{}.{}'.format(path, i) for i in range(count)]
+        for name in names:
+            if validator is None or load_validator(name) != validator:
+                remove_partial(name)
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            list(pool.map(lambda i: self.fetch_range(url, names[i], *bounds[i]),
+                          range(count)))
+        with open(path, 'wb') as out:
+            for name in names:
+                with open(name, 'rb') as f:
+                    shutil.copyfileobj(f, out, chunk_size)
+        for name in names:
+            remove_partial(name)
+
+    def fetch(self, url, out, force=False, size=None, md5=None, sha256=None):
+        print('>> Downloading', url, 'as', out)
+        if not force and os.path.exists(out):
+            error = check(out, size, md5, sha256)
+            if error is None:
+                print('>>', out, 'already exists')
+                return
+            print('>>', out, 'is outdated:', error)
+            os.remove(out)
+        out_path = os.path.dirname(out)
+        if len(out_path) > 0:
+            os.makedirs(out_path, exist_ok=True)
+
+        part = out + '.part'
+        if force:
+            remove_partial(part)
+        start = time.perf_counter()
+        segmented = False
+        if self.segments > 1 and not os.path.exists(part):
+            total, ranges, validator = self.probe(url)
+            if ranges and total is not None and total >= 2 * self.segment_size:
+                self.fetch_segments(url, part, total, validator)
+                segmented = True
+        if not segmented:
+            self.fetch_range(url, part)
+
+        error = check(part, size, md5, sha256)
+        if error is not None:
+            remove_partial(part)
+            raise RuntimeError('Downloaded {} is corrupted: {}'.format(url, error))
+        os.replace(part, out)
+        remove_partial(part)
+        elapsed = time.perf_counter() - start
+        print('>> Downloaded', out, '{:.1f} Mb in {:.1f}s'.format(
+            os.path.getsize(out) / 1024 / 1024, elapsed))
+
+    def fetch_all(self, items, fetch=None):
+        """Download [(url, out) or {'url', 'out', ...fetch() args}] in parallel.
+        Items are passed to fetch if given instead of self.fetch"""
+        fetch = fetch or self.fetch
+
+        def fetch_item(item):
+            if isinstance(item, dict):
+                fetch(**item)
+            else:
+                fetch(*item)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            for _ in pool.map(fetch_item, items):
+                pass
+
+
+class Stream:
+    """Readable url contents. Dropped connection is reopened with a Range
+    request from the current position. Tracks md5 of read data"""
+
+    def __init__(self, loader, url):
+        self.loader = loader
+        self.url = url
+        self.position = 0
+        self.validator = None
+        self.hash = hashlib.md5()
+        self.response = None
+        self.connection = None
+        self.parts = None
+
+    def _open(self):
+        headers = {}
+        if self.position:
+            headers['Range'] = 'bytes={}-'.format(self.position)
+            if self.validator is not None:
+                headers['If-Range'] = self.validator
+        response, connection, parts = self.loader.open(self.url, headers)
+        if response.status != (206 if self.position else 200):
+            connection.close()
+            raise RuntimeError('{}: HTTP {}, can not continue from {}'.format(
+                self.url, response.status, self.position))
+        if not self.position:
+            self.validator = response_validator(response)
+        self.response, self.connection, self.parts = response, connection, parts
+
+    def _read_once(self, size):
+        if self.response is None:
+            self._open()
+        expected = self.response.length
+        try:
+            data = self.response.read(size)
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise RetryableError('{}: {}'.format(self.url, e))
+        if not data and expected:
+            self.close()
+            raise RetryableError('{}: connection dropped at {}'.format(
+                self.url, self.position))
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(chunk_size), b''))
+        data = self.loader.retry(self.url, lambda: self._read_once(size))
+        self.position += len(data)
+        self.hash.update(data)
+        return data
+
+    def md5(self):
+        return self.hash.hexdigest()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.response = self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<url> <out> [<md5>]")
+        exit(1)
+
+    Downloader().fetch(sys.argv[1], sys.argv[2],
+                       md5=sys.argv[3] if len(sys.argv) > 3 else None)
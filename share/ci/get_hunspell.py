@@ -1,19 +1,31 @@
 import common as c
-from config import bitness, msvc_version, build_dir, dependencies_dir, build_type
+from config import bitness, msvc_version, dependency_build_dir, dependencies_dir, build_type
+from config import compiler_cache, compiler_cache_dir
+import artifacts
 import os
 import platform
 
 c.print('>> Installing hunspell')
 
 install_dir = dependencies_dir
+build_dir = os.path.join(dependency_build_dir, 'hunspell')
 url = 'https://github.com/hunspell/hunspell/files/2573619/hunspell-1.7.0.tar.gz'
 required_version = '1.7.0'
 
 
 build_type_flag = 'Debug' if build_type == 'debug' else 'Release'
 
+# artifact key includes MSVC toolset version from its environment
+if platform.system() == "Windows":
+    env_cmd = c.get_msvc_env_cmd(bitness=bitness, msvc_version=msvc_version)
+    c.apply_cmd_env(env_cmd)
+
 cache_file = install_dir + '/hunspell.cache'
-cache_file_data = required_version + build_type_flag
+# artifact key of all build inputs. cmake project is generated by this script
+cache_file_data = artifacts.make_key('hunspell', {
+    'url': url, 'build_type': build_type_flag, 'bitness': bitness,
+    'compiler': artifacts.compiler_id(msvc_version),
+    'recipe': artifacts.file_digest(__file__)})
 
 
 def check_existing():
@@ -62,16 +74,20 @@ if check_existing():
     c.print('>> Using cached')
     exit(0)
 
-archive = os.path.basename(url)
-c.download(url, archive)
+if artifacts.restore(cache_file_data, install_dir):
+    with open(cache_file, 'w') as f:
+        f.write(cache_file_data)
+    if check_existing():
+        c.print('>> Restored from artifact cache')
+        exit(0)
 
+archive = os.path.basename(url)
 src_dir = os.path.abspath('hunspell_src')
-c.extract(archive, '.')
-c.symlink(c.get_archive_top_dir(archive), src_dir)
+c.symlink(c.download_and_extract(url, '.', archive), src_dir)
 
 c.ensure_got_path(install_dir)
 
-c.recreate_dir(build_dir)
+c.prepare_build_dir(build_dir, {'key': cache_file_data})
 os.chdir(build_dir)
 
 c.set_make_threaded()
@@ -113,16 +129,16 @@ DESTINATION lib/pkgconfig)\n')
 cmake_args = '"{}" -DCMAKE_INSTALL_PREFIX="{}" {}'.format(
     build_dir, install_dir, c.get_cmake_arch_args(bitness=bitness))
 
-if platform.system() == "Windows":
-    env_cmd = c.get_msvc_env_cmd(bitness=bitness, msvc_version=msvc_version)
-    c.apply_cmd_env(env_cmd)
-
 c.set_make_threaded()
+launcher = c.setup_compiler_cache(compiler_cache, compiler_cache_dir)
+cmake_args += ' ' + c.get_cmake_launcher_args(launcher)
 c.run('cmake {}'.format(cmake_args))
 build_type_flag = 'Debug' if build_type == 'debug' else 'Release'
 c.run('cmake --build . --config {}'.format(build_type_flag))
 c.run('cmake --build . --target install --config {}'.format(build_type_flag))
 
+artifacts.store(cache_file_data, install_dir, artifacts.installed_files(build_dir))
+
 with open(cache_file, 'w') as f:
     f.write(cache_file_data)
 
@@ -1,7 +1,11 @@
 import common as c
 from config import qt_modules, qt_version, qt_dir, os_name
+import os
 import sys
+import time
+import jobs
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 c.print('>> Downloading Qt {} ({}) for {}'.format(
     qt_version, qt_modules, os_name))
@@ -56,14 +60,51 @@ if len(sys.argv) > 1:  # handle subcommand
             c.print(k, '---', all_modules[k]['file'])
     exit(0)
 
+
+def fetch(module):
+    file_name = all_modules[module]['file']
+    package = all_modules[module]['package']
+    started = time.perf_counter()
+    c.download(base_url + '/' + package + '/' + file_name, file_name)
+    timings[module] = {'download': time.perf_counter() - started,
+                       'downloaded': time.perf_counter()}
+    return module
+
+
+def extract(module):
+    started = time.perf_counter()
+    timings[module]['wait'] = started - timings[module]['downloaded']
+    c.extract(all_modules[module]['file'], '.')
+    timings[module]['extract'] = time.perf_counter() - started
+
+
+# archives are extracted as soon as downloaded while others still download.
+# extraction is disk bound so EXTRACT_WORKERS is kept low by default
+download_workers = c.loader.workers
+extract_workers = int(os.getenv('EXTRACT_WORKERS',
+                                min(4, jobs.cpu_count())))
+timings = {}
+started = time.perf_counter()
+available = []
 for module in qt_modules:
     if module not in all_modules:
         c.print('>> Required module {} not available'.format(module))
         continue
-    file_name = all_modules[module]['file']
-    package = all_modules[module]['package']
-    c.download(base_url + '/' + package + '/' + file_name, file_name)
-    c.extract(file_name, '.')
+    available.append(module)
+
+with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+        ThreadPoolExecutor(max_workers=extract_workers) as extractions:
+    extracted = [extractions.submit(extract, f.result())
+                 for f in as_completed([downloads.submit(fetch, m) for m in available])]
+    for f in extracted:
+        f.result()
+
+c.print('>> Qt modules timing ({} download, {} extract workers), total {:.1f}s:'.format(
+    download_workers, extract_workers, time.perf_counter() - started))
+for module in available:
+    t = timings[module]
+    c.print('   {:16} download {:6.1f}s  queued {:6.1f}s  extract {:6.1f}s'.format(
+        module, t['download'], t['wait'], t['extract']))
 
 c.symlink(qt_dir_prefix, qt_dir)
 
@@ -1,18 +1,47 @@
 import common as c
-from config import bitness, msvc_version, build_dir, dependencies_dir, build_type
+from config import bitness, msvc_version, dependency_build_dir, dependencies_dir, build_type
+from config import compiler_cache, compiler_cache_dir
+import artifacts
 import os
 import platform
 
 c.print('>> Installing tesseract')
 
 install_dir = dependencies_dir
+build_dir = os.path.join(dependency_build_dir, 'tesseract')
 required_version = '5.2.0'
 url = 'https://github.com/tesseract-ocr/tesseract/archive/{}.tar.gz'.format(required_version)
 
 build_type_flag = 'Debug' if build_type == 'debug' else 'Release'
 
+cmake_flags = '-DSW_BUILD=OFF \
+-DBUILD_TRAINING_TOOLS=OFF \
+-DBUILD_TESTS=OFF \
+-DBUILD_SHARED_LIBS=ON \
+-DDISABLE_CURL=ON \
+-DDISABLE_ARCHIVE=ON \
+-DUSE_SYSTEM_ICU=ON \
+-DENABLE_LTO=ON \
+-DGRAPHICS_DISABLED=ON \
+-DDISABLED_LEGACY_ENGINE=ON'
+
+leptonica_key = ''
+if os.path.exists(install_dir + '/leptonica.cache'):
+    with open(install_dir + '/leptonica.cache', 'r') as f:
+        leptonica_key = f.read()
+
+# artifact key includes MSVC toolset version from its environment
+if platform.system() == "Windows":
+    env_cmd = c.get_msvc_env_cmd(bitness=bitness, msvc_version=msvc_version)
+    c.apply_cmd_env(env_cmd)
+
 cache_file = install_dir + '/tesseract.cache'
-cache_file_data = required_version + build_type_flag
+# artifact key of all build inputs
+cache_file_data = artifacts.make_key('tesseract', {
+    'url': url, 'build_type': build_type_flag, 'flags': cmake_flags,
+    'leptonica': leptonica_key, 'bitness': bitness,
+    'compiler': artifacts.compiler_id(msvc_version),
+    'recipe': artifacts.file_digest(__file__)})
 
 def check_existing():
     if not os.path.exists(cache_file):
@@ -52,44 +81,42 @@ if check_existing() and not 'FORCE' in os.environ:
     c.print('>> Using cached')
     exit(0)
 
-archive = 'tesseract-' + os.path.basename(url)
-c.download(url, archive)
+if not 'FORCE' in os.environ and artifacts.restore(cache_file_data, install_dir):
+    with open(cache_file, 'w') as f:
+        f.write(cache_file_data)
+    if check_existing():
+        c.print('>> Restored from artifact cache')
+        exit(0)
 
+archive = 'tesseract-' + os.path.basename(url)
 src_dir = os.path.abspath('tesseract_src')
-c.extract(archive, '.')
-c.symlink(c.get_archive_top_dir(archive), src_dir)
+c.symlink(c.download_and_extract(url, '.', archive), src_dir)
 
 c.ensure_got_path(install_dir)
 
-c.recreate_dir(build_dir)
+c.prepare_build_dir(build_dir, {'key': cache_file_data})
 os.chdir(build_dir)
 
 cmake_args = '"{0}" \
 -DCMAKE_INSTALL_PREFIX="{1}" \
 -DLeptonica_DIR="{1}/cmake" \
--DSW_BUILD=OFF \
--DBUILD_TRAINING_TOOLS=OFF \
--DBUILD_TESTS=OFF \
--DBUILD_SHARED_LIBS=ON \
--DDISABLE_CURL=ON \
--DDISABLE_ARCHIVE=ON \
--DUSE_SYSTEM_ICU=ON \
--DENABLE_LTO=ON \
--DGRAPHICS_DISABLED=ON \
--DDISABLED_LEGACY_ENGINE=ON \
-'.format(src_dir, install_dir)
+{2}'.format(src_dir, install_dir, cmake_flags)
 
 if platform.system() == "Windows":
-    env_cmd = c.get_msvc_env_cmd(bitness=bitness, msvc_version=msvc_version)
-    c.apply_cmd_env(env_cmd)
     cmake_args += ' ' + c.get_cmake_arch_args(bitness=bitness)
 
-c.set_make_threaded()
+# LTO link of libtesseract takes several Gb
+link_jobs = c.set_make_threaded(compile_mb=1024, link_mb=3072)
+cmake_args += ' ' + c.get_cmake_job_pool_args(link_jobs)
+launcher = c.setup_compiler_cache(compiler_cache, compiler_cache_dir)
+cmake_args += ' ' + c.get_cmake_launcher_args(launcher)
 c.run('cmake {}'.format(cmake_args))
 
 c.run('cmake --build . --config {}'.format(build_type_flag))
 c.run('cmake --build . --target install --config {}'.format(build_type_flag))
 
+artifacts.store(cache_file_data, install_dir, artifacts.installed_files(build_dir))
+
 with open(cache_file, 'w') as f:
     f.write(cache_file_data)
 
@@ -0,0 +1,167 @@
+import sys
+import os
+import json
+import shlex
+import shutil
+import functools
+import subprocess as sub
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+print = functools.partial(print, flush=True)
+
+# test is a regression if it got slower by this ratio and at least min_delta seconds
+regression_ratio = 1.5
+min_delta = 0.05
+
+
+def _command(binary):
+    if isinstance(binary, (list, tuple)):
+        if os.name == 'nt':
+            return sub.list2cmdline(binary)
+        return ' '.join(shlex.quote(a) for a in binary)
+    return '"{}"'.format(binary)
+
+
+def run_shard(binary, index, total, xml_path, work_dir):
+    """Run one gtest shard writing its xml report. Return (exit code, output).
+    Shard runs in its own empty work_dir: tests create relative fixtures"""
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    env = dict(os.environ, GTEST_TOTAL_SHARDS=str(total),
+               GTEST_SHARD_INDEX=str(index), GTEST_OUTPUT='xml:' + xml_path)
+    try:
+        result = tracing.call(_command(binary), cwd=work_dir, env=env,
+                              stdout=sub.PIPE, stderr=sub.STDOUT,
+                              universal_newlines=True, errors='replace')
+        return 0, result.stdout
+    except sub.CalledProcessError as e:
+        return e.returncode, e.output
+
+
+def parse(xml_path, binary_name):
+    """Return [{name, time, failed, binary}] of test cases from gtest xml"""
+    cases = []
+    for case in ET.parse(xml_path).getroot().iter('testcase'):
+        if case.get('status', 'run') != 'run' or case.get('result') == 'skipped':
+            continue
+        failures = [f.get('message', '') for f in case.findall('failure')]
+        cases.append({'name': case.get('classname') + '.' + case.get('name'),
+                      'time': float(case.get('time', '0')),
+                      'failed': len(failures) > 0, 'message': '\n'.join(failures),
+                      'binary': binary_name})
+    return cases
+
+
+def run(binary, shards, report_dir):
+    """Run gtest binary split into shards processes. Return (ok, test cases).
+    Crashed shard fails the run even if its report is missing"""
+    name = os.path.basename(binary if isinstance(binary, str) else binary[-1])
+    report_dir = os.path.abspath(report_dir)
+    os.makedirs(report_dir, exist_ok=True)
+    paths = [os.path.join(report_dir, '{}-shard{}.xml'.format(name, i))
+             for i in range(shards)]
+    work_dirs = [os.path.join(report_dir, '{}-shard{}'.format(name, i))
+                 for i in range(shards)]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    print('>> Running', name, 'in', shards, 'shards')
+    with ThreadPoolExecutor(max_workers=shards) as pool:
+        results = list(pool.map(
+            lambda i: run_shard(binary, i, shards, paths[i], work_dirs[i]),
+            range(shards)))
+    ok = True
+    cases = []
+    for i, (code, output) in enumerate(results):
+        if code != 0:
+            ok = False
+            print('[{} {}/{}] failed with code {}'.format(name, i, shards, code))
+            for line in output.rstrip('\n').split('\n'):
+                print('[{} {}/{}] {}'.format(name, i, shards, line))
+        if os.path.exists(paths[i]):
+            cases += parse(paths[i], name)
+        else:
+            ok = False
+            print('>> No report from shard', i, 'of', name)
+    return ok, cases
+
+
+def write_junit(cases, path):
+    """Write merged JUnit xml with a suite per test binary"""
+    root = ET.Element('testsuites', tests=str(len(cases)),
+                      failures=str(sum(c['failed'] for c in cases)),
+                      time='{:.3f}'.format(sum(c['time'] for c in cases)))
+    for binary in sorted({c['binary'] for c in cases}):
+        own = [c for c in cases if c['binary'] == binary]
+        suite = ET.SubElement(root, 'testsuite', name=binary, tests=str(len(own)),
+                              failures=str(sum(c['failed'] for c in own)),
+                              time='{:.3f}'.format(sum(c['time'] for c in own)))
+        for case in sorted(own, key=lambda c: c['name']):
+            classname, _, name = case['name'].partition('.')
+            element = ET.SubElement(suite, 'testcase', classname=classname,
+                                    name=name, time='{:.3f}'.format(case['time']))
+            if case['failed']:
+                ET.SubElement(element, 'failure', message=case['message'][:200]).text = \
+                    case['message']
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def timings(cases):
+    return {c['binary'] + ':' + c['name']: c['time'] for c in cases}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(cases, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(timings(cases), f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def regressions(cases, baseline):
+    """Return [(test, baseline time, current time)] of tests that got slower"""
+    result = []
+    for name, time in sorted(timings(cases).items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if time > before * regression_ratio and time - before > min_delta:
+            result.append((name, before, time))
+    return result
+
+
+def summary(cases, baseline=None, top=5):
+    """Return text with slowest tests and regressions against baseline"""
+    failed = [c for c in cases if c['failed']]
+    lines = ['>> {} tests, {} failed, {:.2f}s total'.format(
+        len(cases), len(failed), sum(c['time'] for c in cases))]
+    for case in failed:
+        lines.append('   FAILED {}:{}'.format(case['binary'], case['name']))
+    lines.append('>> Slowest tests:')
+    for case in sorted(cases, key=lambda c: -c['time'])[:top]:
+        lines.append('   {:8.3f}s {}:{}'.format(case['time'], case['binary'], case['name']))
+    if baseline is not None:
+        slower = regressions(cases, baseline)
+        lines.append('>> Timing regressions against baseline: {}'.format(
+            len(slower) if slower else 'none'))
+        for name, before, time in slower:
+            lines.append('   {:8.3f}s -> {:8.3f}s {}'.format(before, time, name))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<gtest binary> <shards> [<report dir>]")
+        exit(1)
+
+    ok, cases = run(sys.argv[1], int(sys.argv[2]),
+                    sys.argv[3] if len(sys.argv) > 3 else 'test-reports')
+    print(summary(cases))
+    exit(0 if ok else 1)
@@ -0,0 +1,148 @@
+import os
+import math
+import multiprocessing
+
+cgroup_root = '/sys/fs/cgroup'
+proc_cgroup = '/proc/self/cgroup'
+meminfo = '/proc/meminfo'
+
+# default memory cost of one job in Mb
+compile_mb = 512
+link_mb = 1024
+# part of available memory left for page cache and tools
+reserve = 0.1
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _own_paths(proc):
+    """Return {controller: cgroup path} of current process, '' is cgroup v2"""
+    result = {}
+    for line in (_read(proc) or '').split('\n'):
+        parts = line.split(':', 2)
+        if len(parts) == 3:
+            for controller in parts[1].split(','):
+                result[controller] = parts[2].lstrip('/')
+    return result
+
+
+def _dirs(base, path):
+    """Return directories from the cgroup of process up to base. Inside
+    containers own path is not mounted, then base itself is the cgroup"""
+    result = []
+    while True:
+        result.append(os.path.join(base, path) if path else base)
+        if not path:
+            return result
+        path = os.path.dirname(path)
+
+
+def _v1_base(root, controller):
+    for name in os.listdir(root) if os.path.isdir(root) else []:
+        if controller in name.split(','):
+            return os.path.join(root, name)
+    return None
+
+
+def cgroup_cpus(root=cgroup_root, proc=proc_cgroup):
+    """Return cpu quota of current cgroup as a number of cpus or None"""
+    paths = _own_paths(proc)
+    limits = []
+    for dir in _dirs(root, paths.get('', '')):
+        value = _read(os.path.join(dir, 'cpu.max'))  # v2: "<quota> <period>"
+        if value is not None and not value.startswith('max'):
+            quota, period = value.split()
+            limits.append(int(quota) / int(period))
+    base = _v1_base(root, 'cpu')
+    if base is not None:
+        for dir in _dirs(base, paths.get('cpu', '')):
+            quota = _read(os.path.join(dir, 'cpu.cfs_quota_us'))
+            period = _read(os.path.join(dir, 'cpu.cfs_period_us'))
+            if quota is not None and period is not None and int(quota) > 0:
+                limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def _inactive_file(stat, key):
+    for line in (stat or '').split('\n'):
+        name, _, value = line.partition(' ')
+        if name == key:
+            return int(value)
+    return 0
+
+
+def cgroup_memory(root=cgroup_root, proc=proc_cgroup):
+    """Return memory in bytes that current cgroup may still use or None.
+    Inactive page cache is counted as available, it is reclaimed first"""
+    paths = _own_paths(proc)
+    available = []
+    for dir in _dirs(root, paths.get('', '')):
+        limit = _read(os.path.join(dir, 'memory.max'))
+        if limit is None or limit == 'max':
+            continue
+        used = int(_read(os.path.join(dir, 'memory.current')) or 0)
+        used -= _inactive_file(_read(os.path.join(dir, 'memory.stat')), 'inactive_file')
+        available.append(int(limit) - max(used, 0))
+    base = _v1_base(root, 'memory')
+    if base is not None:
+        for dir in _dirs(base, paths.get('memory', '')):
+            limit = _read(os.path.join(dir, 'memory.limit_in_bytes'))
+            if limit is None or int(limit) >= 1 << 60:  # no limit
+                continue
+            used = int(_read(os.path.join(dir, 'memory.usage_in_bytes')) or 0)
+            used -= _inactive_file(_read(os.path.join(dir, 'memory.stat')),
+                                   'total_inactive_file')
+            available.append(int(limit) - max(used, 0))
+    return max(0, min(available)) if available else None
+
+
+def host_memory(path=meminfo):
+    """Return MemAvailable of /proc/meminfo in bytes or None"""
+    for line in (_read(path) or '').split('\n'):
+        if line.startswith('MemAvailable:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def available_memory_mb(root=cgroup_root, proc=proc_cgroup, info=meminfo):
+    values = [v for v in (cgroup_memory(root, proc), host_memory(info))
+              if v is not None]
+    return min(values) / 1024 / 1024 if values else None
+
+
+def cpu_count(root=cgroup_root, proc=proc_cgroup):
+    """Return cpus usable by current process respecting affinity and quota"""
+    count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+        else multiprocessing.cpu_count()
+    quota = cgroup_cpus(root, proc)
+    if quota is not None:
+        count = min(count, max(1, math.ceil(quota)))
+    return count
+
+
+def plan(cpus, memory_mb, compile_cost=compile_mb, link_cost=link_mb):
+    """Return (jobs, link jobs): as many jobs as cpus and memory_mb allow
+    while link jobs running among compile jobs still fit. None memory means
+    no limit. Link limit takes effect with generators having job pools"""
+    if memory_mb is None:
+        return cpus, cpus
+    budget = memory_mb * (1 - reserve)
+    jobs = min(cpus, budget // compile_cost, (budget - link_cost) // compile_cost + 1)
+    jobs = max(1, int(jobs))
+    if link_cost <= compile_cost:
+        return jobs, jobs
+    link_jobs = (budget - jobs * compile_cost) // (link_cost - compile_cost)
+    return jobs, max(1, min(jobs, int(link_jobs)))
+
+
+if __name__ == '__main__':
+    cpus = cpu_count()
+    memory = available_memory_mb()
+    print('cpus', cpus, 'quota', cgroup_cpus(), 'memory Mb', memory)
+    print('jobs, link jobs:', plan(cpus, memory))
@@ -0,0 +1,292 @@
+import sys
+import os
+import io
+import gzip
+import time
+import zlib
+import struct
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import collections
+import subprocess as sub
+from shutil import which
+from concurrent.futures import ThreadPoolExecutor
+
+# big files are deflated in chunks of this size, each primed with the tail
+# of the previous one like pigz does. zlib releases the GIL, so threads run
+# in parallel without re-importing deploy scripts in spawned processes
+chunk_size = 4 * 1024 * 1024
+window = 32 * 1024
+level = 6
+# members with these extensions are stored, deflating them gains nothing
+stored_extensions = {'.zip', '.gz', '.tgz', '.xz', '.bz2', '.7z', '.png', '.jpg',
+                     '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.webm', '.woff2'}
+# limits of zip without zip64 records
+zip_max_size = 0xFFFFFFFF - chunk_size
+zip_max_entries = 0xFFFF
+
+local_header = struct.Struct('<4sHHHHHIIIHH')
+central_header = struct.Struct('<4sBBBBHHHHIIIHHHHHII')
+end_of_directory = struct.Struct('<4sHHHHIIH')
+
+
+def arcname(path):
+    """Return member name like zipfile and tarfile make from path"""
+    name = os.path.normpath(os.path.splitdrive(path)[1])
+    while name.startswith(('..' + os.sep, '.' + os.sep)):
+        name = name[len(name.split(os.sep, 1)[0]) + 1:]
+    return name.lstrip(os.sep).replace(os.sep, '/')
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in stored_extensions
+
+
+def _read_chunk(path, offset, length, compress, last):
+    """Return raw data of chunk and its deflated form (None if stored)"""
+    with open(path, 'rb') as f:
+        prime = b''
+        if compress and offset > 0:
+            f.seek(offset - min(offset, window))
+            prime = f.read(min(offset, window))
+        f.seek(offset)
+        data = f.read(length)
+    if not compress:
+        return data, None
+    deflater = zlib.compressobj(level, zlib.DEFLATED, -15, **({'zdict': prime} if prime else {}))
+    return data, deflater.compress(data) + deflater.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _chunks(files):
+    """Yield (path, offset, length, compress, last) tasks"""
+    for path in files:
+        size = os.path.getsize(path)
+        compress = not is_compressed(path)
+        offset = 0
+        while True:
+            length = min(chunk_size, size - offset)
+            last = offset + length >= size
+            yield path, offset, length, compress, last
+            offset += length
+            if last:
+                break
+
+
+def _ordered(pool, tasks, ahead):
+    """Yield (task, result) in task order keeping at most ahead tasks running"""
+    pending = collections.deque()
+    for task in tasks:
+        pending.append((task, pool.submit(_read_chunk, *task)))
+        if len(pending) >= ahead:
+            task, future = pending.popleft()
+            yield task, future.result()
+    while pending:
+        task, future = pending.popleft()
+        yield task, future.result()
+
+
+def _dos_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def write_zip(files, out, workers):
+    """Write standard zip deflating members in parallel"""
+    members = []
+    with open(out, 'wb') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        current = None
+
+        def finish(member):
+            if member['compress'] and member['csize'] >= member['size']:
+                # incompressible after all: rewrite it stored
+                f.seek(member['data_offset'])
+                f.truncate()
+                with open(member['path'], 'rb') as src:
+                    shutil.copyfileobj(src, f)
+                member['compress'] = False
+                member['csize'] = member['size']
+            end = f.tell()
+            f.seek(member['offset'] + 8)
+            f.write(struct.pack('<HHHIII', 8 if member['compress'] else 0,
+                                member['time'], member['date'], member['crc'],
+                                member['csize'], member['size']))
+            f.seek(end)
+
+        for task, (data, deflated) in _ordered(pool, _chunks(files), workers * 4):
+            path, offset, _, compress, _ = task
+            if offset == 0:
+                if current is not None:
+                    finish(current)
+                stat = os.stat(path)
+                name = arcname(path).encode('utf-8')
+                dos_time, dos_date = _dos_time(stat.st_mtime)
+                current = {'path': path, 'name': name, 'offset': f.tell(),
+                           'compress': compress, 'time': dos_time, 'date': dos_date,
+                           'crc': 0, 'csize': 0, 'size': 0,
+                           'flags': 0 if name.isascii() else 0x800,
+                           'mode': stat.st_mode}
+                members.append(current)
+                f.write(local_header.pack(b'PK\x03\x04', 20, current['flags'], 0,
+                                          0, 0, 0, 0, 0, len(name), 0) + name)
+                current['data_offset'] = f.tell()
+            payload = data if deflated is None else deflated
+            f.write(payload)
+            current['crc'] = zlib.crc32(data, current['crc'])
+            current['size'] += len(data)
+            current['csize'] += len(payload)
+        if current is not None:
+            finish(current)
+
+        directory_offset = f.tell()
+        system = 0 if os.name == 'nt' else 3
+        for m in members:
+            f.write(central_header.pack(
+                b'PK\x01\x02', 20, system, 20, 0, m['flags'], 8 if m['compress'] else 0,
+                m['time'], m['date'], m['crc'], m['csize'], m['size'], len(m['name']),
+                0, 0, 0, 0, (m['mode'] & 0xFFFF) << 16, m['offset']) + m['name'])
+        directory_size = f.tell() - directory_offset
+        f.write(end_of_directory.pack(b'PK\x05\x06', 0, 0, len(members), len(members),
+                                      directory_size, directory_offset, 0))
+
+
+class GzipMembers:
+    """Writable stream compressing every chunk into separate gzip member in
+    parallel. Concatenated members are a valid gzip file"""
+
+    def __init__(self, out, workers):
+        self.out = out
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.ahead = workers * 2
+        self.pending = collections.deque()
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        self.buffer.write(data)
+        if self.buffer.tell() >= chunk_size:
+            self._submit()
+        return len(data)
+
+    def _submit(self):
+        data = self.buffer.getvalue()
+        self.buffer = io.BytesIO()
+        self.pending.append(self.pool.submit(gzip.compress, data, level, mtime=0))
+        while len(self.pending) >= self.ahead:
+            self.out.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.buffer.tell() > 0 or not self.pending:
+            self._submit()
+        while self.pending:
+            self.out.write(self.pending.popleft().result())
+        self.pool.shutdown()
+
+
+def write_tar_gz(files, out, workers):
+    with open(out, 'wb') as f:
+        stream = GzipMembers(f, workers)
+        with tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT) as arc:
+            for path in files:
+                arc.add(path, recursive=False)
+        stream.close()
+
+
+def archive(files, out, workers):
+    """Pack files into zip or tar.gz compressing in workers threads"""
+    if out.endswith('.zip'):
+        if len(files) >= zip_max_entries or \
+                sum(os.path.getsize(p) for p in files) >= zip_max_size:
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as arc:  # zip64
+                for path in files:
+                    arc.write(path)
+            return
+        write_zip(files, out, workers)
+        return
+
+    if out.endswith('.tar.gz'):
+        write_tar_gz(files, out, workers)
+        return
+
+    raise RuntimeError('No archiver to create {} file'.format(out))
+
+
+def benchmark(size_mb, workers):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as dir:
+        os.chdir(dir)  # member names are relative like in windeploy.py
+        print('Creating {} Mb tree'.format(size_mb))
+        files = []
+        written = 0
+        i = 0
+        while written < size_mb * 1024 * 1024:
+            kind = i % 4
+            path = os.path.join('deploy', 'dir{}'.format(i % 7),
+                                'file{}{}'.format(i, '.png' if kind == 3 else '.dll'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            size = [20 * 1024 * 1024, 300 * 1024, 4 * 1024, 1024 * 1024][kind]
+            with open(path, 'wb') as f:
+                if kind == 3:
+                    f.write(os.urandom(size))
+                else:  # code-like: compressible but not trivially
+                    words = [os.urandom(8).hex().encode() for _ in range(2000)]
+                    data = b' '.join(words[(j * 7919) % len(words)] for j in range(size // 16))
+                    f.write(data[:size])
+            files.append(path)
+            written += size
+            i += 1
+
+        def measure(name, action, out):
+            start = time.perf_counter()
+            action(out)
+            elapsed = time.perf_counter() - start
+            print('{:24} {:6.2f}s {:7.1f} Mb/s  size {:6.1f} Mb'.format(
+                name, elapsed, written / 1024 / 1024 / elapsed,
+                os.path.getsize(out) / 1024 / 1024))
+
+        def zipfile_serial(out):
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as arc:
+                for path in files:
+                    arc.write(path)
+
+        def tarfile_serial(out):
+            with tarfile.open(out, 'w|gz') as arc:
+                for path in files:
+                    arc.add(path)
+
+        measure('zipfile, 1 thread', zipfile_serial, 'serial.zip')
+        measure('packer zip, {} threads'.format(workers),
+                lambda out: write_zip(files, out, workers), 'parallel.zip')
+        measure('tarfile gz, 1 thread', tarfile_serial, 'serial.tar.gz')
+        measure('packer tar.gz, {} threads'.format(workers),
+                lambda out: write_tar_gz(files, out, workers), 'parallel.tar.gz')
+
+        with zipfile.ZipFile('parallel.zip') as arc:
+            assert arc.testzip() is None
+            assert sorted(arc.namelist()) == sorted(arcname(p) for p in files)
+        with tarfile.open('parallel.tar.gz') as arc:
+            assert sorted(arc.getnames()) == sorted(arcname(p) for p in files)
+        if which('unzip'):
+            sub.run(['unzip', '-tq', 'parallel.zip'], check=True, stdout=sub.DEVNULL)
+        if which('tar'):
+            sub.run(['tar', 'tzf', 'parallel.tar.gz'], check=True, stdout=sub.DEVNULL)
+        print('archives are valid')
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+        benchmark(size, workers)
+        exit(0)
+
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<out.zip|out.tar.gz> <file>... | benchmark [<size_mb> [<threads>]]")
+        exit(1)
+
+    archive(sys.argv[2:], sys.argv[1], os.cpu_count())
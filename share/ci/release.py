@@ -22,22 +22,54 @@ if len(sys.argv) > 1 and sys.argv[1] == 'artifact_name':
     exit(0)
 
 
-def r(script):
-    return subprocess.run([sys.executable, os.path.join(here, script)], check=True)
+import common as c
+from config import compiler_cache
+import scheduler
+import tracing
 
 
-r('get_qt.py')
-r('get_qt_ssl.py')
-r('get_leptonica.py')
-r('get_tesseract.py')
+def step(script, deps=(), cpus=1):
+    env = {tracing.parent_env: script}
+    return scheduler.Step(script, [sys.executable, os.path.join(here, script)],
+                          deps, cpus, env)
 
-r('get_hunspell.py')
-r('test.py')
-r('build.py')
 
-if platform.system() == "Linux":
-    r('appimage.py')
-if platform.system() == "Windows":
-    r('windeploy.py')
-if platform.system() == "Darwin":
-    r('macdeploy.py')
+deps = ['get_qt.py', 'get_qt_ssl.py', 'get_leptonica.py', 'get_tesseract.py',
+        'get_hunspell.py']
+steps = [
+    step('get_qt.py'),
+    step('get_qt_ssl.py'),
+    step('get_leptonica.py', cpus=None),
+    step('get_tesseract.py', ['get_leptonica.py'], cpus=None),
+    step('get_hunspell.py', cpus=None),
+    step('test.py', deps, cpus=None),
+    step('build.py', deps, cpus=None),  # own build dir, runs beside tests
+]
+
+deploy = {'Linux': 'appimage.py', 'Windows': 'windeploy.py',
+          'Darwin': 'macdeploy.py'}.get(platform.system())
+if deploy:
+    steps.append(step(deploy, ['build.py', 'test.py']))
+
+cpu_budget = int(os.getenv('CPU_BUDGET', '0')) or None
+# commands, downloads and extractions of all steps are traced into
+# ST_TRACE_FILE when it is set. Chrome trace is saved next to it
+if tracing.enabled():
+    os.environ[tracing.trace_file_env] = os.path.abspath(
+        os.environ[tracing.trace_file_env])
+    open(os.environ[tracing.trace_file_env], 'w').close()
+c.zero_compiler_cache_stats(compiler_cache)
+try:
+    scheduler.run(steps, cpu_budget)
+finally:
+    print(scheduler.summary(steps), flush=True)
+    if tracing.enabled():
+        trace = os.environ[tracing.trace_file_env]
+        chrome_trace = os.path.splitext(trace)[0] + '.json'
+        print(tracing.report(trace, chrome_trace), flush=True)
+        print('>> Chrome trace saved to', chrome_trace, flush=True)
+    stats = c.compiler_cache_stats(compiler_cache)
+    if stats is not None:
+        hits, misses = stats
+        print('>> Compiler cache: {} hits, {} misses ({:.0f}% hit rate)'.format(
+            hits, misses, 100.0 * hits / max(hits + misses, 1)), flush=True)
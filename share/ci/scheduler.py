@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+import functools
+import subprocess
+import tracing
+import jobs
+
+print = functools.partial(print, flush=True)
+
+
+class Step:
+    """Command to run after its dependencies. cpus=None means as many as allowed"""
+
+    def __init__(self, name, command, deps=(), cpus=1, env=None):
+        self.name = name
+        self.command = command
+        self.deps = list(deps)
+        self.cpus = cpus
+        self.env = env or {}
+        self.allotted = 0
+        self.start = None
+        self.end = None
+        self.started_at = None  # epoch seconds for the trace
+
+
+def _relay(step, stream):
+    for line in iter(stream.readline, ''):
+        print('[{}] {}'.format(step.name, line.rstrip('\n')))
+    stream.close()
+
+
+def _launch(step, cpus, budget):
+    step.allotted = cpus
+    step.start = time.perf_counter()
+    step.started_at = time.time()
+    env = dict(os.environ, **step.env)
+    env['MAKE_JOBS'] = str(cpus)
+    env['MAKE_CPU_BUDGET'] = str(budget)
+    print('>> Starting', step.name, 'with', cpus, 'cpus')
+    proc = subprocess.Popen(step.command, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True,
+                            errors='replace')
+    relay = threading.Thread(target=_relay, args=(step, proc.stdout))
+    relay.start()
+    return proc, relay
+
+
+def run(steps, cpu_budget=None):
+    """Run steps concurrently respecting dependencies and total allotted cpus.
+    Steps ready at the same time share free cpus. Raise RuntimeError on failure"""
+    budget = cpu_budget or jobs.cpu_count()
+    by_name = {s.name: s for s in steps}
+    for step in steps:
+        for dep in step.deps:
+            if not dep in by_name:
+                raise RuntimeError('{} depends on unknown {}'.format(step.name, dep))
+
+    pending = list(steps)
+    running = {}  # step name -> (process, relay thread)
+    done = set()
+    failed = []
+    free = budget
+    while pending or running:
+        if not failed:
+            ready = [s for s in pending if all(d in done for d in s.deps)]
+            ready.sort(key=lambda s: s.cpus is None)  # greedy ones share the rest
+            for i, step in enumerate(ready):
+                if free < 1:
+                    break
+                share = max(1, free // (len(ready) - i))
+                cpus = share if step.cpus is None else min(step.cpus, share)
+                running[step.name] = _launch(step, cpus, budget)
+                pending.remove(step)
+                free -= cpus
+        elif not running:
+            break
+
+        if not running:
+            raise RuntimeError('Dependency cycle among {}'.format(
+                [s.name for s in pending]))
+
+        time.sleep(0.05)
+        for name, (proc, relay) in list(running.items()):
+            usage = tracing.poll(proc)
+            if usage is None:
+                continue
+            relay.join()
+            step = by_name[name]
+            step.end = time.perf_counter()
+            tracing.record('step', name, step.started_at, step.end - step.start,
+                           *usage[1:], status=usage[0])
+            free += step.allotted
+            del running[name]
+            if proc.returncode != 0:
+                print('>> Step', name, 'failed with code', proc.returncode)
+                failed.append(name)
+            else:
+                print('>> Finished', name, 'in {:.1f}s'.format(step.end - step.start))
+                done.add(name)
+
+    if failed:
+        raise RuntimeError('Failed steps: {}'.format(', '.join(failed)))
+
+
+def critical_path(steps):
+    """Return steps chain that defined total time, last one finished last"""
+    finished = [s for s in steps if s.end is not None]
+    if not finished:
+        return []
+    by_name = {s.name: s for s in finished}
+    path = [max(finished, key=lambda s: s.end)]
+    while True:
+        deps = [by_name[d] for d in path[-1].deps if d in by_name]
+        if not deps:
+            break
+        path.append(max(deps, key=lambda s: s.end))
+    return list(reversed(path))
+
+
+def summary(steps):
+    """Return text with per step timings and the critical path"""
+    finished = [s for s in steps if s.end is not None]
+    if not finished:
+        return 'No steps finished'
+    origin = min(s.start for s in finished)
+    total = max(s.end for s in finished) - origin
+    lines = ['>> Step timings:']
+    for step in sorted(finished, key=lambda s: s.start):
+        lines.append('   {:20} start {:7.1f}s  duration {:7.1f}s  cpus {}'.format(
+            step.name, step.start - origin, step.end - step.start, step.allotted))
+    path = critical_path(steps)
+    parts = []
+    previous_end = origin
+    for step in path:
+        waited = step.start - previous_end
+        if waited > 1:
+            parts.append('(waited {:.1f}s for cpus)'.format(waited))
+        parts.append('{} {:.1f}s'.format(step.name, step.end - step.start))
+        previous_end = step.end
+    serial = sum(s.end - s.start for s in finished)
+    lines.append('>> Critical path: ' + ' -> '.join(parts))
+    lines.append('>> Total {:.1f}s, sequential run would take {:.1f}s'.format(
+        total, serial))
+    return '\n'.join(lines)
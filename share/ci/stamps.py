@@ -0,0 +1,173 @@
+import sys
+import os
+import json
+import tarfile
+import zipfile
+import tempfile
+import time
+import subprocess as sub
+from shutil import which
+import digests
+
+stamp_prefix = '.extracted-'
+
+
+def stamp_path(archive, dest):
+    return os.path.join(dest, stamp_prefix + os.path.basename(archive) + '.json')
+
+
+def archive_key(archive):
+    stat = os.stat(archive)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def list_members(archive):
+    """Return names of files (not directories) stored in archive"""
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as arc:
+            return [i.filename for i in arc.infolist() if not i.is_dir()]
+    if tarfile.is_tarfile(archive):
+        with tarfile.open(archive) as arc:
+            return [i.name for i in arc if not i.isdir()]
+    if which('cmake'):
+        out = sub.run(['cmake', '-E', 'tar', 't', archive], check=True,
+                      stdout=sub.PIPE, universal_newlines=True).stdout
+        return [l for l in out.split('\n') if len(l) > 0 and not l.endswith('/')]
+    if which('7z'):
+        out = sub.run(['7z', 'l', '-slt', archive], check=True,
+                      stdout=sub.PIPE, universal_newlines=True).stdout
+        result = []
+        for block in out.split('\n\n'):
+            fields = dict(l.split(' = ', 1) for l in block.split('\n') if ' = ' in l)
+            if 'Path' in fields and 'Size' in fields and \
+                    not 'D' in fields.get('Attributes', ''):
+                result.append(fields['Path'])
+        return result[1:]  # first block describes the archive itself
+    raise RuntimeError('No archiver to list {} file'.format(archive))
+
+
+def file_sizes(dest, members):
+    files = {}
+    for name in members:
+        path = os.path.join(dest, name)
+        if os.path.isdir(path):
+            continue
+        files[name] = os.lstat(path).st_size if os.path.lexists(path) else -1
+    return files
+
+
+def save(archive, dest, stamp):
+    path = stamp_path(archive, dest)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(stamp, f)
+    os.replace(path + '.tmp', path)
+
+
+def write(archive, dest, members=None):
+    """Record archive digest and sizes of its extracted files"""
+    if members is None:
+        members = list_members(archive)
+    save(archive, dest, {'archive': os.path.abspath(archive),
+                         'key': archive_key(archive), 'md5': digests.md5(archive),
+                         'files': file_sizes(dest, members)})
+
+
+def write_streamed(name, url, dest, md5, members):
+    """Record extraction of archive that was never stored on disk"""
+    top = members[0].split('/')[0] if len(members) > 0 else ''
+    save(name, dest, {'url': url, 'md5': md5, 'top': top,
+                      'files': file_sizes(dest, members)})
+
+
+def load(archive, dest):
+    try:
+        with open(stamp_path(archive, dest), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def files_match(stamp, dest):
+    for name, size in stamp['files'].items():
+        path = os.path.join(dest, name)
+        if size < 0 or not os.path.lexists(path) or os.lstat(path).st_size != size:
+            return False
+    return True
+
+
+def is_extracted(archive, dest, verify=False):
+    """Return True if archive was fully extracted to dest. Checks only the
+    stamp unless verify is set, then also sizes of all extracted files"""
+    stamp = load(archive, dest)
+    if stamp is None or stamp.get('key') is None:  # streamed one has no key
+        return False
+    if stamp['key'] != archive_key(archive) and stamp['md5'] != digests.md5(archive):
+        return False
+    return not verify or files_match(stamp, dest)
+
+
+def load_streamed(name, url, dest, verify=False):
+    """Return stamp of archive streamed from url to dest if it is extracted"""
+    stamp = load(name, dest)
+    if stamp is None or stamp.get('url') != url:
+        return None
+    if verify and not files_match(stamp, dest):
+        return None
+    return stamp
+
+
+def benchmark(file_count, file_size_kb):
+    with tempfile.TemporaryDirectory() as dir:
+        archive = os.path.join(dir, 'sample.tar.gz')
+        source = os.path.join(dir, 'source')
+        print('Creating archive with {} files of {} Kb'.format(file_count, file_size_kb))
+        for i in range(file_count):
+            path = os.path.join(source, 'dir{}'.format(i % 50), 'file{}'.format(i))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(file_size_kb * 1024))
+        with tarfile.open(archive, 'w:gz') as arc:
+            arc.add(source, 'sample')
+        dest = os.path.join(dir, 'dest')
+        os.makedirs(dest)
+        with tarfile.open(archive) as arc:
+            arc.extractall(dest)
+        print('archive size {:.1f} Mb'.format(os.path.getsize(archive) / 1024 / 1024))
+
+        def measure(name, check):
+            start = time.perf_counter()
+            result = check()
+            print('{:28} {:8.3f}s -> {}'.format(name, time.perf_counter() - start, result))
+
+        def listing_check():
+            return all(os.path.exists(os.path.join(dest, n))
+                       for n in list_members(archive))
+
+        def cmake_check():  # what common.extract did before stamps
+            out = sub.run(['cmake', '-E', 'tar', 't', archive], check=True,
+                          stdout=sub.PIPE, universal_newlines=True).stdout
+            return all(os.path.exists(os.path.join(dest, n))
+                       for n in out.split('\n') if len(n) > 0)
+
+        if which('cmake'):
+            measure('cmake list and stat all', cmake_check)
+        measure('list archive and stat all', listing_check)
+        measure('write stamp', lambda: write(archive, dest))
+        measure('stamp check', lambda: is_extracted(archive, dest))
+        measure('stamp check with verify', lambda: is_extracted(archive, dest, True))
+        os.remove(os.path.join(dest, 'sample', 'dir7', 'file7'))
+        measure('verify partial tree', lambda: is_extracted(archive, dest, True))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+        size = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+        benchmark(count, size)
+        exit(0)
+
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<archive> <dest> | benchmark [<files> [<size_kb>]]")
+        exit(1)
+
+    print('extracted' if is_extracted(sys.argv[1], sys.argv[2], True) else 'not extracted')
@@ -1,4 +1,7 @@
 import common as c
+import artifacts
+import gtests
+import jobs
 from config import *
 import os
 import platform
@@ -12,14 +15,39 @@ if platform.system() == "Windows":
     env_cmd = c.get_msvc_env_cmd(bitness=bitness, msvc_version=msvc_version)
     c.apply_cmd_env(env_cmd)
 
-c.recreate_dir(build_dir)
-os.chdir(build_dir)
+qmake_flags = os.environ.get('QMAKE_FLAGS', '')
+c.prepare_build_dir(test_build_dir, {
+    'flags': qmake_flags, 'qt': qt_version, 'project': c.md5sum(test_pro_file),
+    'compiler': artifacts.compiler_id(msvc_version)})
+os.chdir(test_build_dir)
 
 c.set_make_threaded()
-c.run('qmake {} "{}"'.format(os.environ.get('QMAKE_FLAGS', ''), test_pro_file))
+launcher = c.setup_compiler_cache(compiler_cache, compiler_cache_dir)
+qmake_flags += ' ' + c.get_qmake_launcher_args(launcher, qmake_flags)
+c.run('qmake {} "{}"'.format(qmake_flags, test_pro_file))
 make_cmd = c.get_make_cmd()
 c.run(make_cmd)
 
+# gtest binaries are split into shards running in parallel
+shards = int(os.getenv('TEST_SHARDS', os.getenv('MAKE_JOBS', jobs.cpu_count())))
+report_dir = os.path.join(test_build_dir, 'test-reports')
+baseline_file = os.getenv('TEST_BASELINE', os.path.join(test_build_dir, 'test-baseline.json'))
+all_ok = True
+cases = []
 for file in glob.glob('./**/tests*', recursive=True):
-    print(file)
-    c.run(file, silent=False)
+    if not os.path.isfile(file) or not os.access(file, os.X_OK):
+        continue
+    if platform.system() == "Windows" and not file.endswith('.exe'):
+        continue
+    ok, file_cases = gtests.run(os.path.abspath(file), shards, report_dir)
+    all_ok = all_ok and ok
+    cases += file_cases
+
+gtests.write_junit(cases, os.path.join(test_build_dir, 'test-results.xml'))
+baseline = gtests.load_baseline(baseline_file)
+print(gtests.summary(cases, baseline))
+if all_ok and (baseline is None or os.getenv('TEST_UPDATE_BASELINE') == '1'):
+    gtests.save_baseline(cases, baseline_file)
+if not all_ok:
+    c.print('>> Tests failed')
+    exit(1)
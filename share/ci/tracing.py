@@ -0,0 +1,163 @@
+import sys
+import os
+import json
+import time
+import threading
+import contextlib
+import subprocess as sub
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# records are appended here as json lines when set, tracing is off otherwise
+trace_file_env = 'ST_TRACE_FILE'
+# name of release.py step that launched current script
+parent_env = 'ST_TRACE_PARENT'
+
+lock = threading.Lock()
+
+
+def enabled():
+    return len(os.environ.get(trace_file_env, '')) > 0
+
+
+def rss_mb(ru_maxrss):
+    # bytes on macOS, kilobytes elsewhere
+    return ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def record(category, name, start, wall, user=None, system=None, rss=None,
+           status=None):
+    """Append record of finished operation. start is epoch seconds"""
+    if not enabled():
+        return
+    entry = {'cat': category, 'name': name, 'start': start, 'wall': wall,
+             'user': user, 'sys': system, 'rss': rss, 'status': status,
+             'step': os.environ.get(parent_env, ''), 'pid': os.getpid(),
+             'tid': threading.get_ident()}
+    line = json.dumps(entry) + '\n'
+    with lock:
+        with open(os.environ[trace_file_env], 'a') as f:
+            f.write(line)
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def poll(proc, block=False):
+    """Reap finished process. Return (exit code, user, sys, peak rss Mb) of
+    it and its waited descendants or None if it is still running"""
+    if not hasattr(os, 'wait4'):  # no rusage on Windows
+        code = proc.wait() if block else proc.poll()
+        return None if code is None else (code, None, None, None)
+    pid, status, usage = os.wait4(proc.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None
+    proc.returncode = _exit_code(status)
+    return (proc.returncode, usage.ru_utime, usage.ru_stime,
+            rss_mb(usage.ru_maxrss))
+
+
+def call(cmd, **kwargs):
+    """subprocess.run(cmd, shell=True, check=True) that records usage.
+    stderr may only be merged into stdout"""
+    start = time.time()
+    started = time.perf_counter()
+    with sub.Popen(cmd, shell=True, **kwargs) as proc:
+        out = proc.stdout.read() if proc.stdout else None
+        code, user, system, rss = poll(proc, block=True)
+    record('run', cmd, start, time.perf_counter() - started, user, system,
+           rss, code)
+    if code != 0:
+        raise sub.CalledProcessError(code, cmd, out)
+    return sub.CompletedProcess(cmd, code, out)
+
+
+@contextlib.contextmanager
+def span(category, name):
+    """Record in-process operation: wall and cpu time of current thread"""
+    start = time.time()
+    started = time.perf_counter()
+    cpu = time.thread_time()
+    status = 0
+    try:
+        yield
+    except BaseException:
+        status = 1
+        raise
+    finally:
+        rss = rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) \
+            if resource else None
+        record(category, name, start, time.perf_counter() - started,
+               time.thread_time() - cpu, None, rss, status)
+
+
+def load(path):
+    with open(path, 'r') as f:
+        return [json.loads(l) for l in f if len(l.strip()) > 0]
+
+
+def to_chrome_trace(records):
+    """Return Chrome trace / Perfetto json with a process lane per release step"""
+    steps = sorted({r['step'] or r['name'] for r in records if r['cat'] == 'step'} |
+                   {r['step'] for r in records if r['cat'] != 'step'})
+    pids = {name: i + 1 for i, name in enumerate(steps)}
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+               'args': {'name': name or 'main'}} for name, pid in pids.items()]
+    origin = min((r['start'] for r in records), default=0)
+    for r in records:
+        lane = r['name'] if r['cat'] == 'step' else r['step']
+        args = {k: r[k] for k in ('user', 'sys', 'rss', 'status') if r[k] is not None}
+        events.append({'name': r['name'], 'cat': r['cat'], 'ph': 'X',
+                       'ts': int((r['start'] - origin) * 1e6),
+                       'dur': int(r['wall'] * 1e6), 'pid': pids[lane],
+                       'tid': 0 if r['cat'] == 'step' else r['tid'] % 100000,
+                       'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def summary(records, top=10):
+    """Return text with the longest and the most memory hungry operations"""
+    ops = [r for r in records if r['cat'] != 'step']
+    lines = ['>> Top {} operations by wall time:'.format(top)]
+
+    def describe(r):
+        cpu = (r['user'] or 0) + (r['sys'] or 0)
+        rss = '{:8.0f} Mb'.format(r['rss']) if r['rss'] is not None else '       ? Mb'
+        return '   {:7.1f}s wall {:7.1f}s cpu {} rss  [{}] {} {}'.format(
+            r['wall'], cpu, rss, r['step'] or 'main', r['cat'], r['name'][:80])
+
+    for r in sorted(ops, key=lambda r: -r['wall'])[:top]:
+        lines.append(describe(r))
+    with_rss = [r for r in ops if r['rss'] is not None and r['cat'] == 'run']
+    if with_rss:
+        lines.append('>> Top {} commands by peak RSS:'.format(top))
+        for r in sorted(with_rss, key=lambda r: -r['rss'])[:top]:
+            lines.append(describe(r))
+    failed = [r for r in ops if r['status']]
+    if failed:
+        lines.append('>> Failed operations:')
+        for r in failed:
+            lines.append(describe(r) + ' -> status {}'.format(r['status']))
+    return '\n'.join(lines)
+
+
+def report(trace_path, chrome_path, top=10):
+    records = load(trace_path)
+    with open(chrome_path, 'w') as f:
+        json.dump(to_chrome_trace(records), f)
+    return summary(records, top)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<trace.jsonl> <chrome_trace.json> [<top>]")
+        exit(1)
+
+    print(report(sys.argv[1], sys.argv[2],
+                 int(sys.argv[3]) if len(sys.argv) > 3 else 10))
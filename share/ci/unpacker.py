@@ -0,0 +1,164 @@
+import sys
+import os
+import struct
+import tarfile
+import time
+import zlib
+
+chunk_size = 1024 * 1024
+tar_modes = {'.tar.gz': 'r|gz', '.tgz': 'r|gz', '.tar.xz': 'r|xz',
+             '.tar.bz2': 'r|bz2', '.tar': 'r|'}
+# keeps permissions like tar/cmake do but refuses paths leaving dest
+tar_filter = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+
+def kind(name):
+    """Return tar stream mode, 'zip' or None if archive can not be streamed"""
+    if name.endswith('.zip'):
+        return 'zip'
+    for suffix, mode in tar_modes.items():
+        if name.endswith(suffix):
+            return mode
+    return None
+
+
+def safe_path(dest, name):
+    """Return destination of archive member or raise for paths leaving dest"""
+    parts = name.replace('\\', '/').split('/')
+    if name.startswith(('/', '\\')) or '..' in parts or ':' in parts[0]:
+        raise RuntimeError('Unsafe path in archive: ' + name)
+    return os.path.join(dest, *[p for p in parts if p])
+
+
+def extract_tar(stream, mode, dest):
+    """Extract tar members sequentially from stream. Return file names"""
+    members = []
+    with tarfile.open(fileobj=stream, mode=mode) as arc:
+        for member in arc:
+            safe_path(dest, member.name)
+            arc.extract(member, dest, **tar_filter)
+            if not member.isdir():
+                members.append(member.name)
+    return members
+
+
+class Reader:
+    """Buffered reads from stream with ability to return unused data"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+
+    def read_some(self):
+        if self.buffer:
+            data, self.buffer = self.buffer, b''
+            return data
+        return self.stream.read(chunk_size)
+
+    def read_exact(self, size):
+        while len(self.buffer) < size:
+            data = self.stream.read(max(chunk_size, size - len(self.buffer)))
+            if not data:
+                raise RuntimeError('Unexpected end of zip stream')
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+
+def _zip64_sizes(extra):
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, size = struct.unpack_from('<HH', extra, pos)
+        if tag == 1 and size >= 16:
+            return struct.unpack_from('<QQ', extra, pos + 4)  # size, compressed
+        pos += 4 + size
+    return None
+
+
+def extract_zip(stream, dest):
+    """Extract zip members using local headers only, so the central
+    directory at the end is never needed. Return file names"""
+    reader = Reader(stream)
+    members = []
+    while True:
+        if reader.read_exact(4) != b'PK\x03\x04':
+            break  # central directory
+        (_, flags, method, dos_time, dos_date, crc, compressed, size, name_size,
+         extra_size) = struct.unpack('<HHHHHIIIHH', reader.read_exact(26))
+        raw_name = reader.read_exact(name_size)
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+        zip64 = _zip64_sizes(reader.read_exact(extra_size))
+        if zip64 is not None:
+            size, compressed = zip64
+        if flags & 0x1:
+            raise RuntimeError('Encrypted zip member ' + name)
+        has_descriptor = flags & 0x8
+        if method not in (0, 8) or (method == 0 and has_descriptor):
+            raise RuntimeError('Unsupported zip member {} (method {})'.format(name, method))
+
+        path = safe_path(dest, name)
+        is_dir = name.endswith('/')
+        if is_dir:
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        actual_crc = 0
+        with open(os.devnull if is_dir else path, 'wb') as f:
+            if method == 8:
+                inflater = zlib.decompressobj(-15)
+                while not inflater.eof:
+                    data = reader.read_some()
+                    if not data:
+                        raise RuntimeError('Unexpected end of zip stream')
+                    out = inflater.decompress(data)
+                    actual_crc = zlib.crc32(out, actual_crc)
+                    f.write(out)
+                reader.unread(inflater.unused_data)
+            else:
+                left = compressed
+                while left > 0:
+                    data = reader.read_exact(min(left, chunk_size))
+                    actual_crc = zlib.crc32(data, actual_crc)
+                    f.write(data)
+                    left -= len(data)
+
+        if has_descriptor:
+            value = reader.read_exact(4)
+            if value == b'PK\x07\x08':
+                value = reader.read_exact(4)
+            crc, = struct.unpack('<I', value)
+            reader.read_exact(16 if zip64 is not None else 8)
+        if actual_crc != crc:
+            raise RuntimeError('CRC mismatch for zip member ' + name)
+        if not is_dir:
+            date_time = ((dos_date >> 9) + 1980, (dos_date >> 5) & 0xF, dos_date & 0x1F,
+                         dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2, 0, 0, -1)
+            mtime = time.mktime(date_time)
+            os.utime(path, (mtime, mtime))
+            members.append(name)
+    return members
+
+
+def extract(stream, name, dest):
+    """Extract archive named name while reading it from stream.
+    Return names of extracted files"""
+    mode = kind(name)
+    if mode is None:
+        raise RuntimeError('No streaming extractor for {} file'.format(name))
+    os.makedirs(dest, exist_ok=True)
+    if mode == 'zip':
+        return extract_zip(stream, dest)
+    return extract_tar(stream, mode, dest)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<archive> <dest>")
+        exit(1)
+
+    with open(sys.argv[1], 'rb') as f:
+        for name in extract(f, sys.argv[1], sys.argv[2]):
+            print(name)
@@ -0,0 +1,166 @@
+import os
+import time
+import hashlib
+import threading
+import functools
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import digests
+
+print = functools.partial(print, flush=True)
+
+part_suffix = '.part'
+block_size = 1024 * 1024
+# tail of partial remote file that must match local one to resume upload
+verify_tail = 1024 * 1024
+# remote file of the same size is compared by md5 of these evenly spaced
+# blocks unless full check is requested
+sample_blocks = 16
+sample_block = 64 * 1024
+
+
+def ensure_dir(sftp, base, path):
+    """Create missing parts of path under base. Return remote dir"""
+    remote = base.rstrip('/')
+    for part in path.split('/'):
+        remote += '/' + part
+        try:
+            sftp.stat(remote)
+        except IOError:
+            sftp.mkdir(remote)
+    return remote + '/'
+
+
+def sample_ranges(size):
+    """Return [(offset, length)] of compared blocks including head and tail"""
+    if size <= sample_blocks * sample_block:
+        return [(0, size)] if size > 0 else []
+    step = (size - sample_block) // (sample_blocks - 1)
+    return [(i * step, sample_block) for i in range(sample_blocks)]
+
+
+def _sample_md5(path, ranges):
+    hash = hashlib.md5()
+    with open(path, 'rb') as f:
+        for offset, length in ranges:
+            f.seek(offset)
+            hash.update(f.read(length))
+    return hash.hexdigest()
+
+
+def remote_matches(sftp, path, local, full=False):
+    """Return True if remote file of the same size has local contents.
+    Uses check-file extension if server has it. Otherwise compares sampled
+    blocks or, if full is set, reads the whole remote file"""
+    with sftp.open(path, 'rb') as f:
+        try:
+            return f.check('md5').hex() == digests.md5(local)
+        except Exception:  # no check-file on OpenSSH
+            pass
+        hash = hashlib.md5()
+        if full:
+            f.prefetch()
+            for data in iter(lambda: f.read(block_size), b''):
+                hash.update(data)
+            return hash.hexdigest() == digests.md5(local)
+        ranges = sample_ranges(os.path.getsize(local))
+        for data in f.readv(ranges):
+            hash.update(data)
+        return hash.hexdigest() == _sample_md5(local, ranges)
+
+
+def _tail_matches(sftp, remote, local, size):
+    length = min(size, verify_tail)
+    with sftp.open(remote, 'rb') as r, open(local, 'rb') as l:
+        r.seek(size - length)
+        l.seek(size - length)
+        return r.read(length) == l.read(length)
+
+
+def upload(sftp, local, remote_dir, existing, full_check=False):
+    """Upload local file unless remote one has the same size and contents,
+    see remote_matches(). existing is {name: size} of remote_dir.
+    Partial upload is resumed. Return 'skipped', 'uploaded' or 'resumed'"""
+    name = os.path.basename(local)
+    target = remote_dir + name
+    part = target + part_suffix
+    size = os.path.getsize(local)
+    if existing.get(name) == size and remote_matches(sftp, target, local, full_check):
+        print('>> File "{}" is already uploaded'.format(name))
+        return 'skipped'
+
+    offset = existing.get(name + part_suffix, 0)
+    if offset > size or (offset > 0 and not _tail_matches(sftp, part, local, offset)):
+        offset = 0
+    print('>> Uploading "{}"'.format(name) +
+          (' from {:.1f} Mb'.format(offset / 1024 / 1024) if offset > 0 else ''))
+    start = time.perf_counter()
+    with open(local, 'rb') as src, sftp.open(part, 'r+b' if offset > 0 else 'wb') as dst:
+        dst.set_pipelined(True)
+        src.seek(offset)
+        dst.seek(offset)
+        while True:
+            data = src.read(block_size)
+            if not data:
+                break
+            dst.write(data)
+    if sftp.stat(part).st_size != size:
+        raise IOError('Uploaded size of "{}" differs'.format(name))
+    if name in existing:
+        sftp.remove(target)
+    sftp.rename(part, target)
+    print('>> Uploaded "{}" {:.1f} Mb in {:.1f}s'.format(
+        name, (size - offset) / 1024 / 1024, time.perf_counter() - start))
+    return 'resumed' if offset > 0 else 'uploaded'
+
+
+def upload_all(ssh, files, remote_dir, workers=3, full_check=False):
+    """Upload files concurrently, each worker has own sftp channel of the
+    same ssh connection. Return {file: upload() result}"""
+    sftp = ssh.open_sftp()
+    existing = {a.filename: a.st_size for a in sftp.listdir_attr(remote_dir)}
+    sftp.close()
+
+    local = threading.local()
+    clients = []
+    lock = threading.Lock()
+
+    def upload_one(f):
+        try:
+            if not hasattr(local, 'sftp'):
+                local.sftp = ssh.open_sftp()
+                with lock:
+                    clients.append(local.sftp)
+            return upload(local.sftp, f, remote_dir, existing, full_check)
+        except IOError:
+            raise
+        except Exception as e:  # e.g. SSHException of channel in worker
+            raise IOError('Upload of "{}" failed: {}'.format(f, e)) from e
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files)))) as pool:
+            return dict(zip(files, pool.map(upload_one, files)))
+    finally:
+        for client in clients:
+            client.close()
+
+
+def update_info(url, data):
+    """PUT file info form data to url. Return True on success"""
+    raw_data = urllib.parse.urlencode(data).encode('utf-8')
+    try:
+        request = urllib.request.Request(
+            url, method='PUT', headers={"Accept": "application/json"}, data=raw_data)
+        with urllib.request.urlopen(request, timeout=60) as r:
+            r.read()
+        print('>> Updated info for "{}" {} {}'.format(url, r.status, r.reason))
+        return True
+    except Exception as e:
+        print('>> Update info for "{}" failed {}'.format(url, e))
+        return False
+
+
+def update_all_info(urls, data, workers=4):
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as pool:
+        return list(pool.map(lambda url: update_info(url, data), urls))
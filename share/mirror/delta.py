@@ -0,0 +1,193 @@
+import sys
+import os
+import struct
+import hashlib
+import random
+import zipped
+
+magic = b'STPATCH1'
+# content defined chunks: boundary is where gear rolling hash of the last
+# bytes has zero top bits, so an insertion moves only its own boundaries
+min_chunk = 64
+max_chunk = 4096
+boundary_mask = ((1 << 8) - 1) << 56  # 256 bytes average chunk
+_gear_random = random.Random(0x5354)  # same boundaries in every run
+gear = [_gear_random.getrandbits(64) for _ in range(256)]
+# shorter copies are stored as inserts, they are not smaller than their data
+min_copy = 16
+
+
+def boundaries(data):
+    """Yield end offsets of content defined chunks"""
+    size = len(data)
+    start = 0
+    while start < size:
+        end = min(start + max_chunk, size)
+        # hash depends only on the last 64 bytes, skip the rest of min_chunk
+        pos = min(start + max(min_chunk - 64, 0), end)
+        h = 0
+        while pos < end:
+            h = ((h << 1) + gear[data[pos]]) & 0xFFFFFFFFFFFFFFFF
+            pos += 1
+            if h & boundary_mask == 0 and pos - start >= min_chunk:
+                end = pos
+                break
+        yield end
+        start = end
+
+
+def chunks(data):
+    """Yield (offset, chunk) of content defined chunks"""
+    start = 0
+    for end in boundaries(data):
+        yield start, data[start:end]
+        start = end
+
+
+def make(base, target):
+    """Return patch that turns base into target.
+    Format: magic, then ops: b'C' + offset (u64) + length (u32) copies from
+    base, b'I' + length (u32) + data inserts data"""
+    known = {}
+    for offset, chunk in chunks(base):
+        known.setdefault(chunk, offset)
+
+    ops = []  # [kind, offset or data, length]
+    for offset, chunk in chunks(target):
+        last = ops[-1] if ops else None
+        if last and last[0] == b'C':
+            end = last[1] + last[2]
+            if base[end:end + len(chunk)] == chunk:  # repeated chunks
+                last[2] += len(chunk)
+                continue
+        base_offset = known.get(chunk)
+        if base_offset is None:
+            if ops and ops[-1][0] == b'I':
+                ops[-1][1].append(chunk)
+                ops[-1][2] += len(chunk)
+            else:
+                ops.append([b'I', [chunk], len(chunk)])
+            continue
+        ops.append([b'C', base_offset, len(chunk)])
+
+    out = [magic]
+    for kind, value, length in ops:
+        if kind == b'C' and length < min_copy:
+            kind, value = b'I', [base[value:value + length]]
+        if kind == b'C':
+            out.append(b'C' + struct.pack('<QI', value, length))
+        else:
+            out.append(b'I' + struct.pack('<I', length))
+            out.extend(value)
+    return b''.join(out)
+
+
+def apply(base, patch):
+    """Return target restored from base and patch"""
+    if not patch.startswith(magic):
+        raise ValueError('Not a patch')
+    result = []
+    pos = len(magic)
+    while pos < len(patch):
+        kind = patch[pos:pos + 1]
+        if kind == b'C':
+            offset, length = struct.unpack_from('<QI', patch, pos + 1)
+            result.append(base[offset:offset + length])
+            pos += 13
+        elif kind == b'I':
+            length, = struct.unpack_from('<I', patch, pos + 1)
+            result.append(patch[pos + 5:pos + 5 + length])
+            pos += 5 + length
+        else:
+            raise ValueError('Corrupted patch')
+    return b''.join(result)
+
+
+def patch_name(path, base):
+    """Return file name of patch from base contents to current path contents"""
+    return '{}.{}.patch.zip'.format(path, hashlib.md5(base).hexdigest())
+
+
+def _report(kind, revisions):
+    """Print bytes of full downloads and patches over (base, target) pairs"""
+    full_total = 0
+    patch_total = 0
+    for i, (current, revision) in enumerate(revisions):
+        patch = make(current, revision)
+        if apply(current, patch) != revision:
+            print('Patch mismatch at revision', i)
+            exit(1)
+        full = len(zipped.pack('file', revision))
+        packed = len(zipped.pack('patch', patch))
+        print('{} revision {}: full {} bytes, patch {} bytes'.format(kind, i + 1, full, packed))
+        full_total += full
+        patch_total += packed
+    print('{}: full downloads {} bytes, patches {} bytes, saved {:.1f}%'.format(
+        kind, full_total, patch_total, 100.0 * (full_total - patch_total) / full_total))
+
+
+def text_revisions(revisions, lines, changed_lines):
+    """Yield (base, target) of dictionary with changed_lines inserted or removed"""
+    rnd = random.Random(1)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = [''.join(rnd.choice(letters) for _ in range(rnd.randint(3, 12)))
+             for _ in range(lines)]
+    current = ('\n'.join(words) + '\n').encode()
+    for _ in range(revisions):
+        for _ in range(changed_lines):
+            index = rnd.randrange(len(words))
+            if rnd.random() < 0.5:
+                words.insert(index, ''.join(rnd.choice(letters) for _ in range(8)))
+            else:
+                words.pop(index)
+        revision = ('\n'.join(words) + '\n').encode()
+        yield current, revision
+        current = revision
+
+
+def binary_revisions(revisions, size_mb, edits):
+    """Yield (base, target) of incompressible model with edits regions of up
+    to 4 Kb inserted, removed or rewritten, shifting all data after them"""
+    rnd = random.Random(2)
+    current = bytes(rnd.getrandbits(8) for _ in range(size_mb * 1024 * 1024))
+    for _ in range(revisions):
+        revision = bytearray(current)
+        for _ in range(edits):
+            offset = rnd.randrange(len(revision))
+            length = rnd.randint(1, 4096)
+            action = rnd.randrange(3)
+            if action == 0:
+                revision[offset:offset] = rnd.randbytes(length)
+            elif action == 1:
+                del revision[offset:offset + length]
+            else:
+                revision[offset:offset + length] = rnd.randbytes(length)
+        revision = bytes(revision)
+        yield current, revision
+        current = revision
+
+
+def simulate(revisions, lines=200000, changed_lines=100, size_mb=12, edits=20):
+    """Compare bytes of full downloads and patches over dictionary and
+    binary model revisions"""
+    _report('text', text_revisions(revisions, lines, changed_lines))
+    _report('binary', binary_revisions(revisions, size_mb, edits))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'simulate':
+        revisions = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        size_mb = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+        simulate(revisions, size_mb=size_mb)
+        exit(0)
+
+    if len(sys.argv) < 4:
+        print("Usage:", sys.argv[0], "<base> <target> <patch> | simulate [<revisions> [<model_mb>]]")
+        exit(1)
+
+    with open(sys.argv[1], 'rb') as f:
+        base = f.read()
+    with open(sys.argv[2], 'rb') as f:
+        target = f.read()
+    with open(sys.argv[3], 'wb') as f:
+        f.write(zipped.pack(os.path.basename(sys.argv[3]), make(base, target)))
@@ -1,30 +1,5 @@
 #!/bin/sh
 
-pack() {
-  mkdir -p "$2"
-  for f in $(ls $1); do
-    source="$1/$f"
-    target="$2/$f"
-    if [ -d "$source" ]; then
-      pack "$source" "$target"
-    elif [ -f "$source" ]; then
-      if [ "$target.zip" -nt "$source" ]; then
-        echo "$source is up to date"
-        continue
-      fi
-      tmp=/tmp/archive.zip
-      echo "packing $source -> $tmp"
-      ls -l "$source"
-      zip -9 -j "$tmp" "$source"
-
-      echo "moving $tmp -> $target.zip"
-      mv "$tmp" "$target.zip"
-      chmod 444 "$target.zip"
-      ls -l "$target.zip"
-    fi
-  done
-}
-
 mirror() {
   cur="$(pwd)"
   url="$1"
@@ -40,7 +15,7 @@ mirror() {
     git clone --depth=1 --single-branch "$url" $git_dir
   fi
   echo "packing"
-  pack "$git_dir" "$pack_dir"
+  python3 /pack.py "$git_dir" "$pack_dir"
 }
 
 while true; do
@@ -0,0 +1,151 @@
+import sys
+import os
+import glob
+import json
+import shutil
+import subprocess
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import delta
+import zipped
+
+state_name = '.pack-state.json'
+
+
+def git(git_dir, *args):
+    return subprocess.run(['git', '-c', 'core.quotepath=off'] + list(args),
+                          cwd=git_dir, check=True, universal_newlines=True,
+                          stdout=subprocess.PIPE).stdout
+
+
+def list_blobs(git_dir, ref):
+    """Return {path: (blob id, size)} of all files in ref"""
+    result = {}
+    for line in git(git_dir, 'ls-tree', '-r', '-l', '-z', ref).split('\0'):
+        if len(line) == 0:
+            continue
+        meta, path = line.split('\t', 1)
+        _, kind, object_id, size = meta.split()
+        if kind == 'blob':
+            result[path] = (object_id, int(size))
+    return result
+
+
+def pack_blob(git_dir, object_id, path, target):
+    """Stream blob into zip with single deflated member named as the file.
+    Equivalent of `zip -9 -j`"""
+    tmp = target + '.tmp'
+    if os.path.exists(tmp):  # left by interrupted run
+        os.remove(tmp)
+    proc = subprocess.Popen(['git', 'cat-file', 'blob', object_id], cwd=git_dir,
+                            stdout=subprocess.PIPE)
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as arc:
+        with arc.open(zipped.member(os.path.basename(path)), 'w') as dst:
+            shutil.copyfileobj(proc.stdout, dst, 1024 * 1024)
+    if proc.wait() != 0:
+        os.remove(tmp)
+        raise RuntimeError('Failed to read {} ({})'.format(path, object_id))
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, target)
+    return path
+
+
+def remove_patches(target):
+    for patch in glob.glob(glob.escape(target[:-len('.zip')]) + '.*.patch.zip'):
+        os.remove(patch)
+
+
+def make_patch(git_dir, base_id, object_id, path, target):
+    """Write patch from previously published blob to the current one.
+    Skip it when base is no longer available or patch is not smaller"""
+    def read(object_id):
+        return subprocess.run(['git', 'cat-file', 'blob', object_id], cwd=git_dir,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+
+    base = read(base_id)
+    if len(base) == 0:
+        return None
+    name = os.path.basename(path)
+    packed = zipped.pack(name, delta.make(base, read(object_id)))
+    if len(packed) >= os.path.getsize(target) // 2:
+        return None
+    patch = os.path.join(os.path.dirname(target), delta.patch_name(name, base))
+    zipped.replace(patch, packed, 0o444)
+    return patch
+
+
+def _pack_blob(args):
+    git_dir, object_id, path, target, base_id = args
+    remove_patches(target)
+    pack_blob(git_dir, object_id, path, target)
+    if base_id is not None:
+        make_patch(git_dir, base_id, object_id, path, target)
+    return path
+
+
+def load_state(pack_dir):
+    try:
+        with open(os.path.join(pack_dir, state_name), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'tree': '', 'blobs': {}}
+
+
+def save_state(pack_dir, state):
+    path = os.path.join(pack_dir, state_name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def pack(git_dir, pack_dir, ref=None, workers=None):
+    if ref is None:
+        has_fetched = os.path.exists(os.path.join(git_dir, '.git', 'FETCH_HEAD'))
+        ref = 'FETCH_HEAD' if has_fetched else 'HEAD'
+    os.makedirs(pack_dir, exist_ok=True)
+    state = load_state(pack_dir)
+
+    tree = git(git_dir, 'rev-parse', ref + '^{tree}').strip()
+    if tree == state['tree']:
+        print('tree', tree, 'is already packed')
+        return
+
+    blobs = list_blobs(git_dir, ref)
+    packed = state['blobs']
+    jobs = []
+    # big files first to keep all workers busy till the end
+    for path, (object_id, _) in sorted(blobs.items(), key=lambda i: -i[1][1]):
+        target = os.path.join(pack_dir, path + '.zip')
+        if packed.get(path) == object_id and os.path.exists(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # clients with previously published version download only a patch
+        base_id = packed.get(path) if os.path.exists(target) else None
+        jobs.append((git_dir, object_id, path, target, base_id))
+
+    for path in packed.keys() - blobs.keys():
+        target = os.path.join(pack_dir, path + '.zip')
+        print('removing', target)
+        remove_patches(target)
+        if os.path.exists(target):
+            os.remove(target)
+
+    print('packing', len(jobs), 'of', len(blobs), 'files')
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path in pool.map(_pack_blob, jobs):
+            print('packed', path)
+            packed[path] = blobs[path][0]
+            # progress survives interruption
+            save_state(pack_dir, {'tree': '', 'blobs': packed})
+
+    packed = {p: o for p, o in packed.items() if p in blobs}
+    save_state(pack_dir, {'tree': tree, 'blobs': packed})
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<git_dir> <pack_dir> [<ref>]")
+        exit(1)
+
+    pack(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
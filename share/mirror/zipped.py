@@ -0,0 +1,38 @@
+import os
+import io
+import zipfile
+
+# fixed member time makes archives of the same data byte identical
+member_time = (1980, 1, 1, 0, 0, 0)
+
+
+def member(name, level=9):
+    """Return info of deflated member with fixed time"""
+    info = zipfile.ZipInfo(name, date_time=member_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    # ZipFile.open() does not apply compresslevel of the archive to given info
+    info._compresslevel = level
+    return info
+
+
+def pack(name, data):
+    """Return zip archive with single deflated member. Same data gives same bytes"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as arc:
+        arc.writestr(member(name), data)
+    return buffer.getvalue()
+
+
+def replace(path, data, mode=None):
+    """Replace file contents atomically. Return False if contents are the same"""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    if mode is not None:
+        os.chmod(tmp, mode)
+    os.replace(tmp, path)
+    return True
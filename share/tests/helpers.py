@@ -0,0 +1,123 @@
+"""Shared parts of share/ci, share/updates and share/mirror tests"""
+import os
+import sys
+import time
+import hashlib
+import threading
+import email.utils
+import http.server
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for name in ('ci', 'updates', 'mirror'):
+    if os.path.join(root, name) not in sys.path:
+        sys.path.append(os.path.join(root, name))
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_PUT(self):
+        stand_in = self.server.stand_in
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        stand_in.puts.append((self.path, body))
+        stand_in.files[self.path] = body
+        self.send_response(201)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        stand_in.requests.append((self.path, self.headers.get('Range')))
+        if self.path.startswith('/redirect/'):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect'):])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        path = self.path
+        if path.startswith('/slow/'):
+            time.sleep(stand_in.latency)
+            path = path[len('/slow'):]
+        data = stand_in.files.get(path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        modified = email.utils.formatdate(stand_in.modified, usegmt=True)
+        start, end = 0, len(data)
+        requested = self.headers.get('Range')
+        if self.headers.get('If-Range') not in (None, etag, modified):
+            requested = None
+        if requested and stand_in.ranges:
+            first, _, last = requested[len('bytes='):].partition('-')
+            start = int(first)
+            end = min(int(last) + 1, len(data)) if last else len(data)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        if stand_in.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', modified)
+        self.end_headers()
+
+        drops = stand_in.drops.get(path)
+        limit = drops.pop(0) if drops else None
+        pos = start
+        while pos < end:
+            if limit is not None and pos - start >= limit:
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            step = min(64 * 1024, end - pos)
+            if limit is not None:
+                step = min(step, start + limit - pos)
+            try:
+                self.wfile.write(data[pos:pos + step])
+            except ConnectionError:  # client gave up on the response
+                return
+            pos += step
+            if stand_in.delay > 0:
+                time.sleep(stand_in.delay)
+
+
+class StandIn:
+    """Local http server for tests. Serves files (url path -> bytes) with
+    Range, If-Range, ETag and Last-Modified, stores PUT requests into files.
+    /redirect/<path> redirects to /<path>, /slow/<path> answers after latency
+    seconds, drops lists bytes to send before dropping each connection"""
+
+    def __init__(self):
+        self.files = {}
+        self.reset()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.stand_in = self
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self):
+        self.drops = {}
+        self.delay = 0.0  # seconds per 64 Kb
+        self.latency = 0.5
+        self.ranges = True
+        self.validators = True
+        self.modified = time.time()
+        self.requests = []
+        self.puts = []
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
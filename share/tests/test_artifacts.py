@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import StandIn
+import artifacts
+
+
+class ArtifactsTest(unittest.TestCase):
+    def setUp(self):
+        self.stand_in = StandIn()
+        self.addCleanup(self.stand_in.close)
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        patcher = mock.patch.dict(os.environ, {'ST_ARTIFACT_URL': self.stand_in.url,
+                                               'ST_ARTIFACT_UPLOAD': '1'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_depends_on_inputs(self):
+        compiler = artifacts.compiler_id()
+        self.assertNotEqual(artifacts.make_key('sample', {'flags': '-DX=1', 'compiler': compiler}),
+                            artifacts.make_key('sample', {'flags': '-DX=2', 'compiler': compiler}))
+
+    def test_store_and_restore_from_remote(self):
+        install = os.path.join(self.dir, 'install')
+        os.makedirs(os.path.join(install, 'lib'))
+        lib = os.path.join(install, 'lib', 'libsample.so.1')
+        with open(lib, 'wb') as f:
+            f.write(os.urandom(100000))
+        link = os.path.join(install, 'lib', 'libsample.so')
+        os.symlink('libsample.so.1', link)
+
+        key = artifacts.make_key('sample', {'flags': '-DX=1',
+                                            'compiler': artifacts.compiler_id()})
+        local = os.path.join(self.dir, 'local')
+        self.assertFalse(artifacts.restore(key, install, local))
+        artifacts.store(key, install, [lib, link], local)
+        self.assertIn('/' + key + '.tar.gz', self.stand_in.files)
+
+        # another runner with empty local cache gets it from remote
+        other = os.path.join(self.dir, 'other')
+        self.assertTrue(artifacts.restore(key, other, os.path.join(self.dir, 'other-local')))
+        self.assertTrue(os.path.islink(os.path.join(other, 'lib', 'libsample.so')))
+        with open(lib, 'rb') as a, open(os.path.join(other, 'lib', 'libsample.so.1'), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import helpers  # noqa: F401
+import common as c
+
+
+class PrepareBuildDirTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.path = os.path.join(temp.name, 'build')
+        self.inputs = {'flags': '-O2', 'compiler': 'gcc 12'}
+        patcher = mock.patch.dict(os.environ, {'CLEAN_BUILD': ''})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self):
+        with open(os.path.join(self.path, 'result.o'), 'w') as f:
+            f.write('object')
+
+    def built(self):
+        return os.path.exists(os.path.join(self.path, 'result.o'))
+
+    def test_reuse_with_same_inputs(self):
+        self.assertFalse(c.prepare_build_dir(self.path, self.inputs))
+        self.build()
+        self.assertTrue(c.prepare_build_dir(self.path, self.inputs))
+        self.assertTrue(self.built())
+
+    def test_clean_when_inputs_change(self):
+        c.prepare_build_dir(self.path, self.inputs)
+        self.build()
+        self.assertFalse(c.prepare_build_dir(self.path, dict(self.inputs, flags='-O0')))
+        self.assertFalse(self.built())
+
+    def test_truncated_stamp_means_no_previous_build(self):
+        c.prepare_build_dir(self.path, self.inputs)
+        self.build()
+        with open(os.path.join(self.path, '.build-inputs.json'), 'w') as f:
+            f.write('{"flags": "-O')
+        self.assertFalse(c.prepare_build_dir(self.path, self.inputs))
+        self.assertFalse(self.built())
+        self.assertTrue(c.prepare_build_dir(self.path, self.inputs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import hashlib
+import tempfile
+import unittest
+
+from helpers import StandIn
+import downloader
+from downloader import Downloader
+
+
+class DownloaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rnd = random.Random(1)
+        cls.small = bytes(rnd.getrandbits(8) for _ in range(300 * 1024))
+        cls.big = os.urandom(4 * 1024 * 1024)
+        cls.stand_in = StandIn()
+        cls.base = cls.stand_in.url
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stand_in.close()
+
+    def setUp(self):
+        self.stand_in.reset()
+        self.stand_in.files = {'/small': self.small, '/big': self.big}
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as f:
+            f.write(data)
+
+    def ranges(self):
+        return [r for _, r in self.stand_in.requests]
+
+    def test_redirected_download_with_checksum(self):
+        Downloader(backoff=0).fetch(self.base + '/redirect/small', self.path('small'),
+                                    md5=hashlib.md5(self.small).hexdigest())
+        self.assertEqual(self.read('small'), self.small)
+        self.assertFalse(os.path.exists(self.path('small.part.validator')))
+
+    def test_resume_after_dropped_connections(self):
+        self.stand_in.drops = {'/big': [100 * 1024, 1000 * 1024]}
+        Downloader(backoff=0).fetch(self.base + '/big', self.path('big'),
+                                    size=len(self.big))
+        self.assertEqual(self.read('big'), self.big)
+        self.assertEqual(self.ranges(), [None, 'bytes=102400-', 'bytes=1126400-'])
+
+    def test_resume_partial_file_of_same_version(self):
+        loader = Downloader(backoff=0, retries=0)
+        self.stand_in.drops = {'/big': [100 * 1024]}
+        with self.assertRaises(RuntimeError):
+            loader.fetch(self.base + '/big', self.path('big'))
+        self.stand_in.requests = []
+        loader.fetch(self.base + '/big', self.path('big'), size=len(self.big))
+        self.assertEqual(self.read('big'), self.big)
+        self.assertEqual(self.ranges(), ['bytes=102400-'])
+
+    def test_restart_partial_file_of_changed_version(self):
+        loader = Downloader(backoff=0, retries=0)
+        self.stand_in.drops = {'/big': [100 * 1024]}
+        with self.assertRaises(RuntimeError):
+            loader.fetch(self.base + '/big', self.path('big'))
+        changed = os.urandom(len(self.big))
+        self.stand_in.files['/big'] = changed
+        self.stand_in.modified += 60
+        self.stand_in.requests = []
+        loader.fetch(self.base + '/big', self.path('big'), size=len(changed))
+        self.assertEqual(self.read('big'), changed)
+        self.assertEqual(self.ranges(), ['bytes=102400-'])
+
+    def test_restart_stale_longer_partial_file(self):
+        self.write('small.part', self.small + b'stale tail')
+        downloader.save_validator(self.path('small.part'), '"stale"')
+        self.stand_in.validators = False
+        Downloader(backoff=0).fetch(self.base + '/small', self.path('small'))
+        self.assertEqual(self.read('small'), self.small)
+
+    def test_restart_on_unsatisfiable_range(self):
+        self.write('small.part', self.small + b'stale tail')
+        downloader.save_validator(self.path('small.part'),
+                                  '"{}"'.format(hashlib.md5(self.small).hexdigest()))
+        Downloader(backoff=0).fetch(self.base + '/small', self.path('small'))
+        self.assertEqual(self.read('small'), self.small)
+        self.assertEqual(self.ranges(), ['bytes={}-'.format(len(self.small) + 10), None])
+
+    def test_partial_file_without_validator_is_restarted(self):
+        self.write('small.part', b'x' * 1000)
+        Downloader(backoff=0).fetch(self.base + '/small', self.path('small'))
+        self.assertEqual(self.read('small'), self.small)
+        self.assertEqual(self.ranges(), [None])
+
+    def test_restart_without_range_support(self):
+        self.stand_in.ranges = False
+        self.stand_in.drops = {'/small': [1000]}
+        Downloader(backoff=0).fetch(self.base + '/small', self.path('small'),
+                                    size=len(self.small))
+        self.assertEqual(self.read('small'), self.small)
+
+    def test_segmented_download_with_drops(self):
+        self.stand_in.drops = {'/big': [0, 50 * 1024]}
+        self.stand_in.delay = 0.001
+        loader = Downloader(segments=4, segment_size=512 * 1024, backoff=0)
+        loader.fetch(self.base + '/big', self.path('big'),
+                     sha256=hashlib.sha256(self.big).hexdigest())
+        self.assertEqual(self.read('big'), self.big)
+        self.assertGreaterEqual(len(self.stand_in.requests), 5)
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ['big'])
+
+    def test_stale_segments_are_dropped(self):
+        self.write('big.part.0', b'x' * 1000)
+        downloader.save_validator(self.path('big.part.0'), '"stale"')
+        loader = Downloader(segments=4, segment_size=512 * 1024, backoff=0)
+        loader.fetch(self.base + '/big', self.path('big'), size=len(self.big))
+        self.assertEqual(self.read('big'), self.big)
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(RuntimeError):
+            Downloader(backoff=0).fetch(self.base + '/small', self.path('small'),
+                                        md5='0' * 32)
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_stream_resumes_after_dropped_connections(self):
+        self.stand_in.drops = {'/big': [100 * 1024, 0, 1000 * 1024]}
+        with Downloader(backoff=0).stream(self.base + '/redirect/big') as stream:
+            data = b''.join(iter(lambda: stream.read(64 * 1024), b''))
+            self.assertEqual(data, self.big)
+            self.assertEqual(stream.md5(), hashlib.md5(self.big).hexdigest())
+
+    def test_stream_reads_to_end_without_size(self):
+        self.stand_in.drops = {'/big': [100 * 1024]}
+        with Downloader(backoff=0).stream(self.base + '/big') as stream:
+            self.assertEqual(stream.read(10), self.big[:10])
+            self.assertEqual(stream.read(), self.big[10:])
+            self.assertEqual(stream.read(), b'')
+            self.assertEqual(stream.md5(), hashlib.md5(self.big).hexdigest())
+
+    def test_stream_fails_if_file_changes(self):
+        self.stand_in.drops = {'/big': [100 * 1024]}
+        with Downloader(backoff=0).stream(self.base + '/big') as stream:
+            stream.read(64 * 1024)
+            self.stand_in.files['/big'] = os.urandom(len(self.big))
+            with self.assertRaises(RuntimeError):
+                b''.join(iter(lambda: stream.read(64 * 1024), b''))
+
+    def test_bounded_concurrency(self):
+        self.stand_in.delay = 0.01
+        items = [(self.base + '/small', self.path(str(i))) for i in range(8)]
+        started = time.perf_counter()
+        Downloader(workers=4, backoff=0).fetch_all(items)
+        parallel = time.perf_counter() - started
+        items = [(self.base + '/small', self.path('s' + str(i))) for i in range(8)]
+        started = time.perf_counter()
+        Downloader(workers=1, backoff=0).fetch_all(items)
+        serial = time.perf_counter() - started
+        self.assertLess(parallel, serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import helpers  # noqa: F401
+import gtests
+
+# stand-in for gtest binary: honors sharding variables, writes xml report and
+# creates relative fixture that must not be shared with other shards
+fake_gtest = '''
+import os, sys, time
+tests = [('Suite', 'Fast{}'.format(i), 0.0) for i in range(6)] + [('Suite', 'Slow', 0.3)]
+tests.append(('Other', 'Fails', 0.0))
+index, total = int(os.environ['GTEST_SHARD_INDEX']), int(os.environ['GTEST_TOTAL_SHARDS'])
+own = [t for i, t in enumerate(tests) if i % total == index]
+failed = False
+os.makedirs('test', exist_ok=True)
+try:
+    open('test/to1.txt', 'x').close()
+    shared = False
+except FileExistsError:
+    shared = True
+with open(os.environ['GTEST_OUTPUT'][4:], 'w') as f:
+    f.write('<testsuites>')
+    for suite, name, duration in own:
+        start = time.perf_counter()
+        time.sleep(duration)
+        f.write('<testsuite name="{0}"><testcase name="{1}" status="run" '
+                'result="completed" time="{2:.3f}" classname="{0}">'.format(
+                    suite, name, time.perf_counter() - start))
+        if name == 'Fails' or shared:
+            failed = True
+            f.write('<failure message="expected 1 == 2"/>')
+        f.write('</testcase></testsuite>')
+    f.write('</testsuites>')
+print('shard', index, 'ran', len(own))
+sys.exit(1 if failed else 0)
+'''
+
+
+class GtestsTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        script = os.path.join(self.dir, 'tests.py')
+        with open(script, 'w') as f:
+            f.write(fake_gtest)
+        self.ok, self.cases = gtests.run([sys.executable, script], 3,
+                                         os.path.join(self.dir, 'reports'))
+
+    def test_shards_run_every_test_once(self):
+        self.assertFalse(self.ok)
+        self.assertEqual(len(self.cases), 8)
+        self.assertEqual(len({c['name'] for c in self.cases}), 8, 'shards overlap')
+        self.assertEqual([c['name'] for c in self.cases if c['failed']], ['Other.Fails'])
+
+    def test_junit(self):
+        junit = os.path.join(self.dir, 'junit.xml')
+        gtests.write_junit(self.cases, junit)
+        root = ET.parse(junit).getroot()
+        self.assertEqual(root.get('tests'), '8')
+        self.assertEqual(root.get('failures'), '1')
+
+    def test_regressions(self):
+        baseline = os.path.join(self.dir, 'baseline.json')
+        gtests.save_baseline(self.cases, baseline)
+        stored = gtests.load_baseline(baseline)
+        stored['tests.py:Suite.Fast1'] = 0.0
+        stored['tests.py:Suite.Slow'] = 0.1
+        text = gtests.summary(self.cases, stored)
+        self.assertIn('tests.py:Suite.Slow', text.split('Slowest tests:')[1].split('\n')[1])
+        self.assertEqual([r[0] for r in gtests.regressions(self.cases, stored)],
+                         ['tests.py:Suite.Slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+import helpers  # noqa: F401
+import jobs
+
+gb = 1024 * 1024 * 1024
+
+
+class CgroupTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        self.info = self.write('meminfo', 'MemTotal: 65536000 kB\nMemAvailable: 33554432 kB\n')
+
+    def write(self, path, text):
+        path = os.path.join(self.dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_host_memory(self):
+        self.assertEqual(jobs.host_memory(self.info), 32 * gb)
+
+    def test_v2_in_container(self):
+        # own cgroup is mounted as the root
+        proc = self.write('proc', '0::/\n')
+        self.write('v2/cpu.max', '250000 100000\n')
+        self.write('v2/memory.max', str(4 * gb))
+        self.write('v2/memory.current', str(2 * gb))
+        self.write('v2/memory.stat', 'anon 1\ninactive_file {}\n'.format(gb))
+        v2 = os.path.join(self.dir, 'v2')
+        self.assertEqual(jobs.cgroup_cpus(v2, proc), 2.5)
+        self.assertLessEqual(jobs.cpu_count(v2, proc), 3)
+        self.assertEqual(jobs.cgroup_memory(v2, proc), 3 * gb)
+        self.assertEqual(jobs.available_memory_mb(v2, proc, self.info), 3 * 1024)
+
+    def test_v2_on_host(self):
+        # limit is set on a parent of own cgroup
+        proc = self.write('proc', '0::/ci.slice/job\n')
+        self.write('host/cpu.max', 'max 100000\n')
+        self.write('host/ci.slice/cpu.max', '400000 100000\n')
+        self.write('host/ci.slice/job/cpu.max', 'max 100000\n')
+        self.write('host/ci.slice/memory.max', str(8 * gb))
+        self.write('host/ci.slice/job/memory.max', 'max')
+        host = os.path.join(self.dir, 'host')
+        self.assertEqual(jobs.cgroup_cpus(host, proc), 4)
+        self.assertEqual(jobs.cgroup_memory(host, proc), 8 * gb)
+
+    def test_v1_in_container(self):
+        proc = self.write('proc', '4:cpu,cpuacct:/docker/abc\n9:memory:/docker/abc\n')
+        self.write('v1/cpu,cpuacct/cpu.cfs_quota_us', '200000')
+        self.write('v1/cpu,cpuacct/cpu.cfs_period_us', '100000')
+        self.write('v1/memory/memory.limit_in_bytes', '9223372036854771712')
+        v1 = os.path.join(self.dir, 'v1')
+        self.assertEqual(jobs.cgroup_cpus(v1, proc), 2)
+        self.assertIsNone(jobs.cgroup_memory(v1, proc), 'memory is unlimited')
+        self.write('v1/memory/memory.limit_in_bytes', str(6 * gb))
+        self.write('v1/memory/memory.usage_in_bytes', str(gb))
+        self.write('v1/memory/memory.stat', 'total_inactive_file 0\n')
+        self.assertEqual(jobs.cgroup_memory(v1, proc), 5 * gb)
+
+    def test_no_cgroups(self):
+        # Windows, macOS
+        none = os.path.join(self.dir, 'none')
+        proc = self.write('proc', '0::/\n')
+        self.assertIsNone(jobs.cgroup_cpus(none, proc))
+        self.assertIsNone(jobs.available_memory_mb(none, proc, none))
+
+
+class PlanTest(unittest.TestCase):
+    def test_plan(self):
+        self.assertEqual(jobs.plan(8, None), (8, 8))
+        self.assertEqual(jobs.plan(8, 64 * 1024), (8, 8))
+        # LTO link of tesseract takes ~3Gb: it fits into 4Gb next to 1 compile
+        self.assertEqual(jobs.plan(8, 4096, 512, 3072), (2, 1))
+        self.assertEqual(jobs.plan(8, 8192, 512, 3072), (8, 1))
+        self.assertEqual(jobs.plan(16, 8192, 512), (13, 1))
+        self.assertEqual(jobs.plan(16, 16384, 512), (16, 12))
+        self.assertEqual(jobs.plan(4, 1024, 2048, 2048), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
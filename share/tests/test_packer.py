@@ -0,0 +1,67 @@
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import helpers  # noqa: F401
+import packer
+
+chunk = 64 * 1024
+text = b''.join(b'symbol_%d = 0x%08x\n' % (i, i * 7919) for i in range(40000))
+
+
+class PackerTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(temp.name)  # member names are relative like in windeploy.py
+        self.addCleanup(os.chdir, cwd)
+        patcher = mock.patch.object(packer, 'chunk_size', chunk)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.contents = {
+            'deploy/empty.txt': b'',
+            'deploy/small.dll': text[:1000],
+            'deploy/big.dll': text,  # spans many chunks
+            'deploy/random.dll': os.urandom(3 * chunk + 17),  # stored after deflate
+            'deploy/image.png': os.urandom(chunk // 2),  # stored by extension
+            'deploy/переводы/файл.qm': text[:5000],
+        }
+        self.assertGreater(len(text), 4 * chunk)
+        for path, data in self.contents.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        self.files = list(self.contents)
+
+    def test_zip_round_trip(self):
+        packer.archive(self.files, 'out.zip', 4)
+        with zipfile.ZipFile('out.zip') as arc:
+            self.assertIsNone(arc.testzip())
+            self.assertEqual(arc.namelist(), self.files)
+            for path, data in self.contents.items():
+                self.assertEqual(arc.read(path), data, path)
+            infos = {i.filename: i for i in arc.infolist()}
+        stored = {n for n, i in infos.items() if i.compress_type == zipfile.ZIP_STORED}
+        self.assertEqual(stored, {'deploy/empty.txt', 'deploy/random.dll',
+                                  'deploy/image.png'})
+        self.assertLess(infos['deploy/big.dll'].compress_size, len(text) // 2)
+
+    def test_tar_gz_round_trip(self):
+        packer.archive(self.files, 'out.tar.gz', 4)
+        with tarfile.open('out.tar.gz') as arc:
+            self.assertEqual(arc.getnames(), self.files)
+            for path, data in self.contents.items():
+                self.assertEqual(arc.extractfile(path).read(), data, path)
+
+    def test_unknown_format(self):
+        with self.assertRaises(RuntimeError):
+            packer.archive(self.files, 'out.rar', 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import sys
+import unittest
+
+import helpers  # noqa: F401
+from scheduler import Step, run, summary, critical_path
+
+
+def sleeper(seconds):
+    return [sys.executable, '-c', 'import time;time.sleep({})'.format(seconds)]
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_critical_path_and_cpu_budget(self):
+        steps = [Step('download', sleeper(0.6)),
+                 Step('lib', sleeper(0.4), cpus=None),
+                 Step('dependent', sleeper(0.4), ['lib'], cpus=None),
+                 Step('independent', sleeper(0.3), cpus=None),
+                 Step('final', sleeper(0.2), ['download', 'dependent', 'independent'],
+                      cpus=None)]
+        run(steps, cpu_budget=4)
+        self.assertIn('Critical path', summary(steps))
+        self.assertEqual([s.name for s in critical_path(steps)],
+                         ['lib', 'dependent', 'final'])
+        by_name = {s.name: s for s in steps}
+        self.assertLess(by_name['independent'].start, by_name['lib'].end)
+        self.assertEqual(by_name['final'].allotted, 4)
+
+    def test_failure_is_reported(self):
+        with self.assertRaises(RuntimeError):
+            run([Step('fail', [sys.executable, '-c', 'exit(1)']),
+                 Step('after', sleeper(0), ['fail'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
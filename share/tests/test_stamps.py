@@ -0,0 +1,43 @@
+import os
+import tarfile
+import tempfile
+import unittest
+
+import helpers  # noqa: F401
+import stamps
+
+
+class StampsTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        source = os.path.join(self.dir, 'source')
+        os.makedirs(source)
+        with open(os.path.join(source, 'file'), 'wb') as f:
+            f.write(os.urandom(1000))
+        self.archive = os.path.join(self.dir, 'sample.tar.gz')
+        with tarfile.open(self.archive, 'w:gz') as arc:
+            arc.add(source, 'sample')
+        self.dest = os.path.join(self.dir, 'dest')
+        with tarfile.open(self.archive) as arc:
+            arc.extractall(self.dest)
+
+    def test_extracted_until_files_change(self):
+        self.assertFalse(stamps.is_extracted(self.archive, self.dest))
+        stamps.write(self.archive, self.dest)
+        self.assertTrue(stamps.is_extracted(self.archive, self.dest, verify=True))
+        os.remove(os.path.join(self.dest, 'sample', 'file'))
+        self.assertTrue(stamps.is_extracted(self.archive, self.dest))
+        self.assertFalse(stamps.is_extracted(self.archive, self.dest, verify=True))
+
+    def test_streamed_stamp_is_not_extracted_archive(self):
+        stamps.write_streamed('sample.tar.gz', 'http://example.com/sample.tar.gz',
+                              self.dest, '0' * 32, ['sample/file'])
+        self.assertFalse(stamps.is_extracted(self.archive, self.dest))
+        self.assertIsNotNone(stamps.load_streamed(
+            'sample.tar.gz', 'http://example.com/sample.tar.gz', self.dest, verify=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import unittest
+import subprocess as sub
+from unittest import mock
+
+import helpers  # noqa: F401
+import tracing
+
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        self.trace = os.path.join(self.dir, 'trace.jsonl')
+        patcher = mock.patch.dict(os.environ, {tracing.trace_file_env: self.trace,
+                                               tracing.parent_env: 'get_sample.py'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_by_default(self):
+        with mock.patch.dict(os.environ):
+            del os.environ[tracing.trace_file_env]
+            self.assertFalse(tracing.enabled())
+            tracing.call('exit 0')
+        self.assertFalse(os.path.exists(self.trace))
+
+    def test_records_and_report(self):
+        out = tracing.call('echo hello', stdout=sub.PIPE, stderr=sub.STDOUT,
+                           universal_newlines=True).stdout
+        self.assertEqual(out.strip(), 'hello')
+        tracing.call('{} -c "x = bytearray(64 * 1024 * 1024); sum(range(3000000))"'.format(
+            sys.executable), stdout=sub.DEVNULL)
+        with self.assertRaises(sub.CalledProcessError) as e:
+            tracing.call('exit 3')
+        self.assertEqual(e.exception.returncode, 3)
+        with tracing.span('download', 'http://example.com/a.zip'):
+            time.sleep(0.1)
+        del os.environ[tracing.parent_env]
+        tracing.record('step', 'get_sample.py', time.time() - 1, 1.0, status=0)
+
+        records = tracing.load(self.trace)
+        self.assertEqual([r['cat'] for r in records],
+                         ['run', 'run', 'run', 'download', 'step'])
+        self.assertTrue(all(r['step'] == 'get_sample.py' for r in records[:4]))
+        hungry = records[1]
+        if hungry['rss'] is not None:
+            self.assertGreater(hungry['rss'], 64)
+            self.assertGreater(hungry['user'] + hungry['sys'], 0)
+        self.assertEqual(records[2]['status'], 3)
+        self.assertGreaterEqual(records[3]['wall'], 0.1)
+
+        chrome = os.path.join(self.dir, 'trace.json')
+        text = tracing.report(self.trace, chrome, 2)
+        with open(chrome, 'r') as f:
+            events = [e for e in json.load(f)['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len({e['pid'] for e in events}), 1,
+                         'commands are not attributed to their step')
+        self.assertEqual(len(events), 5)
+        self.assertIn('exit 3', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
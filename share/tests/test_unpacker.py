@@ -0,0 +1,73 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import helpers  # noqa: F401
+from unpacker import extract
+
+
+class UnpackerTest(unittest.TestCase):
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        self.source = os.path.join(self.dir, 'source')
+        self.expected = {}
+        for i in range(20):
+            rel = os.path.join('top', 'd{}'.format(i % 3), 'f{}'.format(i))
+            data = os.urandom(i * 1000) + b'text' * i * 1000
+            os.makedirs(os.path.join(self.source, os.path.dirname(rel)), exist_ok=True)
+            with open(os.path.join(self.source, rel), 'wb') as f:
+                f.write(data)
+            self.expected[rel] = data
+
+    def check(self, dest, members):
+        self.assertEqual(len(members), len(self.expected))
+        for rel, data in self.expected.items():
+            with open(os.path.join(dest, rel), 'rb') as f:
+                self.assertEqual(f.read(), data, rel)
+
+    def test_tar(self):
+        for suffix, mode in (('.tar.gz', 'w:gz'), ('.tar.xz', 'w:xz')):
+            archive = os.path.join(self.dir, 'a' + suffix)
+            with tarfile.open(archive, mode) as arc:
+                arc.add(os.path.join(self.source, 'top'), 'top')
+            dest = os.path.join(self.dir, 'out' + suffix)
+            with open(archive, 'rb') as f:
+                self.check(dest, extract(f, archive, dest))
+
+    def test_zip(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as arc:
+            for rel in self.expected:
+                arc.write(os.path.join(self.source, rel), rel)
+            arc.writestr('top/empty/', '')
+        dest = os.path.join(self.dir, 'out')
+        self.check(dest, extract(io.BytesIO(archive.getvalue()), 'a.zip', dest))
+
+    def test_zip_with_data_descriptors(self):
+        # data descriptors are written when output is not seekable
+        archive = io.BytesIO()
+        archive.seekable = lambda: False
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as arc:
+            for rel, data in self.expected.items():
+                with arc.open(rel, 'w') as f:
+                    f.write(data)
+        dest = os.path.join(self.dir, 'out')
+        self.check(dest, extract(io.BytesIO(archive.getvalue()), 'a.zip', dest))
+
+    def test_unsafe_path(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as arc:
+            arc.writestr('../evil', 'x')
+        with self.assertRaises(RuntimeError):
+            extract(io.BytesIO(archive.getvalue()), 'evil.zip',
+                    os.path.join(self.dir, 'out'))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'evil')))
+
+
+if __name__ == '__main__':
+    unittest.main()
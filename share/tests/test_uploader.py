@@ -0,0 +1,248 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from unittest import mock
+
+from helpers import StandIn
+import uploader
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+
+if paramiko is not None:
+    class StandInServer(paramiko.ServerInterface):
+        def check_auth_publickey(self, username, key):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return 'publickey'
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    class CountingHandle(paramiko.SFTPHandle):
+        """Counts bytes written and read by clients"""
+        written = []
+        read_bytes = []
+
+        def write(self, offset, data):
+            self.written.append(len(data))
+            return super().write(offset, data)
+
+        def read(self, offset, length):
+            data = super().read(offset, length)
+            if isinstance(data, bytes):
+                self.read_bytes.append(len(data))
+            return data
+
+        def stat(self):
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    class NoCheckFileServer(paramiko.SFTPServer):
+        """Has no check-file extension like OpenSSH"""
+
+        def _check_file(self, request_number, msg):
+            self._send_status(request_number, paramiko.SFTP_OP_UNSUPPORTED)
+
+    class StandInSFTP(paramiko.SFTPServerInterface):
+        """Serves files of root directory"""
+        root = None
+
+        def _path(self, path):
+            return self.root + self.canonicalize(path)
+
+        def _attrs(self, path, name=None):
+            return paramiko.SFTPAttributes.from_stat(os.stat(path), name)
+
+        def list_folder(self, path):
+            path = self._path(path)
+            return [self._attrs(os.path.join(path, n), n) for n in os.listdir(path)]
+
+        def stat(self, path):
+            try:
+                return self._attrs(self._path(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            path = self._path(path)
+            try:
+                fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o644)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            mode = 'rb'
+            if flags & os.O_WRONLY:
+                mode = 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'r+b'
+            handle = CountingHandle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            os.remove(self._path(path))
+            return paramiko.SFTP_OK
+
+        def rename(self, old, new):
+            os.rename(self._path(old), self._path(new))
+            return paramiko.SFTP_OK
+
+        def mkdir(self, path, attr):
+            os.mkdir(self._path(path))
+            return paramiko.SFTP_OK
+
+
+@unittest.skipIf(paramiko is None, 'paramiko is not installed')
+class UploaderTest(unittest.TestCase):
+    size = 1536 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        host_key = paramiko.RSAKey.generate(2048)
+        cls.listener = socket.socket()
+        cls.listener.bind(('127.0.0.1', 0))
+        cls.listener.listen(5)
+
+        def serve():
+            while True:
+                try:
+                    sock, _ = cls.listener.accept()
+                except OSError:
+                    return
+                transport = paramiko.Transport(sock)
+                transport.add_server_key(host_key)
+                transport.set_subsystem_handler('sftp', NoCheckFileServer, StandInSFTP)
+                transport.start_server(server=StandInServer())
+
+        threading.Thread(target=serve, daemon=True).start()
+        cls.client_key = paramiko.RSAKey.generate(2048)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.listener.close()
+
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.dir = temp.name
+        StandInSFTP.root = os.path.join(self.dir, 'remote')
+        os.makedirs(os.path.join(StandInSFTP.root, 'frs'))
+        self.files = []
+        for i in range(3):
+            path = os.path.join(self.dir, 'artifact{}.zip'.format(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(self.size + i))
+            self.files.append(path)
+
+        self.ssh = paramiko.SSHClient()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ssh.connect('127.0.0.1', self.listener.getsockname()[1], username='ci',
+                         pkey=self.client_key, look_for_keys=False, allow_agent=False)
+        self.addCleanup(self.ssh.close)
+        sftp = self.ssh.open_sftp()
+        self.remote_dir = uploader.ensure_dir(sftp, '/frs/', 'bin/v1.0')
+        self.assertEqual(uploader.ensure_dir(sftp, '/frs/', 'bin/v1.0'), self.remote_dir)
+        sftp.close()
+
+        self.assertEqual(set(self.upload().values()), {'uploaded'})
+        for f in self.files:
+            with open(f, 'rb') as l, open(self.remote(f), 'rb') as r:
+                self.assertEqual(l.read(), r.read())
+        del CountingHandle.written[:]
+        del CountingHandle.read_bytes[:]
+
+    def remote(self, local):
+        return StandInSFTP.root + self.remote_dir + os.path.basename(local)
+
+    def upload(self, **kwargs):
+        return uploader.upload_all(self.ssh, self.files, self.remote_dir, **kwargs)
+
+    def change_middle(self, path):
+        # between sampled blocks
+        ranges = uploader.sample_ranges(os.path.getsize(path))
+        offset = ranges[1][0] + uploader.sample_block + 10
+        self.assertLess(offset + 7, ranges[2][0])
+        with open(path, 'r+b') as f:
+            f.seek(offset)
+            f.write(b'changed')
+
+    def test_identical_files_are_skipped_reading_samples(self):
+        result = self.upload()
+        self.assertEqual(set(result.values()), {'skipped'})
+        self.assertFalse(CountingHandle.written)
+        limit = len(self.files) * uploader.sample_blocks * uploader.sample_block
+        self.assertLessEqual(sum(CountingHandle.read_bytes), limit)
+
+    def test_same_size_change_in_sample_is_uploaded(self):
+        with open(self.files[1], 'r+b') as f:
+            f.seek(self.size - 10)
+            f.write(b'changed')
+        result = self.upload()
+        self.assertEqual(result[self.files[1]], 'uploaded')
+        self.assertEqual(result[self.files[0]], 'skipped')
+
+    def test_full_check_reads_whole_file(self):
+        self.change_middle(self.files[1])
+        self.assertEqual(self.upload()[self.files[1]], 'skipped', 'change is not sampled')
+        result = self.upload(full_check=True)
+        self.assertEqual(result[self.files[1]], 'uploaded')
+        self.assertEqual(result[self.files[0]], 'skipped')
+        with open(self.files[1], 'rb') as l, open(self.remote(self.files[1]), 'rb') as r:
+            self.assertEqual(l.read(), r.read())
+
+    def test_resume(self):
+        with open(self.files[1], 'ab') as f:
+            f.write(b'changed')
+        remote = self.remote(self.files[2])
+        with open(self.files[2], 'rb') as l, open(remote + uploader.part_suffix, 'wb') as r:
+            r.write(l.read(self.size // 2))
+        os.remove(remote)
+        result = self.upload()
+        self.assertEqual(result[self.files[1]], 'uploaded')
+        self.assertEqual(result[self.files[2]], 'resumed')
+        self.assertLess(sum(CountingHandle.written), 2 * self.size,
+                        'resumed file is uploaded fully')
+        with open(self.files[2], 'rb') as l, open(remote, 'rb') as r:
+            self.assertEqual(l.read(), r.read())
+
+    def test_channel_error_in_worker_is_io_error(self):
+        open_sftp = self.ssh.open_sftp
+        calls = []
+
+        def failing_open_sftp():
+            calls.append(1)
+            if len(calls) > 1:  # listing channel is fine, worker one fails
+                raise paramiko.SSHException('Unable to open channel.')
+            return open_sftp()
+
+        with mock.patch.object(self.ssh, 'open_sftp', failing_open_sftp):
+            with self.assertRaises(IOError) as error:
+                self.upload()
+        self.assertIsInstance(error.exception.__cause__, paramiko.SSHException)
+
+
+class UpdateInfoTest(unittest.TestCase):
+    def test_update_info(self):
+        stand_in = StandIn()
+        self.addCleanup(stand_in.close)
+        base = stand_in.url + '/files/bin/v1.0/'
+        urls = [base + 'artifact{}.zip'.format(i) for i in range(3)]
+        self.assertTrue(all(uploader.update_all_info(urls, {'api_key': 'key',
+                                                            'default': 'linux'})))
+        self.assertEqual(len(stand_in.puts), 3)
+        path, body = stand_in.puts[0]
+        self.assertEqual(urllib.parse.parse_qs(body.decode())['default'], ['linux'])
+        self.assertFalse(uploader.update_info('http://127.0.0.1:1/none', {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import io
+import os
+import hashlib
+import unittest
+import zipfile
+
+from helpers import StandIn
+import verify
+
+
+class VerifyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_in = StandIn()
+        data = os.urandom(100000)
+        packed = io.BytesIO()
+        with zipfile.ZipFile(packed, 'w', zipfile.ZIP_DEFLATED) as arc:
+            arc.writestr('good.traineddata', data)
+        cls.stand_in.files = {
+            '/good.traineddata': data,
+            '/good.traineddata.zip': packed.getvalue(),
+            '/changed.traineddata': data[:-1] + b'x',
+            '/short.traineddata': data[:1000],
+        }
+        base = cls.stand_in.url + '/'
+
+        def file(urls, date='2020-03-09T08:28:45+01:00'):
+            return {'files': [{'url': [base + u for u in urls], 'path': '$tessdata$/x',
+                               'size': len(data), 'md5': hashlib.md5(data).hexdigest(),
+                               'date': date}]}
+
+        cls.manifest = {'version': 1, 'recognizers': {
+            'Good': file(['good.traineddata', 'good.traineddata.zip']),
+            'Slow': file(['slow/good.traineddata']),
+            'Dead': file(['missing.traineddata']),
+            'Short': file(['short.traineddata']),
+            'Changed': file(['changed.traineddata']),
+            'Future': file(['good.traineddata'], date='2100-01-01T00:00:00+00:00'),
+        }}
+        cls.base = base
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stand_in.close()
+
+    def statuses(self, results):
+        return {r['url'][len(self.base):]: r['status'] for r in results
+                if r['component'] != 'recognizers/Future'}
+
+    def test_headers(self):
+        results = verify.verify(self.manifest, workers=4, slow=self.stand_in.latency / 2)
+        self.assertEqual(self.statuses(results), {
+            'good.traineddata': 'ok',
+            'good.traineddata.zip': 'ok',
+            'slow/good.traineddata': 'slow',
+            'missing.traineddata': 'dead',
+            'short.traineddata': 'mismatch',
+            'changed.traineddata': 'ok',  # same size
+        })
+        self.assertEqual([r['status'] for r in results
+                          if r['component'] == 'recognizers/Future'], ['stale'])
+        self.assertIn('Slowest urls', verify.report(results))
+
+    def test_digests(self):
+        results = verify.verify(self.manifest, workers=4, digests=True, slow=10)
+        statuses = self.statuses(results)
+        self.assertEqual(statuses['good.traineddata.zip'], 'ok')
+        self.assertEqual(statuses['changed.traineddata'], 'mismatch')
+
+
+if __name__ == '__main__':
+    unittest.main()
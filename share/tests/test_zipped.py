@@ -0,0 +1,47 @@
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+import zlib
+
+import helpers  # noqa: F401
+import zipped
+
+data = b''.join(b'line %d of sample dictionary\n' % (i * i % 977) for i in range(20000))
+
+
+def deflated_size(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return len(compressor.compress(data) + compressor.flush())
+
+
+class ZippedTest(unittest.TestCase):
+    def test_pack_is_deterministic(self):
+        packed = zipped.pack('file', data)
+        self.assertEqual(packed, zipped.pack('file', data))
+        with zipfile.ZipFile(io.BytesIO(packed)) as arc:
+            self.assertEqual(arc.read('file'), data)
+            self.assertEqual(arc.infolist()[0].compress_size, deflated_size(9))
+
+    def test_streamed_member_uses_best_compression(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as arc:
+            with arc.open(zipped.member('file'), 'w') as dst:
+                dst.write(data)
+        with zipfile.ZipFile(buffer) as arc:
+            self.assertEqual(arc.infolist()[0].compress_size, deflated_size(9))
+        self.assertNotEqual(deflated_size(9), deflated_size(6))
+
+    def test_replace(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'file')
+            self.assertTrue(zipped.replace(path, b'data', 0o444))
+            self.assertFalse(zipped.replace(path, b'data'))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'data')
+            self.assertFalse(os.path.exists(path + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import json
+import subprocess
+
+
+class EntryCache:
+    """Generated manifest file entries keyed on (path, size, mtime, commit).
+    commit is HEAD of the repository containing the file, so the entry
+    survives new commits that did not touch the file"""
+
+    version = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.heads = {}
+        self.changes = {}
+        self.modified = False
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == EntryCache.version:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def head(self, repo_dir):
+        """Return HEAD commit of given repository or '' if it is not a repository"""
+        if repo_dir not in self.heads:
+            result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+                                    universal_newlines=True, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+            self.heads[repo_dir] = result.stdout.strip() if result.returncode == 0 else ''
+        return self.heads[repo_dir]
+
+    def _changed(self, repo_dir, old_head):
+        """Return set of files changed since old_head or None if unknown (e.g. shallow clone)"""
+        key = (repo_dir, old_head)
+        if key not in self.changes:
+            git_cmd = ['git', '-c', 'core.quotepath=off', 'diff', '--name-only',
+                       '--relative', old_head, 'HEAD']
+            result = subprocess.run(git_cmd, cwd=repo_dir, universal_newlines=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            if result.returncode != 0:
+                self.changes[key] = None
+            else:
+                self.changes[key] = set(result.stdout.splitlines())
+        return self.changes[key]
+
+    def _key(self, repo_dir, file_name):
+        path = os.path.join(repo_dir, file_name)
+        stat = os.stat(path)
+        return os.path.abspath(path), [stat.st_size, stat.st_mtime_ns, self.head(repo_dir)]
+
+    def get(self, repo_dir, file_name):
+        """Return cached entry for file_name inside repo_dir or None"""
+        path, key = self._key(repo_dir, file_name)
+        cached = self.entries.get(path)
+        if cached is None or cached['key'][:2] != key[:2]:
+            return None
+        if cached['key'][2] != key[2]:
+            old_head = cached['key'][2]
+            if len(old_head) == 0 or len(key[2]) == 0:
+                return None
+            changed = self._changed(repo_dir, old_head)
+            if changed is None or file_name.replace(os.sep, '/') in changed:
+                return None
+            cached['key'] = key
+            self.modified = True
+        return cached['entry']
+
+    def put(self, repo_dir, file_name, entry):
+        path, key = self._key(repo_dir, file_name)
+        self.entries[path] = {'key': key, 'entry': entry}
+        self.modified = True
+
+    def save(self):
+        if self.path is None or not self.modified:
+            return
+        dir = os.path.dirname(self.path)
+        if len(dir) > 0:
+            os.makedirs(dir, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': EntryCache.version, 'entries': self.entries}, f)
+        os.replace(tmp, self.path)
+        self.modified = False
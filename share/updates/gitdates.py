@@ -0,0 +1,123 @@
+import sys
+import os
+import subprocess
+import tempfile
+import time
+
+
+class CommitDates:
+    """Map of file path (relative to given dir) to last commit date (%cI).
+    Built with a single `git log --name-only` walk instead of a
+    `git log -1 <file>` call per file"""
+
+    def __init__(self, repo_dir, paths=None):
+        self.repo_dir = repo_dir
+        self.dates = {}
+        self._load(paths)
+
+    def _load(self, paths):
+        wanted = set(paths) if paths is not None else None
+        git_cmd = ['git', '-c', 'core.quotepath=off', 'log', '--relative',
+                   '--name-only', '--pretty=format:>%cI']
+        proc = subprocess.Popen(git_cmd, cwd=self.repo_dir, universal_newlines=True,
+                                stdout=subprocess.PIPE)
+        date = ''
+        try:
+            for line in proc.stdout:
+                line = line.rstrip('\n')
+                if len(line) == 0:
+                    continue
+                if line.startswith('>'):
+                    date = line[1:]
+                    continue
+                if line in self.dates:  # newer commit already seen
+                    continue
+                self.dates[line] = date
+                if wanted is not None:
+                    wanted.discard(line)
+                    if len(wanted) == 0:  # no need to walk further
+                        break
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.terminate()
+            code = proc.wait()
+        if code > 0 and (wanted is None or len(wanted) > 0):
+            raise subprocess.CalledProcessError(code, git_cmd)
+
+    def get(self, path, default=''):
+        return self.dates.get(path.replace(os.sep, '/'), default)
+
+    def __getitem__(self, path):
+        return self.get(path)
+
+    def __contains__(self, path):
+        return path.replace(os.sep, '/') in self.dates
+
+
+def single_commit_date(repo_dir, path):
+    """Previous approach: separate history walk per file"""
+    git_cmd = ['git', 'log', '-1', '--pretty=format:%cI', path]
+    return subprocess.run(git_cmd, cwd=repo_dir, universal_newlines=True,
+                          stdout=subprocess.PIPE, check=True).stdout
+
+
+def make_synthetic_repo(path, commit_count, file_count):
+    """Create repo with commit_count commits, each touching a few of file_count files"""
+    subprocess.run(['git', 'init', '-q', path], check=True)
+    stream = []
+    for i in range(commit_count):
+        stream.append('commit refs/heads/master')
+        stream.append('committer Bench <bench@example.com> {} +0000'.format(
+            1500000000 + i * 60))
+        message = 'commit {}'.format(i)
+        stream.append('data {}'.format(len(message)))
+        stream.append(message)
+        for j in range(3):
+            content = '{} {}'.format(i, j)
+            stream.append('M 644 inline file{}.traineddata'.format(
+                (i * 3 + j) % file_count))
+            stream.append('data {}'.format(len(content)))
+            stream.append(content)
+        stream.append('')
+    subprocess.run(['git', 'fast-import', '--quiet'], cwd=path, check=True,
+                   input='\n'.join(stream) + '\n', universal_newlines=True)
+    subprocess.run(['git', 'checkout', '-q', 'master'], cwd=path, check=True)
+
+
+def benchmark(commit_count, file_count):
+    with tempfile.TemporaryDirectory() as repo_dir:
+        print('Creating repo with {} commits and {} files'.format(
+            commit_count, file_count))
+        make_synthetic_repo(repo_dir, commit_count, file_count)
+        files = sorted(f for f in os.listdir(repo_dir) if f != '.git')
+
+        start = time.perf_counter()
+        single = {f: single_commit_date(repo_dir, f) for f in files}
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dates = CommitDates(repo_dir, files)
+        indexed = {f: dates[f] for f in files}
+        index_time = time.perf_counter() - start
+
+        if single != indexed:
+            print('Dates mismatch')
+            exit(1)
+        print('per file: {:.3f}s, index: {:.3f}s, speedup: {:.1f}x'.format(
+            single_time, index_time, single_time / max(index_time, 1e-9)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        commits = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+        files = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+        benchmark(commits, files)
+        exit(0)
+
+    if len(sys.argv) < 2:
+        print("Usage:", sys.argv[0], "<repo_dir> | benchmark [<commits> [<files>]]")
+        exit(1)
+
+    for path, date in sorted(CommitDates(sys.argv[1]).dates.items()):
+        print(date, path)
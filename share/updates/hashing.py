@@ -0,0 +1,92 @@
+import sys
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ci'))
+import digests
+
+
+def _file_digests(args):
+    return digests.compute(*args)
+
+
+def hash_files(paths, algorithms=('md5',), workers=None, use_cache=True):
+    """Return {path: {algorithm: hexdigest}} hashing files in a process pool.
+    Digests of unchanged files are taken from the shared digest cache"""
+    result = {}
+    cache = digests.shared() if use_cache else None
+    missing = []
+    for p in paths:
+        cached = cache.lookup(p, algorithms) if cache is not None else None
+        if cached is not None:
+            result[p] = cached
+        else:
+            missing.append(p)
+    if len(missing) == 0:
+        return result
+
+    keys = {p: digests.stat_key(p) for p in missing}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(missing))
+    if workers <= 1:
+        computed = {p: digests.compute(p, algorithms) for p in missing}
+    else:
+        # large files first to avoid a long tail on one worker
+        ordered = sorted(missing, key=lambda p: keys[p][2], reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            hashed = pool.map(_file_digests, [(p, algorithms) for p in ordered])
+            computed = dict(zip(ordered, hashed))
+
+    for p, d in computed.items():
+        if cache is not None:
+            cache.store(p, keys[p], d)
+        result[p] = d
+    return result
+
+
+def benchmark(file_count, file_size_mb, algorithms):
+    with tempfile.TemporaryDirectory() as dir:
+        print('Creating {} files of {} Mb'.format(file_count, file_size_mb))
+        paths = []
+        for i in range(file_count):
+            path = os.path.join(dir, '{}.traineddata'.format(i))
+            with open(path, 'wb') as f:
+                for _ in range(file_size_mb):
+                    f.write(os.urandom(1024 * 1024))
+            paths.append(path)
+
+        total_mb = file_count * file_size_mb
+        workers = 1
+        expected = None
+        while True:
+            start = time.perf_counter()
+            result = hash_files(paths, algorithms, workers, use_cache=False)
+            elapsed = time.perf_counter() - start
+            if expected is None:
+                expected = result
+            elif expected != result:
+                print('Digests mismatch')
+                exit(1)
+            print('workers: {:2}, time: {:.3f}s, throughput: {:.1f} Mb/s'.format(
+                workers, elapsed, total_mb / max(elapsed, 1e-9)))
+            if workers >= (os.cpu_count() or 1):
+                break
+            workers = min(workers * 2, os.cpu_count() or 1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+        size = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+        benchmark(count, size, ('md5', 'sha256'))
+        exit(0)
+
+    if len(sys.argv) < 2:
+        print("Usage:", sys.argv[0], "<file>... | benchmark [<files> [<size_mb>]]")
+        exit(1)
+
+    for path, values in hash_files(sys.argv[1:]).items():
+        print(values['md5'], path)
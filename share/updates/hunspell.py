@@ -1,7 +1,14 @@
 import sys
 import os
-import subprocess
 import re
+import gitdates
+import hashing
+
+default_download_url = "https://cgit.freedesktop.org/libreoffice/dictionaries/plain"
+default_mirror_url = "https://translator.gres.biz/resources/dictionaries"
+
+preferred = ['sr.aff', 'sv_FI.aff',
+             'en_US.aff', 'de_DE_frami.aff', 'nb_NO.aff']
 
 
 def parse_language_names():
@@ -20,87 +27,113 @@ def parse_language_names():
     return result
 
 
-if len(sys.argv) < 2:
-    print("Usage:", sys.argv[0], "<dict_dir> [<download_url>]")
-    exit(1)
-
-dict_dir = sys.argv[1]
-
-download_url = "https://cgit.freedesktop.org/libreoffice/dictionaries/plain"
-if len(sys.argv) > 2:
-    download_url = sys.argv[2]
-
-mirror_url = "https://translator.gres.biz/resources/dictionaries"
-
-language_names = parse_language_names()
+def find_files(dict_dir):
+    """Return map of language code to its [aff, dic] file names"""
+    files = {}
+    it = os.scandir(dict_dir)
+    for d in it:
+        if not d.is_dir():
+            continue
 
-preferred = ['sr.aff', 'sv_FI.aff',
-             'en_US.aff', 'de_DE_frami.aff', 'nb_NO.aff']
+        lang = d.name
+        if '_' in lang:
+            lang = lang[0:lang.index('_')]
 
-files = {}
-it = os.scandir(dict_dir)
-for d in it:
-    if not d.is_dir():
-        continue
+        affs = []
+        fit = os.scandir(os.path.join(dict_dir, d.name))
+        for f in fit:
+            if not f.is_file or not f.name.endswith('.aff'):
+                continue
+            affs.append(f.name)
 
-    lang = d.name
-    if '_' in lang:
-        lang = lang[0:lang.index('_')]
+        aff = ''
+        if len(affs) == 0:
+            continue
+        if len(affs) == 1:
+            aff = affs[0]
+        else:
+            for p in preferred:
+                if p in affs:
+                    aff = p
+                    break
+
+        if len(aff) == 0:
+            print('no aff for', lang, affs, file=sys.stderr)
+            continue
 
-    affs = []
-    fit = os.scandir(os.path.join(dict_dir, d.name))
-    for f in fit:
-        if not f.is_file or not f.name.endswith('.aff'):
+        aff = os.path.join(d.name, aff)
+        dic = aff[:aff.rindex('.')] + '.dic'
+        if not os.path.exists(os.path.join(dict_dir, dic)):
+            print('no dic exists', dic, file=sys.stderr)
+
+        files[lang] = [aff, dic]
+    return files
+
+
+def collect(dict_dir, download_url=default_download_url,
+            mirror_url=default_mirror_url, cache=None, algorithms=('md5',),
+            patches=None):
+    """Return "correction" section and list of unknown language names"""
+    language_names = parse_language_names()
+    files = find_files(dict_dir)
+
+    cached = {}
+    if cache is not None:
+        for file_names in files.values():
+            for file_name in file_names:
+                info = cache.get(dict_dir, file_name)
+                if info is not None and all(a in info for a in algorithms):
+                    cached[file_name] = info
+    missing = [f for names in files.values() for f in names if f not in cached]
+    dates = gitdates.CommitDates(dict_dir, missing) if len(missing) > 0 else None
+    digests = hashing.hash_files([os.path.join(dict_dir, f) for f in missing],
+                                 algorithms) if len(missing) > 0 else {}
+
+    section = {}
+    unknown_names = []
+    for lang in sorted(files.keys()):
+        file_names = files[lang]
+        if not lang in language_names:
+            unknown_names.append(lang)
             continue
-        affs.append(f.name)
-
-    aff = ''
-    if len(affs) == 0:
-        continue
-    if len(affs) == 1:
-        aff = affs[0]
-    else:
-        for p in preferred:
-            if p in affs:
-                aff = p
-                break
-
-    if len(aff) == 0:
-        print('no aff for', lang, affs)
-        continue
-
-    aff = os.path.join(d.name, aff)
-    dic = aff[:aff.rindex('.')] + '.dic'
-    if not os.path.exists(os.path.join(dict_dir, dic)):
-        print('no dic exists', dic)
-
-    files[lang] = [aff, dic]
-
-
-print(',"correction": {')
-comma = ''
-unknown_names = []
-for lang in sorted(files.keys()):
-    file_names = files[lang]
-    if not lang in language_names:
-        unknown_names.append(lang)
-        continue
-    lang_name = language_names[lang]
-    print(' {}"{}":{{"files":['.format(comma, lang_name))
-    comma = ', '
-    lang_comma = ''
-    for file_name in file_names:
-        git_cmd = ['git', 'log', '-1', '--pretty=format:%cI', file_name]
-        date = subprocess.run(git_cmd, cwd=dict_dir, universal_newlines=True,
-                              stdout=subprocess.PIPE, check=True).stdout
-        size = os.path.getsize(os.path.join(dict_dir, file_name))
-        installed = lang + file_name[file_name.index('/'):]
-        mirror = ',"' + mirror_url + '/' + file_name + \
-            '.zip"' if len(mirror_url) > 0 else ''
-        print('  {}{{"url":["{}/{}"{}], "path":"$hunspell$/{}", "date":"{}", "size":{}}}'.format(
-            lang_comma, download_url, file_name, mirror, installed, date, size))
-        lang_comma = ','
-    print(' ]}')
-print('}')
-
-print('unknown names', unknown_names)
+        entries = []
+        for file_name in file_names:
+            url_name = file_name.replace(os.sep, '/')
+            urls = [download_url + '/' + url_name]
+            if len(mirror_url) > 0:
+                urls.append(mirror_url + '/' + url_name + '.zip')
+            installed = lang + url_name[url_name.index('/'):]
+            entry = {'url': urls, 'path': '$hunspell$/' + installed}
+            if file_name in cached:
+                fields = ('date', 'size') + tuple(algorithms)
+                entry.update({k: v for k, v in cached[file_name].items() if k in fields})
+            else:
+                info = {'date': dates[file_name],
+                        'size': os.path.getsize(os.path.join(dict_dir, file_name))}
+                info.update(digests[os.path.join(dict_dir, file_name)])
+                if cache is not None:
+                    cache.put(dict_dir, file_name, info)
+                entry.update(info)
+            if patches is not None and url_name in patches:
+                entry['patches'] = patches[url_name]
+            entries.append(entry)
+        section[language_names[lang]] = {'files': entries}
+    return section, unknown_names
+
+
+if __name__ == '__main__':
+    import manifest
+
+    if len(sys.argv) < 2:
+        print("Usage:", sys.argv[0], "<dict_dir> [<download_url>]")
+        exit(1)
+
+    dict_dir = sys.argv[1]
+
+    download_url = default_download_url
+    if len(sys.argv) > 2:
+        download_url = sys.argv[2]
+
+    section, unknown_names = collect(dict_dir, download_url)
+    print(manifest.format_section('correction', section))
+    print('unknown names', unknown_names)
@@ -0,0 +1,137 @@
+import sys
+import os
+import json
+import argparse
+import entrycache
+import shards
+import patches
+import tessdata
+import hunspell
+import translators
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mirror'))
+import zipped
+
+sections = ['app', 'recognizers', 'correction', 'translators']
+default_cache = os.path.join(os.path.expanduser('~'), '.cache', 'st_manifest.json')
+
+
+def format_section(name, section):
+    """Return section as `,"name": {...}` fragment with one component per line"""
+    lines = [',{}:{{'.format(json.dumps(name))]
+    comma = ' '
+    for key, value in section.items():
+        lines.append('{}{}:{}'.format(comma, json.dumps(key),
+                                      json.dumps(value, ensure_ascii=False,
+                                                 separators=(',', ':'))))
+        comma = ' ,'
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def dump(manifest):
+    """Return manifest text keeping sections in fixed order"""
+    parts = ['{', '"version":{}'.format(manifest.get('version', 1))]
+    names = sections + [n for n in manifest.keys() if n not in sections]
+    for name in names:
+        if name == 'version' or not name in manifest:
+            continue
+        parts.append('')
+        parts.append(format_section(name, manifest[name]))
+    parts.append('}')
+    return '\n'.join(parts) + '\n'
+
+
+def load(path):
+    if not os.path.exists(path):
+        return {'version': 1}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write(path, text):
+    """Replace file contents atomically. Return False if contents are the same"""
+    return zipped.replace(path, text.encode('utf-8'))
+
+
+def write_packed(path, text):
+    """Write zipped text to path + '.zip'. Return False if contents are the same"""
+    return zipped.replace(path + '.zip',
+                          zipped.pack(os.path.basename(path), text.encode('utf-8')))
+
+
+def build(args):
+    manifest = load(args.base if args.base else args.out)
+    cache = entrycache.EntryCache(None if args.no_cache else args.cache)
+    algorithms = ('md5', 'sha256') if args.sha256 else ('md5',)
+
+    if args.tessdata:
+        found = None
+        if args.tessdata_patches:
+            found = patches.find(args.tessdata_patches, args.tessdata_mirror)
+        section, unknown = tessdata.collect(
+            args.tessdata, args.tessdata_url, args.tessdata_mirror, cache, algorithms,
+            found)
+        manifest['recognizers'] = section
+        if len(unknown) > 0:
+            print('unknown recognizer names', unknown, file=sys.stderr)
+
+    if args.dictionaries:
+        found = None
+        if args.hunspell_patches:
+            found = patches.find(args.hunspell_patches, args.hunspell_mirror)
+        section, unknown = hunspell.collect(
+            args.dictionaries, args.hunspell_url, args.hunspell_mirror, cache, algorithms,
+            found)
+        manifest['correction'] = section
+        if len(unknown) > 0:
+            print('unknown dictionary names', unknown, file=sys.stderr)
+
+    if not args.no_translators:
+        manifest['translators'] = translators.collect(
+            args.translators_url, cache=cache)
+
+    cache.save()
+    return manifest
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Build updates.json. Sections without sources are kept from base')
+    parser.add_argument('out', help='manifest to write')
+    parser.add_argument('--base', help='manifest to take unchanged sections from (default: out)')
+    parser.add_argument('--tessdata', help='tessdata_best git checkout')
+    parser.add_argument('--tessdata-url', default=tessdata.default_download_url)
+    parser.add_argument('--tessdata-mirror', default=tessdata.default_mirror_url)
+    parser.add_argument('--tessdata-patches',
+                        help='mirror directory with packed tessdata and patches')
+    parser.add_argument('--dictionaries', help='libreoffice dictionaries git checkout')
+    parser.add_argument('--hunspell-url', default=hunspell.default_download_url)
+    parser.add_argument('--hunspell-mirror', default=hunspell.default_mirror_url)
+    parser.add_argument('--hunspell-patches',
+                        help='mirror directory with packed dictionaries and patches')
+    parser.add_argument('--translators-url', default=translators.default_download_url)
+    parser.add_argument('--no-translators', action='store_true')
+    parser.add_argument('--sha256', action='store_true',
+                        help='add sha256 to recognizers and dictionaries besides md5')
+    parser.add_argument('--zip', action='store_true',
+                        help='also write compressed <out>.zip')
+    parser.add_argument('--shards', help='also write per-section shards and their index here')
+    parser.add_argument('--cache', default=default_cache, help='entry cache file')
+    parser.add_argument('--no-cache', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    manifest = build(args)
+    text = dump(manifest)
+    if write(args.out, text):
+        print('Updated', args.out)
+    else:
+        print('No changes in', args.out)
+    if args.zip and write_packed(args.out, text):
+        print('Updated', args.out + '.zip')
+    if args.shards:
+        for name in shards.write(manifest, args.shards):
+            print('Updated', os.path.join(args.shards, name))
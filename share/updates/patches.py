@@ -0,0 +1,34 @@
+import sys
+import os
+import re
+
+# written by share/mirror/pack.py next to packed files
+patch_pattern = re.compile(r'^(.+)\.([0-9a-f]{32})\.patch\.zip$')
+
+
+def find(pack_dir, mirror_url):
+    """Return {file path relative to pack_dir: [patch entry]}.
+    Entry lists patch url, md5 of file version it applies to and size"""
+    result = {}
+    for root, _, names in os.walk(pack_dir):
+        for name in sorted(names):
+            match = patch_pattern.match(name)
+            if match is None:
+                continue
+            rel_dir = os.path.relpath(root, pack_dir).replace(os.sep, '/')
+            prefix = '' if rel_dir == '.' else rel_dir + '/'
+            result.setdefault(prefix + match.group(1), []).append({
+                'url': mirror_url + '/' + prefix + name,
+                'base': match.group(2),
+                'size': os.path.getsize(os.path.join(root, name))})
+    return result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], "<pack_dir> <mirror_url>")
+        exit(1)
+
+    for path, entries in sorted(find(sys.argv[1], sys.argv[2]).items()):
+        for entry in entries:
+            print(path, entry['base'], entry['size'], entry['url'])
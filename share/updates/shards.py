@@ -0,0 +1,125 @@
+import sys
+import os
+import json
+import hashlib
+import time
+import manifest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mirror'))
+import zipped
+
+index_name = 'index.json'
+
+
+def split(data):
+    """Return {section: shard text}. Every shard is a valid manifest itself"""
+    result = {}
+    for name, section in data.items():
+        if name == 'version':
+            continue
+        result[name] = manifest.dump({'version': data.get('version', 1), name: section})
+    return result
+
+
+def make_index(shards):
+    """Return index text listing shard urls (relative to index, compressed
+    first) and hashes of their uncompressed contents"""
+    index = {'version': 1, 'shards': {}}
+    for name in sorted(shards.keys()):
+        raw = shards[name].encode('utf-8')
+        index['shards'][name] = {'url': [name + '.json.zip', name + '.json'],
+                                 'md5': hashlib.md5(raw).hexdigest(),
+                                 'size': len(raw)}
+    return json.dumps(index, separators=(',', ':')) + '\n'
+
+
+def write(data, out_dir):
+    """Write shards and index into out_dir. Return names of changed files"""
+    os.makedirs(out_dir, exist_ok=True)
+    shards = split(data)
+    changed = []
+    files = [(name + '.json', text) for name, text in shards.items()]
+    # index last so clients never see hashes of unwritten shards
+    files.append((index_name, make_index(shards)))
+    for name, text in files:
+        path = os.path.join(out_dir, name)
+        if manifest.write(path, text):
+            changed.append(name)
+        if manifest.write_packed(path, text):
+            changed.append(name + '.zip')
+    return changed
+
+
+def delta(old, new):
+    """Return document with components changed or removed between manifest versions"""
+    result = {'version': 1,
+              'from': hashlib.md5(manifest.dump(old).encode('utf-8')).hexdigest(),
+              'to': hashlib.md5(manifest.dump(new).encode('utf-8')).hexdigest(),
+              'changed': {}, 'removed': {}}
+    for name in new.keys():
+        if name == 'version':
+            continue
+        old_section = old.get(name, {})
+        changed = {k: v for k, v in new[name].items() if old_section.get(k) != v}
+        if len(changed) > 0:
+            result['changed'][name] = changed
+    for name in old.keys():
+        if name == 'version':
+            continue
+        removed = [k for k in old[name].keys() if not k in new.get(name, {})]
+        if len(removed) > 0:
+            result['removed'][name] = removed
+    return result
+
+
+def apply_delta(old, delta):
+    result = json.loads(json.dumps(old))
+    for name, components in delta['removed'].items():
+        for component in components:
+            result[name].pop(component, None)
+    for name, components in delta['changed'].items():
+        result.setdefault(name, {}).update(components)
+    return result
+
+
+def benchmark(manifest_path, repeat=200):
+    with open(manifest_path, 'rb') as f:
+        full = f.read()
+    index = make_index(split(json.loads(full)))
+    packed_index = zipped.pack(index_name, index.encode('utf-8'))
+    index = index.encode('utf-8')
+
+    def parse_time(raw):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            json.loads(raw)
+        return (time.perf_counter() - start) / repeat
+
+    full_time = parse_time(full)
+    index_time = parse_time(index)
+    print('full manifest: {} bytes, parse {:.3f} ms'.format(len(full), full_time * 1000))
+    print('shard index:   {} bytes, parse {:.3f} ms'.format(len(index), index_time * 1000))
+    print('packed index:  {} bytes'.format(len(packed_index)))
+    print('no-change check transfers {:.1f}x less, parses {:.1f}x faster'.format(
+        len(full) / len(index), full_time / max(index_time, 1e-9)))
+
+
+if __name__ == '__main__':
+    usage = "<split <manifest> <out_dir> | delta <old> <new> <out> | benchmark <manifest>>"
+    if len(sys.argv) < 3:
+        print("Usage:", sys.argv[0], usage)
+        exit(1)
+
+    command = sys.argv[1]
+    if command == 'split':
+        for name in write(manifest.load(sys.argv[2]), sys.argv[3]):
+            print('Updated', name)
+    elif command == 'delta':
+        result = delta(manifest.load(sys.argv[2]), manifest.load(sys.argv[3]))
+        with open(sys.argv[4], 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
+    elif command == 'benchmark':
+        benchmark(sys.argv[2])
+    else:
+        print("Usage:", sys.argv[0], usage)
+        exit(1)
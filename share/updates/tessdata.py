@@ -1,7 +1,11 @@
 import sys
 import os
-import subprocess
 import re
+import gitdates
+import hashing
+
+default_download_url = "https://github.com/tesseract-ocr/tessdata_best/raw/master"
+default_mirror_url = "https://translator.gres.biz/resources/tessdata_best"
 
 
 def parse_language_names():
@@ -18,51 +22,78 @@ def parse_language_names():
     return result
 
 
-if len(sys.argv) < 2:
-    print("Usage:", sys.argv[0], "<tessdata_dir> [<download_url>]")
-    exit(1)
+def collect(tessdata_dir, download_url=default_download_url,
+            mirror_url=default_mirror_url, cache=None, algorithms=('md5',),
+            patches=None):
+    """Return "recognizers" section and list of unknown language names"""
+    language_names = parse_language_names()
+
+    files = {}
+    it = os.scandir(tessdata_dir)
+    for f in it:
+        if not f.is_file() or f.name in ["LICENSE", "README.md"]:
+            continue
+        name = f.name[:f.name.index('.')]
+        if len(name) == 0:
+            continue
+        files.setdefault(name, []).append(f.name)
+
+    cached = {}
+    if cache is not None:
+        for file_names in files.values():
+            for file_name in file_names:
+                info = cache.get(tessdata_dir, file_name)
+                if info is not None and all(a in info for a in algorithms):
+                    cached[file_name] = info
+    missing = [f for names in files.values() for f in names if f not in cached]
+    dates = gitdates.CommitDates(tessdata_dir, missing) if len(missing) > 0 else None
+    digests = hashing.hash_files([os.path.join(tessdata_dir, f) for f in missing],
+                                 algorithms) if len(missing) > 0 else {}
 
-tessdata_dir = sys.argv[1]
+    section = {}
+    unknown_names = []
+    for name in sorted(files.keys()):
+        file_names = files[name]
+        if not name in language_names:
+            unknown_names.append(name)
+        else:
+            name = language_names[name]
+        entries = []
+        for file_name in file_names:
+            urls = [download_url + '/' + file_name]
+            if len(mirror_url) > 0:
+                urls.append(mirror_url + '/' + file_name + '.zip')
+            entry = {'url': urls, 'path': '$tessdata$/' + file_name}
+            if file_name in cached:
+                fields = ('date', 'size') + tuple(algorithms)
+                entry.update({k: v for k, v in cached[file_name].items() if k in fields})
+            else:
+                info = {'date': dates[file_name],
+                        'size': os.path.getsize(os.path.join(tessdata_dir, file_name))}
+                info.update(digests[os.path.join(tessdata_dir, file_name)])
+                if cache is not None:
+                    cache.put(tessdata_dir, file_name, info)
+                entry.update(info)
+            if patches is not None and file_name in patches:
+                entry['patches'] = patches[file_name]
+            entries.append(entry)
+        section[name] = {'files': entries}
+    return section, unknown_names
 
-download_url = "https://github.com/tesseract-ocr/tessdata_best/raw/master"
-if len(sys.argv) > 2:
-    download_url = sys.argv[2]
 
-mirror_url = "https://translator.gres.biz/resources/tessdata_best"
+if __name__ == '__main__':
+    import manifest
 
-language_names = parse_language_names()
+    if len(sys.argv) < 2:
+        print("Usage:", sys.argv[0], "<tessdata_dir> [<download_url>]")
+        exit(1)
 
-files = {}
-it = os.scandir(tessdata_dir)
-for f in it:
-    if not f.is_file() or f.name in ["LICENSE", "README.md"]:
-        continue
-    name = f.name[:f.name.index('.')]
-    if len(name) == 0:
-        continue
-    files.setdefault(name, []).append(f.name)
+    tessdata_dir = sys.argv[1]
 
-print(',"recognizers": {')
-comma = ''
-unknown_names = []
-for name in sorted(files.keys()):
-    file_names = files[name]
-    if not name in language_names:
-        unknown_names.append(name)
-    else:
-        name = language_names[name]
-    print(' {}"{}":{{"files":['.format(comma, name))
-    comma = ', '
-    for file_name in file_names:
-        git_cmd = ['git', 'log', '-1', '--pretty=format:%cI', file_name]
-        date = subprocess.run(git_cmd, cwd=tessdata_dir, universal_newlines=True,
-                              stdout=subprocess.PIPE, check=True).stdout
-        size = os.path.getsize(os.path.join(tessdata_dir, file_name))
-        mirror = ',"' + mirror_url + '/' + file_name + \
-            '.zip"' if len(mirror_url) > 0 else ''
-        print('  {{"url":["{}/{}"{}], "path":"$tessdata$/{}", "date":"{}", "size":{}}}'.format(
-            download_url, file_name, mirror, file_name, date, size))
-    print(' ]}')
-print('}')
+    download_url = default_download_url
+    if len(sys.argv) > 2:
+        download_url = sys.argv[2]
 
-print('unknown names', unknown_names)
+    section, unknown_names = collect(tessdata_dir, download_url)
+    print(manifest.format_section('recognizers', section))
+    print('unknown names', unknown_names)
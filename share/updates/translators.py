@@ -1,38 +1,47 @@
 import sys
 import os
-import hashlib
+import hashing
 
-download_url = "https://raw.githubusercontent.com/OneMoreGres/ScreenTranslator/master"
-
-if len(sys.argv) > 1:
-    download_url = sys.argv[1]
+default_download_url = "https://raw.githubusercontent.com/OneMoreGres/ScreenTranslator/master"
 
 subdir = 'translators'
 root = os.path.abspath(os.path.basename(__file__) + '/../../..')
-translators_dir = root + '/' + subdir
-
-files = {}
-it = os.scandir(translators_dir)
-for f in it:
-    if not f.is_file() or not f.name.endswith('.js'):
-        continue
-    name = f.name[:f.name.index('.')]
-    files[name] = f.name
-
-print(',"translators":{')
-comma = ''
-for name in sorted(files.keys()):
-    file_name = files[name]
-    print(' {}"{}": {{"files":['.format(comma, name))
-    comma = ','
-    md5 = hashlib.md5()
-    size = 0
-    with open(os.path.join(translators_dir, file_name), 'rb') as f:
-        data = f.read()
-        size = len(data)
-        md5.update(data)
-    print('  {{"url":"{}/{}", "path":"$translators$/{}", "md5":"{}", "size":{}}}'.format(
-        download_url, subdir + '/' + file_name, file_name,
-        md5.hexdigest(), size))
-    print(' ]}')
-print('}')
+default_translators_dir = root + '/' + subdir
+
+
+def collect(download_url=default_download_url, translators_dir=default_translators_dir,
+            cache=None):
+    """Return "translators" section"""
+    files = {}
+    it = os.scandir(translators_dir)
+    for f in it:
+        if not f.is_file() or not f.name.endswith('.js'):
+            continue
+        name = f.name[:f.name.index('.')]
+        files[name] = f.name
+
+    section = {}
+    for name in sorted(files.keys()):
+        file_name = files[name]
+        entry = {'url': download_url + '/' + subdir + '/' + file_name,
+                 'path': '$translators$/' + file_name}
+        info = cache.get(translators_dir, file_name) if cache is not None else None
+        if info is None:
+            path = os.path.join(translators_dir, file_name)
+            md5 = hashing.hash_files([path], workers=1)[path]['md5']
+            info = {'md5': md5, 'size': os.path.getsize(path)}
+            if cache is not None:
+                cache.put(translators_dir, file_name, info)
+        entry.update(info)
+        section[name] = {'files': [entry]}
+    return section
+
+
+if __name__ == '__main__':
+    import manifest
+
+    download_url = default_download_url
+    if len(sys.argv) > 1:
+        download_url = sys.argv[1]
+
+    print(manifest.format_section('translators', collect(download_url)))
@@ -0,0 +1,170 @@
+import sys
+import os
+import time
+import json
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import email.utils
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ci'))
+import downloader
+
+
+def entries(manifest):
+    """Return every url of manifest with the file fields it must match.
+    Zipped mirrors are 'packed': size and md5 describe their single member"""
+    result = []
+    for section, components in manifest.items():
+        if not isinstance(components, dict):
+            continue
+        for name, component in components.items():
+            for file in component.get('files', []):
+                urls = file.get('url', [])
+                for url in [urls] if isinstance(urls, str) else urls:
+                    result.append({'component': section + '/' + name, 'url': url,
+                                   'path': file['path'], 'size': file.get('size'),
+                                   'md5': file.get('md5'), 'date': file.get('date'),
+                                   'packed': url.endswith('.zip')})
+                for patch in file.get('patches', []):
+                    for url in patch['urls'] if 'urls' in patch else [patch['url']]:
+                        result.append({'component': section + '/' + name, 'url': url,
+                                       'path': file['path'], 'size': patch.get('size'),
+                                       'md5': None, 'date': None, 'packed': False})
+    return result
+
+
+def _served_date(response):
+    value = response.getheader('Last-Modified')
+    if value is None:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _probe(loader, url):
+    """Return (status, size, last modified) reading only response headers"""
+    response, connection, parts = loader.open(url, {'Range': 'bytes=0-0'})
+    size = None
+    if response.status == 206:
+        total = response.getheader('Content-Range', '').rpartition('/')[2]
+        size = int(total) if total.isdigit() else None
+    elif response.getheader('Content-Length'):
+        size = int(response.getheader('Content-Length'))
+    date = _served_date(response)
+    connection.close()  # body is not needed
+    return response.status, size, date
+
+
+def _served_digest(loader, entry):
+    """Return (size, md5) of served file or of its member if it is packed"""
+    with tempfile.TemporaryDirectory() as dir:
+        path = os.path.join(dir, os.path.basename(entry['url']))
+        loader.fetch(entry['url'], path, force=True)
+        if not entry['packed']:
+            with open(path, 'rb') as f:
+                return os.path.getsize(path), hashlib.md5(f.read()).hexdigest()
+        with zipfile.ZipFile(path) as arc:
+            info = arc.infolist()[0]
+            return info.file_size, hashlib.md5(arc.read(info)).hexdigest()
+
+
+def check(loader, entry, digests=False, slow=2.0):
+    """Return entry with 'status' (ok, dead, mismatch, slow or stale),
+    'latency' in seconds and list of 'problems'"""
+    result = dict(entry, problems=[], latency=None)
+    start = time.perf_counter()
+    try:
+        status, size, date = loader.retry(entry['url'], lambda: _probe(loader, entry['url']))
+    except (RuntimeError, downloader.RetryableError) as e:
+        result['latency'] = time.perf_counter() - start
+        result['problems'].append(str(e))
+        result['status'] = 'dead'
+        return result
+    result['latency'] = time.perf_counter() - start
+
+    if status not in (200, 206):
+        result['problems'].append('HTTP {}'.format(status))
+        result['status'] = 'dead'
+        return result
+    if not entry['packed'] and entry['size'] is not None and size is not None \
+            and size != entry['size']:
+        result['problems'].append('size {} != {}'.format(size, entry['size']))
+    if digests and (entry['md5'] is not None or entry['packed']):
+        try:
+            served_size, served_md5 = _served_digest(loader, entry)
+            if entry['size'] is not None and served_size != entry['size']:
+                result['problems'].append('unpacked size {} != {}'.format(
+                    served_size, entry['size']))
+            if entry['md5'] is not None and served_md5 != entry['md5']:
+                result['problems'].append('md5 {} != {}'.format(served_md5, entry['md5']))
+        except (RuntimeError, OSError, zipfile.BadZipFile, IndexError) as e:
+            result['problems'].append('download failed: {}'.format(e))
+    if result['problems']:
+        result['status'] = 'mismatch'
+        return result
+
+    if entry['date'] is not None and date is not None:
+        expected = datetime.datetime.fromisoformat(entry['date'])
+        if expected.tzinfo is None:
+            expected = expected.replace(tzinfo=datetime.timezone.utc)
+        if date < expected:
+            result['problems'].append('served copy from {} is older than {}'.format(
+                date.isoformat(), entry['date']))
+            result['status'] = 'stale'
+            return result
+    result['status'] = 'slow' if result['latency'] > slow else 'ok'
+    return result
+
+
+def verify(manifest, workers=16, digests=False, slow=2.0, timeout=20):
+    """Check all manifest urls using at most workers concurrent requests"""
+    loader = downloader.Downloader(workers=workers, retries=1, timeout=timeout,
+                                   backoff=0.5)
+    items = entries(manifest)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda e: check(loader, e, digests, slow), items))
+    loader.pool.close()
+    return results
+
+
+def report(results, top=10):
+    """Return text with problems and the slowest urls"""
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    lines = ['>> Checked {} urls: {}'.format(len(results), ', '.join(
+        '{} {}'.format(n, s) for s, n in sorted(counts.items())))]
+    for status in ('dead', 'mismatch', 'stale', 'slow'):
+        bad = [r for r in results if r['status'] == status]
+        if not bad:
+            continue
+        lines.append('>> {}:'.format(status.capitalize()))
+        for r in sorted(bad, key=lambda r: -r['latency']):
+            lines.append('   {:6.2f}s {} {} {}'.format(
+                r['latency'], r['component'], r['url'], '; '.join(r['problems'])))
+    lines.append('>> Slowest urls:')
+    for r in sorted(results, key=lambda r: -r['latency'])[:top]:
+        lines.append('   {:6.2f}s {}'.format(r['latency'], r['url']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check urls of updates manifest')
+    parser.add_argument('manifest')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--digests', action='store_true',
+                        help='download files to compare md5 and unpacked size')
+    parser.add_argument('--slow', type=float, default=2.0,
+                        help='latency in seconds to report url as slow')
+    args = parser.parse_args()
+
+    with open(args.manifest, 'r', encoding='utf-8') as f:
+        results = verify(json.load(f), args.workers, args.digests, args.slow)
+    print(report(results))
+    exit(1 if any(r['status'] in ('dead', 'mismatch') for r in results) else 0)
@@ -16,13 +16,23 @@
 #include <QFileInfo>
 #include <QMessageBox>
 #include <QNetworkProxy>
+#include <QStandardPaths>
 #include <QThread>
 
 namespace
 {
 #ifdef DEVELOP
+const auto updatesPackedIndexUrl =
+    "http://localhost:8081/updates/index.json.zip";
+const auto updatesIndexUrl = "http://localhost:8081/updates/index.json";
 const auto updatesUrl = "http://localhost:8081/updates.json";
 #else
+const auto updatesPackedIndexUrl =
+    "https://raw.githubusercontent.com/OneMoreGres/ScreenTranslator/master/"
+    "updates/index.json.zip";
+const auto updatesIndexUrl =
+    "https://raw.githubusercontent.com/OneMoreGres/ScreenTranslator/master/"
+    "updates/index.json";
 const auto updatesUrl =
     "https://raw.githubusercontent.com/OneMoreGres/ScreenTranslator/master/"
     "updates.json";
@@ -34,10 +44,15 @@ using Loader = update::Loader;
 Manager::Manager()
   : models_(std::make_unique<CommonModels>())
   , settings_(std::make_unique<Settings>())
-  , updater_(std::make_unique<update::Updater>(QVector<QUrl>{{updatesUrl}}))
+  , updater_(std::make_unique<update::Updater>(QVector<QUrl>{
+        {updatesPackedIndexUrl}, {updatesIndexUrl}, {updatesUrl}}))
 {
   SOFT_ASSERT(settings_, return );
 
+  updater_->setCacheDir(
+      QStandardPaths::writableLocation(QStandardPaths::CacheLocation) +
+      "/updates");
+
   // updater components
   (void)QT_TRANSLATE_NOOP("QObject", "app");
   (void)QT_TRANSLATE_NOOP("QObject", "recognizers");
@@ -2,20 +2,23 @@
 #include "debug.h"
 
 #include <QApplication>
+#include <QBuffer>
+#include <QCryptographicHash>
+#include <QDataStream>
 #include <QDir>
 #include <QJsonArray>
 #include <QJsonDocument>
 #include <QJsonObject>
 #include <QMenu>
 #include <QNetworkReply>
+#include <QSaveFile>
 #include <QScopeGuard>
 #include <QSortFilterProxyModel>
 #include <QTemporaryFile>
+#include <QThread>
 #include <QTimer>
 #include <QTreeView>
 
-#include <random>
-
 #define MINIZ_NO_ZLIB_APIS
 #define MINIZ_NO_ZLIB_COMPATIBLE_NAMES
 #define MINIZ_NO_MALLOC
@@ -23,9 +26,14 @@
 #define MINIZ_NO_ARCHIVE_WRITING_APIS
 #include <miniz/miniz.h>
 
+static bool isPacked(const QByteArray &data)
+{
+  return data.startsWith("PK");
+}
+
 static QByteArray unpack(const QByteArray &data)
 {
-  if (data.size() <= 4 || data.left(2) != "PK") {
+  if (data.size() <= 4 || !isPacked(data)) {
     LTRACE() << "Incorrect data to unpack" << LARG(data.size())
              << data.left(10);
     return {};
@@ -66,12 +74,23 @@ static QByteArray unpack(const QByteArray &data)
   return {};
 }
 
+static size_t readDevice(void *opaque, mz_uint64 offset, void *buffer,
+                         size_t size)
+{
+  auto device = static_cast<QIODevice *>(opaque);
+  if (!device->seek(qint64(offset)))
+    return 0;
+  const auto read = device->read(static_cast<char *>(buffer), qint64(size));
+  return read < 0 ? 0 : size_t(read);
+}
+
 namespace update
 {
 namespace
 {
 const auto versionKey = "version";
 const auto filesKey = "files";
+const auto shardsKey = "shards";
 
 QString sizeString(qint64 bytes, int precision)
 {
@@ -141,15 +160,187 @@ QStringList toList(const QJsonValue &value)
   return result;
 }
 
+QVector<QUrl> toUrls(const QJsonValue &value)
+{
+  QVector<QUrl> result;
+  for (const auto &s : toList(value)) {
+    const auto url = QUrl(s);
+    if (url.isValid())
+      result.append(url);
+  }
+  return result;
+}
+
+// read and write block of streamed files
+const auto chunkSize = 1024 * 1024;
+
+// mirrors are compared by expected time to download this amount
+const auto referenceBytes = 4 * 1024 * 1024;
+// smaller transfers are too short to measure throughput
+const auto minMeasuredBytes = 64 * 1024;
+const auto failurePenaltyMs = 10'000.0;
+const auto statsWeight = 0.3;  // of new sample in moving average
+
+double average(double old, double sample)
+{
+  return old < 0 ? sample : old * (1 - statsWeight) + sample * statsWeight;
+}
+
+// 4xx is missing file (e.g. optional format), not a broken mirror
+bool isHostFailure(const QNetworkReply &reply)
+{
+  if (reply.error() > QNetworkReply::NoError &&
+      reply.error() < QNetworkReply::ProxyConnectionRefusedError)
+    return true;  // connection level error, including timed out
+  const auto status =
+      reply.attribute(QNetworkRequest::HttpStatusCodeAttribute).toInt();
+  return status >= 500;
+}
+
+DigestIndex::Entry fileStamp(const QString &path)
+{
+  QFileInfo info(path);
+  if (!info.exists())
+    return {};
+  return {info.size(),
+          info.fileTime(QFile::FileModificationTime).toMSecsSinceEpoch(),
+          {}};
+}
+
 }  // namespace
 
 //
 
+void DigestIndex::load(const QString &fileName)
+{
+  fileName_ = fileName;
+  entries_.clear();
+  changed_ = false;
+
+  QFile f(fileName_);
+  if (!f.open(QFile::ReadOnly))
+    return;
+
+  const auto json = QJsonDocument::fromJson(f.readAll()).object();
+  for (auto it = json.constBegin(), end = json.constEnd(); it != end; ++it) {
+    const auto info = it.value().toObject();
+    Entry entry;
+    entry.size = qint64(info["size"].toDouble(-1));
+    entry.mtime = qint64(info["mtime"].toDouble(-1));
+    entry.md5 = info["md5"].toString();
+    if (entry.size < 0 || entry.md5.isEmpty())
+      continue;
+    entries_.insert(it.key(), entry);
+  }
+  LTRACE() << "Loaded digests of" << entries_.size() << "files";
+}
+
+void DigestIndex::save()
+{
+  if (!changed_ || fileName_.isEmpty())
+    return;
+
+  QJsonObject json;
+  for (auto it = entries_.cbegin(), end = entries_.cend(); it != end; ++it) {
+    if (it->md5.isEmpty() || !QFile::exists(it.key()))
+      continue;
+    QJsonObject info;
+    info["size"] = double(it->size);
+    info["mtime"] = double(it->mtime);
+    info["md5"] = it->md5;
+    json[it.key()] = info;
+  }
+
+  if (!QDir().mkpath(QFileInfo(fileName_).absolutePath()))
+    return;
+
+  QSaveFile f(fileName_);
+  if (!f.open(QFile::WriteOnly)) {
+    LTRACE() << "Failed to save digests" << fileName_ << f.errorString();
+    return;
+  }
+  f.write(QJsonDocument(json).toJson(QJsonDocument::Compact));
+  if (f.commit())
+    changed_ = false;
+}
+
+std::optional<QString> DigestIndex::cached(const QString &path) const
+{
+  const auto it = entries_.constFind(QFileInfo(path).absoluteFilePath());
+  if (it == entries_.cend())
+    return {};
+
+  const auto stamp = fileStamp(path);
+  if (stamp.size != it->size || stamp.mtime != it->mtime)
+    return {};
+  return it->md5;
+}
+
+QString DigestIndex::md5(const QString &path)
+{
+  if (const auto md5 = cached(path))
+    return *md5;
+
+  const auto entry = compute(path);
+  store(path, entry);
+  return entry.md5;
+}
+
+void DigestIndex::store(const QString &path, const Entry &entry)
+{
+  if (entry.size < 0)
+    return;
+  entries_.insert(QFileInfo(path).absoluteFilePath(), entry);
+  changed_ = true;
+}
+
+DigestIndex::Entry DigestIndex::compute(const QString &path)
+{
+  auto result = fileStamp(path);
+  if (result.size < 0)
+    return result;
+
+  QFile f(path);
+  if (!f.open(QFile::ReadOnly))
+    return result;
+
+  QByteArray chunk(chunkSize, Qt::Uninitialized);
+  QCryptographicHash hash(QCryptographicHash::Md5);
+  while (true) {
+    const auto read = f.read(chunk.data(), chunk.size());
+    if (read < 0)
+      return result;
+    if (read == 0)
+      break;
+    hash.addData(chunk.constData(), int(read));
+  }
+
+  const auto after = fileStamp(path);
+  if (after.size != result.size || after.mtime != result.mtime) {
+    LTRACE() << "File changed while hashing" << path;
+    return {};
+  }
+
+  result.md5 = hash.result().toHex();
+  return result;
+}
+
+//
+
 Model::Model(Updater &updater)
   : updater_(updater)
 {
 }
 
+Model::~Model()
+{
+  if (!hasher_)
+    return;
+  hasher_->requestInterruption();
+  hasher_->wait();
+  delete hasher_;
+}
+
 QString Model::parse(const QByteArray &data)
 {
   QJsonParseError error;
@@ -160,7 +351,11 @@ QString Model::parse(const QByteArray &data)
         .arg(error.offset);
   }
 
-  const auto json = doc.object();
+  return load(doc.object());
+}
+
+QString Model::load(const QJsonObject &json)
+{
   const auto version = json[versionKey].toInt();
   if (version != 1) {
     return tr("Wrong updates version: %1").arg(version);
@@ -211,22 +406,22 @@ std::unique_ptr<Model::Component> Model::parse(const QJsonObject &json) const
     for (const auto &fileInfo : files) {
       const auto object = fileInfo.toObject();
       File file;
-      for (const auto &s : toList(object["url"])) {
-        const auto url = QUrl(s);
-        if (url.isValid())
-          file.urls.append(url);
-      }
+      file.urls = toUrls(object["url"]);
       if (file.urls.isEmpty()) {
         result->checkOnly = true;
-      } else if (file.urls.size() > 1) {
-        std::random_device device;
-        std::mt19937 generator(device());
-        std::shuffle(file.urls.begin(), file.urls.end(), generator);
       }
       file.rawPath = object["path"].toString();
       file.md5 = object["md5"].toString();
       file.versionDate =
           QDateTime::fromString(object["date"].toString(), Qt::ISODate);
+      for (const auto &patchInfo : object["patches"].toArray()) {
+        const auto patchObject = patchInfo.toObject();
+        Patch patch;
+        patch.urls = toUrls(patchObject["url"]);
+        patch.base = patchObject["base"].toString();
+        if (!patch.urls.isEmpty() && !patch.base.isEmpty())
+          file.patches.push_back(patch);
+      }
       const auto size = object["size"].toInt();
       result->size += size;
       result->files.push_back(file);
@@ -294,18 +489,35 @@ void Model::setExpansions(const QHash<QString, QString> &expansions)
 }
 
 void Model::updateStates()
+{
+  updateStates({});
+}
+
+void Model::updateStates(const QSet<QString> &notHashed)
 {
   if (!root_)
     return;
 
-  auto visitor = [this](Component &component, auto v) -> void {
+  QStringList unknown;
+  auto visitor = [this, &unknown, &notHashed](Component &component,
+                                              auto v) -> void {
     if (!component.files.empty()) {
-      component.state = State::Actual;
+      auto state = State::Actual;
+      auto known = true;
       for (auto &file : component.files) {
         file.expandedPath = expanded(file.rawPath);
         const auto fileState = currentState(file);
-        component.state = std::min(component.state, fileState);
+        if (!fileState) {
+          if (!notHashed.contains(file.expandedPath))
+            unknown.append(file.expandedPath);
+          known = false;
+          continue;
+        }
+        state = std::min(state, *fileState);
       }
+      if (!known)  // updated when digests are ready
+        return;
+      component.state = state;
       auto index = toIndex(component, int(Column::State));
       emit dataChanged(index, index, {Qt::DisplayRole});
 
@@ -315,9 +527,12 @@ void Model::updateStates()
   };
 
   visitor(*root_, visitor);
+
+  if (!unknown.isEmpty())
+    hashInBackground(unknown);
 }
 
-State Model::currentState(const File &file) const
+std::optional<State> Model::currentState(const File &file) const
 {
   if (file.expandedPath.isEmpty() ||
       (file.md5.isEmpty() && !file.versionDate.isValid()))
@@ -331,21 +546,75 @@ State Model::currentState(const File &file) const
     const auto date = info.fileTime(QFile::FileModificationTime);
     if (!date.isValid())
       return State::NotInstalled;
-    return date >= file.versionDate ? State::Actual : State::UpdateAvailable;
+    if (date >= file.versionDate)
+      return State::Actual;
+    // modification time is not reliable after copy or restore
+    if (file.md5.isEmpty())
+      return State::UpdateAvailable;
   }
 
-  QFile f(file.expandedPath);
-  if (!f.open(QFile::ReadOnly))
+  const auto md5 = updater_.digests().cached(file.expandedPath);
+  if (!md5)
+    return {};
+  if (md5->isEmpty())
     return State::NotInstalled;
-
-  const auto data = f.readAll();
-  const auto md5 =
-      QCryptographicHash::hash(data, QCryptographicHash::Md5).toHex();
-  if (md5 != file.md5)
+  if (*md5 != file.md5)
     return State::UpdateAvailable;
   return State::Actual;
 }
 
+void Model::hashInBackground(const QStringList &paths)
+{
+  for (const auto &path : paths) {
+    if (!hashQueue_.contains(path))
+      hashQueue_.append(path);
+  }
+  if (hasher_)  // queue is taken when current batch is finished
+    return;
+
+  const auto batch = hashQueue_;
+  hashQueue_.clear();
+  LTRACE() << "Hashing" << batch.size() << "files in background";
+
+  using Results = QVector<QPair<QString, DigestIndex::Entry>>;
+  auto results = std::make_shared<Results>();
+  hasher_ = QThread::create([batch, results] {
+    for (const auto &path : batch) {
+      if (QThread::currentThread()->isInterruptionRequested())
+        return;
+      results->append({path, DigestIndex::compute(path)});
+    }
+  });
+
+  connect(hasher_, &QThread::finished,  //
+          this, [this, results] {
+            hasher_->deleteLater();
+            hasher_ = nullptr;
+
+            // files changed while hashed are hashed again on next update
+            // only, otherwise a file being written is hashed in a loop
+            QSet<QString> changed;
+            auto &digests = updater_.digests();
+            for (const auto &result : qAsConst(*results)) {
+              if (result.second.size < 0)
+                changed.insert(result.first);
+              digests.store(result.first, result.second);
+            }
+            digests.save();
+
+            updateStates(changed);
+            if (!hasher_ && !hashQueue_.isEmpty())
+              hashInBackground({});
+            emit digestsUpdated();
+          });
+  hasher_->start(QThread::LowPriority);
+}
+
+bool Model::isHashing() const
+{
+  return hasher_ != nullptr;
+}
+
 QString Model::expanded(const QString &source) const
 {
   auto result = source;
@@ -520,73 +789,374 @@ Qt::ItemFlags Model::flags(const QModelIndex &index) const
 
 //
 
+void MirrorStats::load(const QString &fileName)
+{
+  fileName_ = fileName;
+  hosts_.clear();
+  changed_ = false;
+
+  QFile f(fileName_);
+  if (!f.open(QFile::ReadOnly))
+    return;
+
+  const auto json = QJsonDocument::fromJson(f.readAll()).object();
+  for (auto it = json.constBegin(), end = json.constEnd(); it != end; ++it) {
+    const auto info = it.value().toObject();
+    Host host;
+    host.latencyMs = info["latency"].toDouble(-1);
+    host.bytesPerMs = info["throughput"].toDouble(-1);
+    host.failures = info["failures"].toInt();
+    hosts_.insert(it.key(), host);
+  }
+}
+
+void MirrorStats::save()
+{
+  if (!changed_ || fileName_.isEmpty())
+    return;
+
+  QJsonObject json;
+  for (auto it = hosts_.cbegin(), end = hosts_.cend(); it != end; ++it) {
+    QJsonObject info;
+    info["latency"] = it->latencyMs;
+    info["throughput"] = it->bytesPerMs;
+    info["failures"] = it->failures;
+    json[it.key()] = info;
+  }
+
+  if (!QDir().mkpath(QFileInfo(fileName_).absolutePath()))
+    return;
+
+  QSaveFile f(fileName_);
+  if (!f.open(QFile::WriteOnly)) {
+    LTRACE() << "Failed to save mirror stats" << fileName_ << f.errorString();
+    return;
+  }
+  f.write(QJsonDocument(json).toJson(QJsonDocument::Compact));
+  if (f.commit())
+    changed_ = false;
+}
+
+void MirrorStats::addTransfer(const QString &host, qint64 latencyMs,
+                              qint64 bytes, qint64 elapsedMs)
+{
+  auto &stats = hosts_[host];
+  stats.latencyMs = average(stats.latencyMs, latencyMs);
+  const auto transferMs = std::max<qint64>(1, elapsedMs - latencyMs);
+  if (bytes >= minMeasuredBytes)
+    stats.bytesPerMs = average(stats.bytesPerMs, double(bytes) / transferMs);
+  stats.failures = std::max(0, stats.failures - 1);
+  changed_ = true;
+}
+
+void MirrorStats::addStall(const QString &host, qint64 idleMs)
+{
+  auto &stats = hosts_[host];
+  stats.latencyMs = average(stats.latencyMs, idleMs);
+  changed_ = true;
+}
+
+void MirrorStats::addFailure(const QString &host)
+{
+  ++hosts_[host].failures;
+  changed_ = true;
+}
+
+double MirrorStats::score(const QString &host) const
+{
+  const auto it = hosts_.constFind(host);
+  if (it == hosts_.cend())
+    return 0;
+
+  auto result = it->failures * failurePenaltyMs;
+  if (it->latencyMs > 0)
+    result += it->latencyMs;
+  if (it->bytesPerMs > 0)
+    result += referenceBytes / it->bytesPerMs;
+  return result;
+}
+
+QVector<QUrl> MirrorStats::ranked(const QVector<QUrl> &urls) const
+{
+  auto result = urls;
+  // stable to keep manifest order of equal hosts (e.g. index formats)
+  std::stable_sort(result.begin(), result.end(),
+                   [this](const QUrl &l, const QUrl &r) {
+                     return score(hostKey(l)) < score(hostKey(r));
+                   });
+  return result;
+}
+
+QString MirrorStats::hostKey(const QUrl &url)
+{
+  const auto port = url.port(url.scheme() == "https" ? 443 : 80);
+  return url.host() + ':' + QString::number(port);
+}
+
+//
+
 Loader::Loader(Updater &updater)
   : updater_(updater)
   , network_(new QNetworkAccessManager(this))
+  , stallTimer_(new QTimer(this))
 {
   network_->setRedirectPolicy(
       QNetworkRequest::RedirectPolicy::NoLessSafeRedirectPolicy);
   connect(network_, &QNetworkAccessManager::finished,  //
           this, &Loader::handleReply);
+
+  updateCheckInterval();
+  connect(stallTimer_, &QTimer::timeout,  //
+          this, &Loader::checkStalls);
 }
 
 void Loader::download(const Urls &urls)
 {
-  start(urls, {}, {});
+  if (urls.isEmpty())
+    return;
+
+  auto task = std::make_shared<Task>();
+  task->leftUrls = stats_.ranked(urls);
+  queue_.append(task);
+  schedule();
+}
+
+void Loader::setMaxPerHost(int count)
+{
+  maxPerHost_ = std::max(1, count);
+}
+
+void Loader::setStallTimeout(int ms)
+{
+  stallTimeoutMs_ = ms;
+  updateCheckInterval();
+}
+
+void Loader::setTransferTimeout(int ms)
+{
+  transferTimeoutMs_ = ms;
+  updateCheckInterval();
 }
 
-void Loader::start(const Urls &urls, const QUrl &previous, const QString &error)
+void Loader::updateCheckInterval()
 {
-  if (!error.isEmpty())
-    qCritical() << error;
+  stallTimer_->setInterval(
+      std::max(10, std::min(stallTimeoutMs_, transferTimeoutMs_) / 4));
+}
+
+MirrorStats &Loader::stats()
+{
+  return stats_;
+}
 
-  if (urls.isEmpty()) {
-    if (!previous.isEmpty())
-      updater_.downloadFailed(previous, error);
+void Loader::schedule()
+{
+  if (scheduling_)  // started tasks call back, queue is checked till the end
     return;
+  scheduling_ = true;
+
+  for (auto i = 0; i < queue_.size();) {
+    const auto task = queue_[i];
+    if (task->finished || start(task))
+      queue_.removeAt(i);
+    else
+      ++i;
   }
 
-  auto leftUrls = urls;
-  const auto current = leftUrls.takeFirst();
+  scheduling_ = false;
+
+  if (attempts_.isEmpty()) {
+    stallTimer_->stop();
+    if (queue_.isEmpty())
+      stats_.save();
+  }
+}
+
+bool Loader::start(const std::shared_ptr<Task> &task)
+{
+  auto &urls = task->leftUrls;
+  const auto hasSlot = [this](const QUrl &url) {
+    return hostLoad_.value(MirrorStats::hostKey(url)) < maxPerHost_;
+  };
+  const auto next = std::find_if(urls.begin(), urls.end(), hasSlot);
+  if (next == urls.end())
+    return false;
+
+  const auto current = *next;
+  urls.erase(next);
+
+  auto file = std::make_shared<QTemporaryFile>();
+  if (!file->open()) {
+    urls.clear();  // other mirrors will not help
+    fail(task, current,
+         tr("Failed to create temp file\n%1\nError %2")
+             .arg(file->fileName(), file->errorString()));
+    return true;
+  }
+
+  Attempt attempt;
+  attempt.task = task;
+  attempt.file = file;
+  attempt.host = MirrorStats::hostKey(current);
+  attempt.timer.start();
+  ++hostLoad_[attempt.host];
+  ++task->attempts;
+
   auto reply = network_->get(QNetworkRequest(current));
-  downloads_.insert(reply, leftUrls);
+  reply->setReadBufferSize(chunkSize);
+  attempts_.insert(reply, attempt);
 
+  connect(reply, &QNetworkReply::readyRead,  //
+          this, [this, reply] { handleData(reply); });
   connect(reply, &QNetworkReply::downloadProgress,  //
           this, [this, current](qint64 bytesSent, qint64 bytesTotal) {
             updater_.updateProgress(current, bytesSent, bytesTotal);
           });
 
-  if (reply->error() == QNetworkReply::NoError) {
-    updater_.updateProgress(current, -1, -1);
+  if (!stallTimer_->isActive())
+    stallTimer_->start();
+  updater_.updateProgress(current, -1, -1);
+  return true;
+}
+
+void Loader::fail(const std::shared_ptr<Task> &task, const QUrl &url,
+                  const QString &error)
+{
+  qCritical() << error;
+
+  if (task->attempts > 0) {  // raced mirror may still succeed
+    // or be raced again if it is stalled
+    for (auto &attempt : attempts_) {
+      if (attempt.task == task)
+        attempt.raced = false;
+    }
+    return;
+  }
+
+  if (!task->leftUrls.isEmpty()) {
+    if (!queue_.contains(task))
+      queue_.prepend(task);
+    schedule();
     return;
   }
 
-  handleReply(reply);
+  task->finished = true;
+  updater_.downloadFailed(url, error);
+}
+
+void Loader::handleData(QNetworkReply *reply)
+{
+  const auto it = attempts_.find(reply);
+  if (it == attempts_.end())
+    return;
+
+  const auto data = reply->readAll();
+  const auto elapsed = it->timer.elapsed();
+  if (it->latencyMs < 0)
+    it->latencyMs = elapsed;
+  it->lastDataMs = elapsed;
+  it->bytes += data.size();
+
+  if (it->file->write(data) != data.size()) {
+    LTRACE() << "Failed to save downloaded data" << it->file->errorString();
+    reply->abort();
+  }
 }
 
 void Loader::handleReply(QNetworkReply *reply)
 {
   reply->deleteLater();
 
-  SOFT_ASSERT(downloads_.contains(reply), return );
-  const auto leftUrls = downloads_.take(reply);
+  SOFT_ASSERT(attempts_.contains(reply), return );
+  if (reply->error() == QNetworkReply::NoError)
+    handleData(reply);
+
+  const auto attempt = attempts_.take(reply);
+  const auto &task = attempt.task;
   const auto url = reply->request().url();
+  auto &file = *attempt.file;
+
+  --task->attempts;
+  if (--hostLoad_[attempt.host] < 1)
+    hostLoad_.remove(attempt.host);
+  const auto scheduleNext = qScopeGuard([this] { schedule(); });
+
+  if (task->finished)  // aborted after other mirror won the race
+    return;
+
+  if (file.error() != QFileDevice::NoError) {
+    const auto error = tr("Failed to write to temp file\n%1\nError %2")
+                           .arg(file.fileName(), file.errorString());
+    fail(task, url, error);
+    return;
+  }
 
   if (reply->error() != QNetworkReply::NoError) {
-    const auto error = tr("Failed to download file\n%1. Error %2")
-                           .arg(reply->url().toString(), reply->errorString());
-    start(leftUrls, url, error);
+    if (isHostFailure(*reply))
+      stats_.addFailure(attempt.host);
+    const auto error =
+        tr("Failed to download file\n%1. Error %2")
+            .arg(reply->url().toString(),
+                 attempt.timedOut ? tr("Timed out") : reply->errorString());
+    fail(task, url, error);
     return;
   }
 
-  const auto replyData = reply->readAll();
-  if (replyData.isEmpty()) {
+  if (file.size() == 0 || !file.seek(0)) {
     const auto error = tr("Empty data downloaded from\n%1").arg(url.toString());
-    start(leftUrls, url, error);
+    fail(task, url, error);
     return;
   }
 
-  updater_.downloaded(url, replyData);
+  stats_.addTransfer(attempt.host, std::max<qint64>(0, attempt.latencyMs),
+                     attempt.bytes, attempt.timer.elapsed());
+  task->finished = true;
+
+  QVector<QNetworkReply *> losers;
+  for (auto it = attempts_.cbegin(), end = attempts_.cend(); it != end; ++it) {
+    if (it->task == task)
+      losers.append(it.key());
+  }
+  for (auto loser : losers) loser->abort();
+
+  updater_.downloaded(url, file);
+}
+
+void Loader::checkStalls()
+{
+  auto raced = false;
+  QVector<QNetworkReply *> timedOut;
+  for (auto it = attempts_.begin(), end = attempts_.end(); it != end; ++it) {
+    auto &attempt = *it;
+    if (attempt.timer.elapsed() >= transferTimeoutMs_ && !attempt.timedOut) {
+      LTRACE() << "Transfer timed out" << attempt.host;
+      attempt.timedOut = true;
+      timedOut.append(it.key());
+      continue;
+    }
+
+    const auto idleMs = attempt.timer.elapsed() - attempt.lastDataMs;
+    const auto &task = attempt.task;
+    if (attempt.raced || idleMs < stallTimeoutMs_ || task->finished ||
+        task->attempts > 1 || task->leftUrls.isEmpty())
+      continue;
+
+    LTRACE() << "Mirror stalled, racing next one" << attempt.host;
+    attempt.raced = true;
+    stats_.addStall(attempt.host, idleMs);
+    if (!queue_.contains(task))
+      queue_.prepend(task);
+    raced = true;
+  }
+
+  // abort finishes reply right away and may start next mirror
+  for (auto reply : timedOut) {
+    if (attempts_.contains(reply))
+      reply->abort();
+  }
+
+  if (raced)
+    schedule();
 }
 
 //
@@ -643,47 +1213,230 @@ void Installer::remove(const File &file)
   }
 }
 
+// Temporary file next to installed one. Replaces it atomically if all data
+// is written and has expected md5
+class Installer::Target
+{
+public:
+  Target(const File &file, QString &error)
+    : file_(file)
+    , error_(error)
+    , out_(file.expandedPath)
+  {
+    auto installDir = QFileInfo(file.expandedPath).absoluteDir();
+    if (!installDir.exists() && !installDir.mkpath(".")) {
+      error_ += QApplication::translate("Updates", "Failed to create path\n%1")
+                    .arg(installDir.absolutePath());
+      return;
+    }
+
+    if (!out_.open(QFile::WriteOnly)) {
+      error_ += QApplication::translate(
+                    "Updates", "Failed to create temp file\n%1\nError %2")
+                    .arg(out_.fileName(), out_.errorString());
+    }
+  }
+
+  bool isOpen() const { return out_.isOpen(); }
+
+  bool write(const char *data, qint64 size)
+  {
+    hash_.addData(data, int(size));
+    written_ += size;
+    if (out_.write(data, size) == size)
+      return true;
+    error_ += QApplication::translate(
+                  "Updates", "Failed to write to temp file\n%1\nError %2")
+                  .arg(out_.fileName(), out_.errorString());
+    return false;
+  }
+
+  qint64 written() const { return written_; }
+
+  QString commit()
+  {
+    const QString md5 = hash_.result().toHex();
+    if (!file_.md5.isEmpty() && md5 != file_.md5) {
+      out_.cancelWriting();
+      error_ += QApplication::translate("Updates",
+                                        "Checksum mismatch of\n%1")
+                    .arg(file_.expandedPath);
+      return {};
+    }
+
+    if (!out_.commit()) {
+      error_ += QApplication::translate("Updates",
+                                        "Failed to replace file\n%1\nError %2")
+                    .arg(file_.expandedPath, out_.errorString());
+      return {};
+    }
+    return md5;
+  }
+
+private:
+  const File &file_;
+  QString &error_;
+  QSaveFile out_;
+  QCryptographicHash hash_{QCryptographicHash::Md5};
+  qint64 written_{0};
+};
+
 void Installer::install(const File &file, const QByteArray &data)
 {
-  auto installDir = QFileInfo(file.expandedPath).absoluteDir();
-  if (!installDir.exists() && !installDir.mkpath(".")) {
-    error_ += QApplication::translate("Updates", "Failed to create path\n%1")
-                  .arg(installDir.absolutePath());
+  QBuffer buffer;
+  buffer.setData(data);
+  buffer.open(QBuffer::ReadOnly);
+  install(file, buffer);
+}
+
+void Installer::install(const File &file, QIODevice &data)
+{
+  Target target(file, error_);
+  if (!target.isOpen())
     return;
+
+  QByteArray chunk(chunkSize, Qt::Uninitialized);
+  while (true) {
+    const auto read = data.read(chunk.data(), chunk.size());
+    if (read < 0) {
+      error_ += QApplication::translate("Updates",
+                                        "Failed to read downloaded data\n%1")
+                    .arg(data.errorString());
+      return;
+    }
+    if (read == 0)
+      break;
+    if (!target.write(chunk.constData(), read))
+      return;
   }
 
-  QTemporaryFile tmp;
-  if (!tmp.open()) {
-    error_ += QApplication::translate(
-                  "Updates", "Failed to create temp file\n%1\nError %2")
-                  .arg(tmp.fileName(), tmp.errorString());
+  md5_ = target.commit();
+}
+
+void Installer::installPacked(const File &file, QIODevice &archive)
+{
+  mz_zip_archive zip;
+  memset(&zip, 0, sizeof(zip));
+  zip.m_pRead = readDevice;
+  zip.m_pIO_opaque = &archive;
+  if (!mz_zip_reader_init(&zip, mz_uint64(archive.size()), 0)) {
+    error_ += QApplication::translate("Updates", "Failed to unpack\n%1\n%2")
+                  .arg(file.expandedPath,
+                       mz_zip_get_error_string(zip.m_last_error));
     return;
   }
 
-  const auto wrote = tmp.write(data);
-  if (wrote != data.size()) {
-    error_ += QApplication::translate(
-                  "Updates", "Failed to write to temp file\n%1\nError %2")
-                  .arg(tmp.fileName(), tmp.errorString());
+  const auto guard = qScopeGuard([&zip] { mz_zip_reader_end(&zip); });
+
+  auto index = 0u;
+  const auto fileCount = mz_zip_reader_get_num_files(&zip);
+  while (index < fileCount && mz_zip_reader_is_file_a_directory(&zip, index))
+    ++index;
+  if (index == fileCount) {
+    error_ += QApplication::translate("Updates", "Failed to unpack\n%1\n%2")
+                  .arg(file.expandedPath, "No files in zip archive");
+    return;
+  }
+
+  Target target(file, error_);
+  if (!target.isOpen())
+    return;
+
+  // inflated in blocks of miniz dictionary size, never as a whole
+  const auto write = [](void *opaque, mz_uint64 /*offset*/, const void *data,
+                        size_t size) -> size_t {
+    auto target = static_cast<Target *>(opaque);
+    const auto bytes = static_cast<const char *>(data);
+    return target->write(bytes, qint64(size)) ? size : 0;
+  };
+  if (!mz_zip_reader_extract_to_callback(&zip, index, write, &target, 0)) {
+    error_ += QApplication::translate("Updates", "Failed to unpack\n%1\n%2")
+                  .arg(file.expandedPath,
+                       mz_zip_get_error_string(zip.m_last_error));
     return;
   }
 
-  tmp.close();
+  if (target.written() == 0) {
+    error_ += QApplication::translate("Updates", "Empty data unpacked to\n%1")
+                  .arg(file.expandedPath);
+    return;
+  }
+
+  md5_ = target.commit();
+}
+
+void Installer::installPatch(const File &file, const QByteArray &patch)
+{
+  // written by share/mirror/delta.py
+  const QByteArray magic = "STPATCH1";
+  if (!patch.startsWith(magic)) {
+    error_ += QApplication::translate("Updates", "Incorrect patch for\n%1")
+                  .arg(file.expandedPath);
+    return;
+  }
 
-  QFile existing(file.expandedPath);
-  if (existing.exists() && !existing.remove()) {
+  // base is the installed file itself, it is replaced only after commit
+  QFile base(file.expandedPath);
+  if (!base.open(QFile::ReadOnly)) {
     error_ += QApplication::translate("Updates",
-                                      "Failed to remove file\n%1\nError %2")
-                  .arg(existing.fileName(), existing.errorString());
+                                      "Failed to open file\n%1\nError %2")
+                  .arg(base.fileName(), base.errorString());
     return;
   }
 
-  if (!tmp.copy(file.expandedPath)) {
-    error_ += QApplication::translate(
-                  "Updates", "Failed to copy file\n%1\nto %2\nError %3")
-                  .arg(tmp.fileName(), file.expandedPath, tmp.errorString());
+  Target target(file, error_);
+  if (!target.isOpen())
     return;
+
+  const auto corrupted = [this, &file] {
+    error_ += QApplication::translate("Updates", "Corrupted patch for\n%1")
+                  .arg(file.expandedPath);
+  };
+
+  QByteArray chunk(chunkSize, Qt::Uninitialized);
+  QDataStream stream(patch);
+  stream.setByteOrder(QDataStream::LittleEndian);
+  stream.skipRawData(magic.size());
+  while (!stream.atEnd()) {
+    quint8 kind = 0;
+    stream >> kind;
+    if (kind == 'C') {
+      quint64 offset = 0;
+      quint32 length = 0;
+      stream >> offset >> length;
+      if (stream.status() != QDataStream::Ok ||
+          offset + length > quint64(base.size()) || !base.seek(offset))
+        return corrupted();
+      for (qint64 left = length; left > 0;) {
+        const auto read =
+            base.read(chunk.data(), std::min<qint64>(left, chunk.size()));
+        if (read <= 0)
+          return corrupted();
+        if (!target.write(chunk.constData(), read))
+          return;
+        left -= read;
+      }
+    } else if (kind == 'I') {
+      quint32 length = 0;
+      stream >> length;
+      if (stream.status() != QDataStream::Ok || length > quint32(patch.size()))
+        return corrupted();
+      for (qint64 left = length; left > 0;) {
+        const auto size = int(std::min<qint64>(left, chunk.size()));
+        if (stream.readRawData(chunk.data(), size) != size)
+          return corrupted();
+        if (!target.write(chunk.constData(), size))
+          return;
+        left -= size;
+      }
+    } else {
+      LTRACE() << "Corrupted patch" << LARG(kind);
+      return corrupted();
+    }
   }
+
+  base.close();  // to be replaceable on windows
+  md5_ = target.commit();
 }
 
 const QString &Installer::error() const
@@ -691,6 +1444,11 @@ const QString &Installer::error() const
   return error_;
 }
 
+const QString &Installer::md5() const
+{
+  return md5_;
+}
+
 //
 
 AutoChecker::AutoChecker(Updater &updater, int intervalDays,
@@ -748,9 +1506,8 @@ Updater::Updater(const QVector<QUrl> &updateUrls)
   , loader_(std::make_unique<Loader>(*this))
   , updateUrls_(updateUrls)
 {
-  std::random_device device;
-  std::mt19937 generator(device());
-  std::shuffle(updateUrls_.begin(), updateUrls_.end(), generator);
+  connect(model_.get(), &Model::digestsUpdated,  //
+          this, &Updater::handleDigestsUpdated);
 }
 
 void Updater::initView(QTreeView *view)
@@ -777,11 +1534,219 @@ void Updater::setExpansions(const QHash<QString, QString> &expansions)
   model_->setExpansions(expansions);
 }
 
+void Updater::setCacheDir(const QString &path)
+{
+  cacheDir_ = path;
+  digests_.load(cacheDir_ + "/installed.json");
+  loader_->stats().load(cacheDir_ + "/mirrors.json");
+  model_->updateStates();
+}
+
+DigestIndex &Updater::digests()
+{
+  return digests_;
+}
+
+Loader &Updater::loader()
+{
+  return *loader_;
+}
+
 void Updater::checkForUpdates()
 {
+  fallbackUrls_.clear();
   loader_->download(updateUrls_);
 }
 
+void Updater::finishCheck(const QString &errors)
+{
+  emit checkedForUpdates();
+  if (!errors.isEmpty()) {
+    emit error(errors);
+    return;
+  }
+  checkPending_ = model_->isHashing();
+  if (!checkPending_ && model_->hasUpdates())
+    emit updatesAvailable();
+}
+
+void Updater::handleDigestsUpdated()
+{
+  const auto awaiting = hashing_;
+  hashing_.clear();
+  for (const auto &file : awaiting) {
+    if (digests_.cached(file.expandedPath)) {
+      if (!startPatch(file))
+        downloadFull(file);
+    } else if (model_->isHashing()) {
+      hashing_.push_back(file);
+    } else {  // changed while hashed
+      downloadFull(file);
+    }
+  }
+
+  if (!checkPending_ || model_->isHashing())
+    return;
+  checkPending_ = false;
+  if (model_->hasUpdates())
+    emit updatesAvailable();
+}
+
+void Updater::handleIndex(const QJsonObject &json, const QUrl &indexUrl)
+{
+  if (fallbackUrls_.contains(indexUrl)) {  // another index, skip it
+    fallbackUrls_ = fallbackUrls_.mid(fallbackUrls_.indexOf(indexUrl) + 1);
+    fallbackToFullManifest(tr("No full update data available"));
+    return;
+  }
+
+  indexUrl_ = indexUrl;
+  const auto version = json[versionKey].toInt();
+  if (version != 1) {
+    finishCheck(tr("Wrong updates version: %1").arg(version));
+    return;
+  }
+
+  shards_.clear();
+  pendingShards_.clear();
+
+  const auto shards = json[shardsKey].toObject();
+  for (auto it = shards.constBegin(), end = shards.constEnd(); it != end;
+       ++it) {
+    const auto info = it.value().toObject();
+    Shard shard;
+    shard.name = it.key();
+    for (const auto &url : toList(info["url"]))
+      shard.urls.append(indexUrl.resolved(QUrl(url)));
+    shard.md5 = info["md5"].toString();
+    shards_.push_back(shard);
+  }
+
+  if (shards_.isEmpty()) {
+    finishCheck(tr("No data parsed"));
+    return;
+  }
+
+  auto changed = loadedShards_.size() != shards_.size();
+  for (const auto &shard : qAsConst(shards_)) {
+    if (loadedShards_.value(shard.name) != shard.md5)
+      changed = true;
+  }
+  if (!changed) {
+    LTRACE() << "Update shards not changed";
+    model_->updateStates();
+    finishCheck({});
+    return;
+  }
+
+  for (const auto &shard : qAsConst(shards_)) {
+    if (shardSections_.contains(shard.md5) || loadCachedShard(shard))
+      continue;
+    pendingShards_.insert(shard.name, shard);
+  }
+
+  if (pendingShards_.isEmpty()) {
+    applyShards();
+    return;
+  }
+
+  const auto pending = pendingShards_.values();
+  for (const auto &shard : pending) loader_->download(shard.urls);
+}
+
+QString Updater::findPendingShard(const QUrl &url) const
+{
+  for (auto it = pendingShards_.cbegin(), end = pendingShards_.cend();
+       it != end; ++it) {
+    if (it->urls.contains(url))
+      return it.key();
+  }
+  return {};
+}
+
+void Updater::handleShard(const QUrl &url, const QByteArray &packedData)
+{
+  const auto shard = pendingShards_.take(findPendingShard(url));
+  const auto data = isPacked(packedData) ? unpack(packedData) : packedData;
+  const auto md5 =
+      QCryptographicHash::hash(data, QCryptographicHash::Md5).toHex();
+  const auto section =
+      QJsonDocument::fromJson(data).object().value(shard.name).toObject();
+  if (md5 != shard.md5 || section.isEmpty()) {
+    // index and shards may be cached by mirror out of step
+    fallbackUrls_ = updateUrls_.mid(updateUrls_.indexOf(indexUrl_) + 1);
+    fallbackToFullManifest(tr("Corrupted update data downloaded from\n%1")
+                               .arg(url.toString()));
+    return;
+  }
+
+  shardSections_.insert(shard.md5, section);
+
+  if (!cacheDir_.isEmpty() && QDir().mkpath(cacheDir_)) {
+    QFile f(cacheDir_ + '/' + shard.name + ".json");
+    if (!f.open(QFile::WriteOnly) || f.write(data) != data.size())
+      LTRACE() << "Failed to cache update shard" << f.fileName();
+  }
+
+  if (pendingShards_.isEmpty())
+    applyShards();
+}
+
+void Updater::fallbackToFullManifest(const QString &error)
+{
+  pendingShards_.clear();
+  if (fallbackUrls_.isEmpty()) {
+    finishCheck(error);
+    return;
+  }
+
+  LTRACE() << "Update shards failed, loading" << fallbackUrls_ << error;
+  loader_->download(fallbackUrls_);
+}
+
+bool Updater::loadCachedShard(const Shard &shard)
+{
+  if (cacheDir_.isEmpty())
+    return false;
+
+  QFile f(cacheDir_ + '/' + shard.name + ".json");
+  if (!f.open(QFile::ReadOnly))
+    return false;
+
+  const auto data = f.readAll();
+  const auto md5 =
+      QCryptographicHash::hash(data, QCryptographicHash::Md5).toHex();
+  if (md5 != shard.md5)
+    return false;
+
+  const auto section =
+      QJsonDocument::fromJson(data).object().value(shard.name).toObject();
+  if (section.isEmpty())
+    return false;
+
+  shardSections_.insert(shard.md5, section);
+  return true;
+}
+
+void Updater::applyShards()
+{
+  QJsonObject json;
+  json[versionKey] = 1;
+  QHash<QString, QString> loaded;
+  QHash<QString, QJsonObject> sections;
+  for (const auto &shard : qAsConst(shards_)) {
+    const auto section = shardSections_.value(shard.md5);
+    json[shard.name] = section;
+    loaded.insert(shard.name, shard.md5);
+    sections.insert(shard.md5, section);
+  }
+
+  const auto errors = model_->load(json);
+  loadedShards_ = errors.isEmpty() ? loaded : QHash<QString, QString>{};
+  shardSections_ = sections;
+  finishCheck(errors);
+}
+
 void Updater::applyAction(Action action, const QVector<File> &files)
 {
   for (const auto &file : files) {
@@ -800,7 +1765,9 @@ void Updater::applyAction(Action action, const QVector<File> &files)
     }
 
     if (action == Action::Install) {
-      if (file.urls.isEmpty() || findDownload(file.urls.first()) != -1)
+      if (file.urls.isEmpty() || findDownload(file.urls.first()) != -1 ||
+          findPatch(file.urls.first()) != -1 ||
+          findHashing(file.urls.first()) != -1)
         continue;
 
       Installer installer;
@@ -811,26 +1778,115 @@ void Updater::applyAction(Action action, const QVector<File> &files)
         continue;
       }
 
-      downloading_.push_back(file);
-      loader_->download(file.urls);
+      if (!startPatch(file))
+        downloadFull(file);
       continue;
     }
   }
 }
 
-void Updater::downloaded(const QUrl &url, const QByteArray &data)
+bool Updater::startPatch(const File &file)
+{
+  if (file.patches.isEmpty() || file.md5.isEmpty() ||
+      !QFile::exists(file.expandedPath))
+    return false;
+
+  // big files are not hashed in gui thread, patch starts when hashed
+  const auto md5 = digests_.cached(file.expandedPath);
+  if (!md5) {
+    LTRACE() << "hashing before patch" << file.expandedPath;
+    hashing_.push_back(file);
+    model_->hashInBackground({file.expandedPath});
+    return true;
+  }
+
+  auto it = std::find_if(file.patches.cbegin(), file.patches.cend(),
+                         [md5](const Patch &p) { return p.base == *md5; });
+  if (it == file.patches.cend())
+    return false;
+
+  LTRACE() << "downloading patch" << file.expandedPath << it->urls;
+  patching_.push_back({file, *it});
+  loader_->download(it->urls);
+  return true;
+}
+
+void Updater::handlePatch(const QUrl &url, const QByteArray &data)
+{
+  const auto download = patching_.takeAt(findPatch(url));
+  const auto &file = download.file;
+  model_->updateProgress(file.urls.first(), 0);
+
+  const auto patch = isPacked(data) ? unpack(data) : data;
+  Installer installer;
+  installer.installPatch(file, patch);
+  if (!installer.error().isEmpty()) {
+    LTRACE() << "patch from" << url << "not applied to" << file.expandedPath
+             << installer.error();
+    downloadFull(file);
+    return;
+  }
+
+  finishInstall(file, installer.md5());
+}
+
+void Updater::downloadFull(const File &file)
+{
+  downloading_.push_back(file);
+  loader_->download(file.urls);
+}
+
+void Updater::install(const File &file, QIODevice &data, bool packed)
+{
+  Installer installer;
+  if (packed)
+    installer.installPacked(file, data);
+  else
+    installer.install(file, data);
+  if (!installer.error().isEmpty()) {
+    emit error(installer.error());
+    return;
+  }
+
+  finishInstall(file, installer.md5());
+}
+
+void Updater::finishInstall(const File &file, const QString &md5)
+{
+  auto entry = fileStamp(file.expandedPath);
+  entry.md5 = md5;
+  digests_.store(file.expandedPath, entry);
+  digests_.save();
+
+  model_->updateStates();
+  emit updated();
+}
+
+void Updater::downloaded(const QUrl &url, QIODevice &data)
 {
   LTRACE() << "downloaded" << url << LARG(data.size());
 
   if (updateUrls_.contains(url)) {
-    const auto errors = model_->parse(data);
-    emit checkedForUpdates();
-    if (!errors.isEmpty()) {
-      emit error(errors);
+    const auto packed = data.readAll();
+    const auto manifest = isPacked(packed) ? unpack(packed) : packed;
+    const auto doc = QJsonDocument::fromJson(manifest);
+    const auto json = doc.object();
+    if (json.contains(shardsKey)) {
+      handleIndex(json, url);
       return;
     }
-    if (model_->hasUpdates())
-      emit updatesAvailable();
+    loadedShards_.clear();
+    finishCheck(doc.isNull() ? model_->parse(manifest) : model_->load(json));
+    return;
+  }
+
+  if (!findPendingShard(url).isEmpty()) {
+    handleShard(url, data.readAll());
+    return;
+  }
+
+  if (findPatch(url) != -1) {
+    handlePatch(url, data.readAll());
     return;
   }
 
@@ -845,27 +1901,18 @@ void Updater::downloaded(const QUrl &url, const QByteArray &data)
 
   const auto mustUnpack =
       url.toString().endsWith(".zip") && !file.expandedPath.endsWith(".zip");
-  const auto unpacked = mustUnpack ? unpack(data) : data;
-  if (unpacked.isEmpty()) {
-    emit error(tr("Empty data unpacked from\n%1").arg(url.toString()));
-    return;
-  }
-
-  Installer installer;
-  installer.install(file, unpacked);
-  if (!installer.error().isEmpty()) {
-    emit error(installer.error());
-    return;
-  }
-
-  model_->updateStates();
-  emit updated();
+  install(file, data, mustUnpack);
 }
 
 void Updater::updateProgress(const QUrl &url, qint64 bytesSent,
                              qint64 bytesTotal)
 {
   auto progress = bytesTotal < 1 ? 1 : int(100.0 * bytesSent / bytesTotal);
+  const auto patchIndex = findPatch(url);
+  if (patchIndex != -1) {
+    model_->updateProgress(patching_[patchIndex].file.urls.first(), progress);
+    return;
+  }
   model_->updateProgress(url, progress);
 }
 
@@ -877,6 +1924,19 @@ void Updater::downloadFailed(const QUrl &url, const QString &error)
     return;
   }
 
+  if (!findPendingShard(url).isEmpty()) {
+    fallbackUrls_ = updateUrls_.mid(updateUrls_.indexOf(indexUrl_) + 1);
+    fallbackToFullManifest(error);
+    return;
+  }
+
+  const auto patchIndex = findPatch(url);
+  if (patchIndex != -1) {
+    LTRACE() << "patch download failed" << url << error;
+    downloadFull(patching_.takeAt(patchIndex).file);
+    return;
+  }
+
   model_->updateProgress(url, 0);
 
   const auto index = findDownload(url);
@@ -946,6 +2006,27 @@ int Updater::findDownload(const QUrl &url) const
   return std::distance(downloading_.cbegin(), it);
 }
 
+int Updater::findHashing(const QUrl &url) const
+{
+  auto it = std::find_if(hashing_.cbegin(), hashing_.cend(),
+                         [url](const File &f) { return f.urls.contains(url); });
+  if (it == hashing_.end())
+    return -1;
+  return std::distance(hashing_.cbegin(), it);
+}
+
+int Updater::findPatch(const QUrl &url) const
+{
+  auto it = std::find_if(patching_.cbegin(), patching_.cend(),
+                         [url](const PatchDownload &p) {
+                           return p.patch.urls.contains(url) ||
+                                  p.file.urls.contains(url);
+                         });
+  if (it == patching_.end())
+    return -1;
+  return std::distance(patching_.cbegin(), it);
+}
+
 QModelIndex Updater::fromProxy(const QModelIndex &index) const
 {
   if (!index.isValid() || index.model() == model_.get())
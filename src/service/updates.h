@@ -1,11 +1,20 @@
 #pragma once
 
 #include <QDate>
+#include <QElapsedTimer>
+#include <QJsonObject>
+#include <QSet>
 #include <QStyledItemDelegate>
 #include <QUrl>
 
+#include <optional>
+
+class QIODevice;
 class QNetworkAccessManager;
 class QNetworkReply;
+class QTemporaryFile;
+class QThread;
+class QTimer;
 class QTreeView;
 
 namespace update
@@ -15,15 +24,46 @@ enum class Action { Install, Remove };
 
 class Updater;
 
+struct Patch {
+  QVector<QUrl> urls;
+  QString base;  // md5 of the file version patch applies to
+};
+
 struct File {
   QVector<QUrl> urls;
   QString rawPath;
   QString expandedPath;
   QString md5;
   QDateTime versionDate;
+  QVector<Patch> patches;
   int progress{0};
 };
 
+// Digests of installed files keyed on path, size and modification time.
+// Unchanged files are not read again, even after restart
+class DigestIndex
+{
+public:
+  struct Entry {
+    qint64 size{-1};
+    qint64 mtime{-1};
+    QString md5;  // empty if file is not readable
+  };
+
+  void load(const QString& fileName);
+  void save();
+  std::optional<QString> cached(const QString& path) const;
+  QString md5(const QString& path);
+  void store(const QString& path, const Entry& entry);
+
+  static Entry compute(const QString& path);
+
+private:
+  QString fileName_;
+  QHash<QString, Entry> entries_;
+  bool changed_{false};
+};
+
 class UpdateDelegate : public QStyledItemDelegate
 {
   Q_OBJECT
@@ -40,11 +80,15 @@ public:
   enum class Column { Name, State, Size, Version, Progress, Count };
 
   explicit Model(Updater& updater);
+  ~Model() override;
 
   QString parse(const QByteArray& data);
+  QString load(const QJsonObject& json);
   void setExpansions(const QHash<QString, QString>& expansions);
   void updateStates();
   bool hasUpdates() const;
+  bool isHashing() const;
+  void hashInBackground(const QStringList& paths);
   void updateProgress(const QUrl& url, int progress);
   void selectAllUpdates();
   void tryAction(Action action, const QModelIndex& index);
@@ -59,6 +103,9 @@ public:
   QVariant data(const QModelIndex& index, int role) const override;
   Qt::ItemFlags flags(const QModelIndex& index) const override;
 
+signals:
+  void digestsUpdated();
+
 private:
   struct Component {
     QString name;
@@ -74,7 +121,8 @@ private:
   };
 
   std::unique_ptr<Component> parse(const QJsonObject& json) const;
-  State currentState(const File& file) const;
+  std::optional<State> currentState(const File& file) const;
+  void updateStates(const QSet<QString>& notHashed);
   QString expanded(const QString& source) const;
   Component* toComponent(const QModelIndex& index) const;
   QModelIndex toIndex(const Component& component, int column) const;
@@ -82,6 +130,36 @@ private:
   Updater& updater_;
   std::unique_ptr<Component> root_;
   QHash<QString, QString> expansions_;
+  QThread* hasher_{nullptr};
+  QStringList hashQueue_;
+};
+
+// Latency and throughput of mirror hosts measured on real transfers.
+// Unknown hosts are ranked first to get measured
+class MirrorStats
+{
+public:
+  void load(const QString& fileName);
+  void save();
+  void addTransfer(const QString& host, qint64 latencyMs, qint64 bytes,
+                   qint64 elapsedMs);
+  void addStall(const QString& host, qint64 idleMs);
+  void addFailure(const QString& host);
+  double score(const QString& host) const;
+  QVector<QUrl> ranked(const QVector<QUrl>& urls) const;
+
+  static QString hostKey(const QUrl& url);
+
+private:
+  struct Host {
+    double latencyMs{-1};
+    double bytesPerMs{-1};
+    int failures{0};
+  };
+
+  QString fileName_;
+  QHash<QString, Host> hosts_;
+  bool changed_{false};
 };
 
 class Loader : public QObject
@@ -92,14 +170,49 @@ public:
   explicit Loader(Updater& updater);
 
   void download(const Urls& urls);
+  void setMaxPerHost(int count);
+  void setStallTimeout(int ms);
+  void setTransferTimeout(int ms);
+  MirrorStats& stats();
 
 private:
-  void start(const Urls& urls, const QUrl& previous, const QString& error);
+  struct Task {
+    Urls leftUrls;  // ranked mirrors not tried yet
+    int attempts{0};
+    bool finished{false};
+  };
+  struct Attempt {
+    std::shared_ptr<Task> task;
+    std::shared_ptr<QTemporaryFile> file;  // reply data streamed to disk
+    QString host;
+    QElapsedTimer timer;
+    qint64 latencyMs{-1};
+    qint64 lastDataMs{0};
+    qint64 bytes{0};
+    bool raced{false};  // next mirror is started because this one stalled
+    bool timedOut{false};
+  };
+
+  void schedule();
+  bool start(const std::shared_ptr<Task>& task);
+  void fail(const std::shared_ptr<Task>& task, const QUrl& url,
+            const QString& error);
+  void handleData(QNetworkReply* reply);
   void handleReply(QNetworkReply* reply);
+  void checkStalls();
+  void updateCheckInterval();
 
   Updater& updater_;
   QNetworkAccessManager* network_;
-  QHash<QNetworkReply*, Urls> downloads_;
+  QTimer* stallTimer_;
+  MirrorStats stats_;
+  QHash<QNetworkReply*, Attempt> attempts_;
+  QVector<std::shared_ptr<Task>> queue_;  // wait for free host slot
+  QHash<QString, int> hostLoad_;
+  int maxPerHost_{4};
+  int stallTimeoutMs_{10000};
+  int transferTimeoutMs_{30 * 60 * 1000};  // aborts even slowly sent data
+  bool scheduling_{false};
 };
 
 class Installer
@@ -107,11 +220,18 @@ class Installer
 public:
   void remove(const File& file);
   void install(const File& file, const QByteArray& data);
+  void install(const File& file, QIODevice& data);
+  void installPacked(const File& file, QIODevice& archive);
+  void installPatch(const File& file, const QByteArray& patch);
   void checkInstall(const File& file);
   const QString& error() const;
+  const QString& md5() const;
 
 private:
+  class Target;
+
   QString error_;
+  QString md5_;
 };
 
 class AutoChecker : public QObject
@@ -141,13 +261,16 @@ public:
 
   void initView(QTreeView* view);
   void setExpansions(const QHash<QString, QString>& expansions);
+  void setCacheDir(const QString& path);
   void checkForUpdates();
+  DigestIndex& digests();
+  Loader& loader();
 
   QDateTime lastUpdateCheck() const;
   void setAutoUpdate(int intervalDays, const QDateTime& lastCheck);
 
   void applyAction(Action action, const QVector<File>& files);
-  void downloaded(const QUrl& url, const QByteArray& data);
+  void downloaded(const QUrl& url, QIODevice& data);
   void updateProgress(const QUrl& url, qint64 bytesSent, qint64 bytesTotal);
   void downloadFailed(const QUrl& url, const QString& error);
 
@@ -158,16 +281,52 @@ signals:
   void error(const QString& error);
 
 private:
+  struct Shard {
+    QString name;
+    QVector<QUrl> urls;
+    QString md5;
+  };
+  struct PatchDownload {
+    File file;
+    Patch patch;
+  };
+
+  void finishCheck(const QString& errors);
+  void handleDigestsUpdated();
+  void handleIndex(const QJsonObject& json, const QUrl& indexUrl);
+  void handleShard(const QUrl& url, const QByteArray& data);
+  void fallbackToFullManifest(const QString& error);
+  void applyShards();
+  bool loadCachedShard(const Shard& shard);
+  QString findPendingShard(const QUrl& url) const;
+  bool startPatch(const File& file);
+  void handlePatch(const QUrl& url, const QByteArray& data);
+  void downloadFull(const File& file);
+  void install(const File& file, QIODevice& data, bool packed);
+  void finishInstall(const File& file, const QString& md5);
+  int findPatch(const QUrl& url) const;
   void handleModelDoubleClick(const QModelIndex& index);
   void showModelContextMenu();
   int findDownload(const QUrl& url) const;
+  int findHashing(const QUrl& url) const;
   QModelIndex fromProxy(const QModelIndex& index) const;
 
+  DigestIndex digests_;  // outlives model_
   std::unique_ptr<Model> model_;
   std::unique_ptr<Loader> loader_;
   std::unique_ptr<AutoChecker> autoChecker_;
   QVector<QUrl> updateUrls_;
   QVector<File> downloading_;
+  QVector<PatchDownload> patching_;
+  QVector<File> hashing_;  // wait for digest to choose patch
+  QString cacheDir_;
+  QVector<Shard> shards_;
+  QUrl indexUrl_;
+  QVector<QUrl> fallbackUrls_;  // after index, when its shards failed
+  QHash<QString, Shard> pendingShards_;  // name -> shard
+  QHash<QString, QJsonObject> shardSections_;  // md5 -> section
+  QHash<QString, QString> loadedShards_;       // name -> md5
+  bool checkPending_{false};  // waits for digests to report updates
 };
 
 }  // namespace update
@@ -2,9 +2,22 @@
 
 #include "updates.h"
 
+#include <QBuffer>
+#include <QCryptographicHash>
+#include <QDataStream>
 #include <QDebug>
+#include <QDir>
+#include <QElapsedTimer>
 #include <QFileInfo>
+#include <QJsonArray>
+#include <QJsonDocument>
+#include <QJsonObject>
 #include <QSignalSpy>
+#include <QTcpServer>
+#include <QTcpSocket>
+#include <QTimer>
+
+#include <miniz/miniz.h>
 
 using namespace update;
 
@@ -44,6 +57,119 @@ bool removeFile(const QString& name)
     return true;
   return QFile::remove(name);
 }
+
+QByteArray pack(const QByteArray& name, const QByteArray& data)
+{
+  mz_zip_archive zip;
+  memset(&zip, 0, sizeof(zip));
+  if (!mz_zip_writer_init_heap(&zip, 0, 0))
+    return {};
+
+  void* buffer = nullptr;
+  size_t size = 0;
+  QByteArray result;
+  if (mz_zip_writer_add_mem(&zip, name.constData(), data.constData(),
+                            data.size(), MZ_BEST_COMPRESSION) &&
+      mz_zip_writer_finalize_heap_archive(&zip, &buffer, &size)) {
+    result = QByteArray(static_cast<const char*>(buffer), int(size));
+  }
+  mz_zip_writer_end(&zip);
+  return result;
+}
+
+// Patch in share/mirror/delta.py format: copy base prefix, insert tail
+QByteArray makePatch(quint64 copyLength, const QByteArray& tail)
+{
+  QByteArray result("STPATCH1");
+  QDataStream stream(&result, QIODevice::Append);
+  stream.setByteOrder(QDataStream::LittleEndian);
+  stream << quint8('C') << quint64(0) << quint32(copyLength);
+  stream << quint8('I') << quint32(tail.size());
+  stream.writeRawData(tail.constData(), tail.size());
+  return result;
+}
+
+QByteArray md5(const QByteArray& data)
+{
+  return QCryptographicHash::hash(data, QCryptographicHash::Md5).toHex();
+}
+
+// Serves given files over HTTP, optionally after delay in ms, and records
+// requested paths and the most of simultaneously served requests
+class HttpStandIn : public QObject
+{
+public:
+  HttpStandIn()
+  {
+    server_.listen(QHostAddress::LocalHost);
+    connect(&server_, &QTcpServer::newConnection,  //
+            this, &HttpStandIn::accept);
+  }
+
+  QUrl url(const QString& path) const
+  {
+    return QUrl(
+        QString("http://127.0.0.1:%1%2").arg(server_.serverPort()).arg(path));
+  }
+
+  QHash<QString, QByteArray> files;
+  QHash<QString, int> delays;
+  QStringList requests;
+  int pending{0};
+  int maxPending{0};
+
+private:
+  void accept()
+  {
+    while (auto socket = server_.nextPendingConnection()) {
+      connect(socket, &QTcpSocket::readyRead,  //
+              this, [this, socket] { handle(socket); });
+      connect(socket, &QTcpSocket::disconnected,  //
+              socket, &QObject::deleteLater);
+    }
+  }
+
+  void handle(QTcpSocket* socket)
+  {
+    auto& request = buffers_[socket];
+    request += socket->readAll();
+    if (!request.contains("\r\n\r\n"))
+      return;
+
+    const auto path = QString::fromUtf8(request.split(' ').value(1));
+    buffers_.remove(socket);
+    requests.append(path);
+    maxPending = std::max(maxPending, ++pending);
+
+    if (delays.contains(path)) {
+      QTimer::singleShot(delays[path], socket,
+                         [this, socket, path] { respond(socket, path); });
+      return;
+    }
+    respond(socket, path);
+  }
+
+  void respond(QTcpSocket* socket, const QString& path)
+  {
+    --pending;
+    QByteArray response;
+    if (files.contains(path)) {
+      const auto body = files[path];
+      response = "HTTP/1.1 200 OK\r\nContent-Length: " +
+                 QByteArray::number(body.size()) +
+                 "\r\nConnection: close\r\n\r\n" + body;
+    } else {
+      response =
+          "HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n"
+          "Connection: close\r\n\r\n";
+    }
+    socket->write(response);
+    socket->disconnectFromHost();
+  }
+
+  QTcpServer server_;
+  QHash<QTcpSocket*, QByteArray> buffers_;
+};
 }  // namespace
 
 TEST(UpdateInstaller, SuccessInstall)
@@ -56,6 +182,77 @@ TEST(UpdateInstaller, SuccessInstall)
   ASSERT_TRUE(testee.error().isEmpty());
 }
 
+TEST(UpdateInstaller, StreamPacked)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(writeFile(t1, data));
+  QByteArray big;
+  for (auto i = 0; big.size() < 5 * 1024 * 1024; ++i)
+    big += QByteArray::number(i) + ' ';
+  QBuffer archive;
+  archive.setData(pack("to1.txt", big));
+  archive.open(QBuffer::ReadOnly);
+
+  auto file = toFile(t1);
+  file.md5 = md5(big);
+  Installer testee;
+  testee.installPacked(file, archive);
+  ASSERT_TRUE(testee.error().isEmpty());
+  ASSERT_EQ(md5(big), testee.md5());
+  ASSERT_EQ(big, readFile(t1));
+}
+
+TEST(UpdateInstaller, ChecksumMismatchKeepsFile)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(writeFile(t1, data));
+
+  auto file = toFile(t1);
+  file.md5 = QByteArray(32, '0');
+  Installer testee;
+  testee.install(file, QByteArray("other data"));
+  ASSERT_FALSE(testee.error().isEmpty());
+  ASSERT_EQ(data, readFile(t1));
+  ASSERT_TRUE(QDir("test").entryList({"to1.txt?*"}, QDir::Files).isEmpty());
+}
+
+TEST(UpdateInstaller, FailUnpackCorrupted)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(writeFile(t1, data));
+  QBuffer archive;
+  archive.setData(pack("to1.txt", "more data").left(20));
+  archive.open(QBuffer::ReadOnly);
+
+  Installer testee;
+  testee.installPacked(toFile(t1), archive);
+  ASSERT_FALSE(testee.error().isEmpty());
+  ASSERT_EQ(data, readFile(t1));
+}
+
+TEST(UpdateInstaller, StreamPatch)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  QByteArray base;
+  for (auto i = 0; base.size() < 3 * 1024 * 1024; ++i)
+    base += QByteArray::number(i) + ' ';
+  ASSERT_TRUE(writeFile(t1, base));
+  const auto target = base + "more data\n";
+
+  auto file = toFile(t1);
+  file.md5 = md5(target);
+  Installer testee;
+  testee.installPatch(file, makePatch(base.size(), "more data\n"));
+  ASSERT_TRUE(testee.error().isEmpty());
+  ASSERT_EQ(target, readFile(t1));
+
+  // wrong result keeps installed file
+  file.md5 = QByteArray(32, '0');
+  testee.installPatch(file, makePatch(base.size(), "other data\n"));
+  ASSERT_FALSE(testee.error().isEmpty());
+  ASSERT_EQ(target, readFile(t1));
+}
+
 TEST(UpdateInstaller, SuccessRemove)
 {
   ASSERT_TRUE(writeFile(f1, data));
@@ -132,3 +329,552 @@ TEST(UpdateModel, Parse)
       comp1.sibling(comp1.row(), int(Model::Column::Name)).data().toString();
   ASSERT_EQ("comp1", comp1Name);
 }
+
+TEST(UpdateModel, StateByMd5WhenOlder)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(writeFile(t1, data));
+
+  const auto updates = R"({
+"version":1
+,"recognizers": {
+"Sample":{"files":[
+{"url":"https://example.com/test1", "path":"$test$/to1.txt", "date":"2100-01-01T00:00:00+00:00", "size":6, "md5":"5e8ff9bf55ba3508199d22e984129be6"}
+]}
+,"Changed":{"files":[
+{"url":"https://example.com/test2", "path":"$test$/to1.txt", "date":"2100-01-01T00:00:00+00:00", "size":6, "md5":"00000000000000000000000000000000"}
+]}
+}
+})";
+
+  Updater updater({});
+  Model testee(updater);
+  ASSERT_TRUE(testee.parse(updates).isEmpty());
+  QSignalSpy hashed(&testee, &Model::digestsUpdated);
+  testee.setExpansions({{"$test$", "test"}});
+  ASSERT_TRUE(testee.isHashing());
+  ASSERT_TRUE(hashed.wait());
+
+  const auto recognizers = testee.index(0, 0, {});
+  const auto changed = testee.index(0, int(Model::Column::State), recognizers);
+  const auto sample = testee.index(1, int(Model::Column::State), recognizers);
+  ASSERT_EQ("Update available", changed.data().toString());
+  ASSERT_EQ("Up to date", sample.data().toString());
+}
+
+TEST(UpdateModel, FileChangedWhileHashedIsNotHashedInLoop)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  const auto path = QString("test/written.traineddata");
+  ASSERT_TRUE(writeFile(path, QByteArray(64 * 1024 * 1024, 'x')));
+
+  const auto updates = R"({
+"version":1
+,"recognizers": {
+"Sample":{"files":[
+{"url":"https://example.com/test1", "path":"$test$/written.traineddata", "date":"2100-01-01T00:00:00+00:00", "md5":"5e8ff9bf55ba3508199d22e984129be6"}
+]}
+}
+})";
+
+  Updater updater({});
+  Model testee(updater);
+  ASSERT_TRUE(testee.parse(updates).isEmpty());
+
+  // file is being written all the time it is hashed
+  auto seconds = 0;
+  QTimer writer;
+  QObject::connect(&writer, &QTimer::timeout, [&] {
+    QFile f(path);
+    if (f.open(QFile::ReadWrite))
+      f.setFileTime(QDateTime::currentDateTime().addSecs(++seconds),
+                    QFile::FileModificationTime);
+  });
+  writer.start(5);
+
+  QSignalSpy hashed(&testee, &Model::digestsUpdated);
+  testee.setExpansions({{"$test$", "test"}});
+  ASSERT_TRUE(testee.isHashing());
+  ASSERT_TRUE(hashed.wait());
+  ASSERT_FALSE(testee.isHashing());
+
+  // hashed again on next update
+  writer.stop();
+  testee.setExpansions({{"$test$", "test"}});
+  while (testee.isHashing()) ASSERT_TRUE(hashed.wait());
+
+  const auto recognizers = testee.index(0, 0, {});
+  const auto sample = testee.index(0, int(Model::Column::State), recognizers);
+  ASSERT_EQ("Update available", sample.data().toString());
+  ASSERT_TRUE(removeFile(path));
+}
+
+TEST(UpdateDigestIndex, ReusedUntilFileChanges)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(writeFile(t1, data));
+  const auto indexFile = "test/installed.json";
+  ASSERT_TRUE(removeFile(indexFile));
+
+  {
+    DigestIndex testee;
+    testee.load(indexFile);
+    ASSERT_FALSE(testee.cached(t1));
+    ASSERT_EQ(md5(data), testee.md5(t1));
+    testee.save();
+  }
+
+  DigestIndex testee;
+  testee.load(indexFile);
+  ASSERT_EQ(md5(data), testee.cached(t1).value_or(""));
+
+  const auto other = QByteArray("other data");
+  ASSERT_TRUE(writeFile(t1, other));
+  ASSERT_FALSE(testee.cached(t1));
+  ASSERT_EQ(md5(other), testee.md5(t1));
+}
+
+TEST(UpdateDigestIndex, UnreadableFileIsNotInstalled)
+{
+  const auto missing = "test/missing.txt";
+  ASSERT_TRUE(removeFile(missing));
+
+  DigestIndex testee;
+  ASSERT_TRUE(testee.md5(missing).isEmpty());
+  ASSERT_EQ(-1, DigestIndex::compute(missing).size);
+}
+
+// Run with --gtest_also_run_disabled_tests. ST_BENCH_MODELS and
+// ST_BENCH_MODEL_MB change the simulated installation
+TEST(UpdateDigestIndex, DISABLED_InstalledModelsBenchmark)
+{
+  const auto count = qEnvironmentVariableIntValue("ST_BENCH_MODELS") > 0
+                         ? qEnvironmentVariableIntValue("ST_BENCH_MODELS")
+                         : 120;
+  const auto sizeMb = qEnvironmentVariableIntValue("ST_BENCH_MODEL_MB") > 0
+                          ? qEnvironmentVariableIntValue("ST_BENCH_MODEL_MB")
+                          : 12;
+  const auto dir = QString("bench");
+  ASSERT_TRUE(QDir().mkpath(dir));
+
+  QByteArray model(sizeMb * 1024 * 1024, 0);
+  QJsonObject recognizers;
+  for (auto i = 0; i < count; ++i) {
+    const auto name = QString("model%1.traineddata").arg(i);
+    const auto path = dir + '/' + name;
+    memcpy(model.data(), &i, sizeof(i));
+    if (QFileInfo(path).size() != model.size())
+      ASSERT_TRUE(writeFile(path, model));
+
+    QJsonObject file;
+    file["url"] = "https://example.com/" + name;
+    file["path"] = "$bench$/" + name;
+    file["date"] = "2100-01-01T00:00:00+00:00";  // forces md5 check
+    file["md5"] = QString(md5(model));
+    recognizers[name] = QJsonObject{{"files", QJsonArray{file}}};
+  }
+  const auto updates =
+      QJsonDocument(QJsonObject{{"version", 1}, {"recognizers", recognizers}})
+          .toJson();
+  ASSERT_TRUE(removeFile(dir + "/cache/installed.json"));
+
+  const auto measure = [&](bool expectHashing) {
+    Updater updater({});
+    updater.setCacheDir(dir + "/cache");
+    Model testee(updater);
+    EXPECT_TRUE(testee.parse(updates).isEmpty());
+
+    QElapsedTimer timer;
+    timer.start();
+    QSignalSpy hashed(&testee, &Model::digestsUpdated);
+    testee.setExpansions({{"$bench$", dir}});
+    const auto guiMs = timer.elapsed();
+    EXPECT_EQ(expectHashing, testee.isHashing());
+    while (testee.isHashing()) EXPECT_TRUE(hashed.wait(600'000));
+    const auto totalMs = timer.elapsed();
+
+    const auto root = testee.index(0, 0, {});
+    for (auto i = 0; i < count; ++i) {
+      const auto state = testee.index(i, int(Model::Column::State), root);
+      EXPECT_EQ("Up to date", state.data().toString());
+    }
+    return std::make_pair(guiMs, totalMs);
+  };
+
+  const auto cold = measure(true);
+  const auto warm = measure(false);
+  qDebug().noquote() << QString("%1 models of %2 Mb").arg(count).arg(sizeMb);
+  qDebug().noquote() << QString("cold: %1 ms in GUI thread, %2 ms total")
+                            .arg(cold.first)
+                            .arg(cold.second);
+  qDebug().noquote() << QString("indexed: %1 ms").arg(warm.second);
+  ASSERT_LT(warm.second, cold.second);
+}
+
+TEST(UpdateUpdater, ShardedCheck)
+{
+  ASSERT_TRUE(QDir().mkpath("test/shards"));
+  const auto shard = QByteArray(R"({"version":1,"recognizers":{
+"Afrikaans":{"files":[{"url":"https://example.com/test1", "path":"$tessdata$/afr.traineddata", "date":"2020-03-09T08:28:45+01:00", "size":12800552}]}
+}})");
+  const auto md5 =
+      QCryptographicHash::hash(shard, QCryptographicHash::Md5).toHex();
+  const auto index = QByteArray(R"({"version":1,"shards":{"recognizers":{)") +
+                     R"("url":"recognizers.json", "md5":")" + md5 + "\"}}}";
+  ASSERT_TRUE(writeFile("test/shards/recognizers.json", shard));
+  ASSERT_TRUE(writeFile("test/shards/index.json", index));
+
+  const auto indexUrl = QUrl::fromLocalFile(
+      QFileInfo("test/shards/index.json").absoluteFilePath());
+  Updater testee({indexUrl});
+  QSignalSpy checked(&testee, &Updater::checkedForUpdates);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.checkForUpdates();
+  ASSERT_TRUE(checked.wait());
+  ASSERT_EQ(0, errors.count());
+
+  // unchanged index must not download shards again
+  ASSERT_TRUE(removeFile("test/shards/recognizers.json"));
+  testee.checkForUpdates();
+  ASSERT_TRUE(checked.wait());
+  ASSERT_EQ(0, errors.count());
+
+  // shard must match the hash from index
+  ASSERT_TRUE(writeFile("test/shards/recognizers.json", shard + " "));
+  ASSERT_TRUE(writeFile("test/shards/index.json",
+                        QByteArray(index).replace(md5, QByteArray(32, '0'))));
+  testee.checkForUpdates();
+  ASSERT_TRUE(checked.wait());
+  ASSERT_EQ(1, errors.count());
+}
+
+TEST(UpdateUpdater, CompressedShards)
+{
+  const auto shard = QByteArray(R"({"version":1,"recognizers":{
+"Afrikaans":{"files":[{"url":"https://example.com/test1", "path":"$tessdata$/afr.traineddata", "date":"2020-03-09T08:28:45+01:00", "size":12800552}]}
+}})");
+  const auto md5 =
+      QCryptographicHash::hash(shard, QCryptographicHash::Md5).toHex();
+  const auto index = QByteArray(R"({"version":1,"shards":{"recognizers":{)") +
+                     R"("url":["recognizers.json.zip","recognizers.json"], )" +
+                     R"("md5":")" + md5 + "\"}}}";
+
+  HttpStandIn server;
+  server.files["/updates/index.json.zip"] = pack("index.json", index);
+  server.files["/updates/recognizers.json.zip"] =
+      pack("recognizers.json", shard);
+
+  Updater testee({server.url("/updates/index.json.zip"),
+                  server.url("/updates/index.json")});
+  QSignalSpy checked(&testee, &Updater::checkedForUpdates);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.checkForUpdates();
+  ASSERT_TRUE(checked.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(QStringList({"/updates/index.json.zip",
+                         "/updates/recognizers.json.zip"}),
+            server.requests);
+}
+
+TEST(UpdateUpdater, StaleShardFallbackToFullManifest)
+{
+  const auto shard = QByteArray(R"({"version":1,"recognizers":{
+"Afrikaans":{"files":[{"url":"https://example.com/test1", "path":"$tessdata$/afr.traineddata", "date":"2020-03-09T08:28:45+01:00", "size":12800552}]}
+}})");
+  // shard was updated after cached index was published
+  const auto index = QByteArray(R"({"version":1,"shards":{"recognizers":{)") +
+                     R"("url":"recognizers.json", "md5":")" +
+                     QByteArray(32, '0') + "\"}}}";
+
+  HttpStandIn server;
+  server.files["/updates/index.json"] = index;
+  server.files["/updates/recognizers.json"] = shard;
+  server.files["/updates.json"] = shard;
+
+  Updater testee({server.url("/updates/index.json.zip"),
+                  server.url("/updates/index.json"),
+                  server.url("/updates.json")});
+  QSignalSpy checked(&testee, &Updater::checkedForUpdates);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.checkForUpdates();
+  ASSERT_TRUE(checked.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(QStringList({"/updates/index.json.zip", "/updates/index.json",
+                         "/updates/recognizers.json", "/updates.json"}),
+            server.requests);
+}
+
+TEST(UpdateUpdater, PlainManifestFallback)
+{
+  const auto updates = QByteArray(R"({
+"version":1
+,"recognizers": {
+"Afrikaans":{"files":[
+{"url":"https://example.com/test1", "path":"$tessdata$/afr.traineddata", "date":"2020-03-09T08:28:45+01:00", "size":12800552}
+]}
+}
+})");
+
+  HttpStandIn server;
+  server.files["/updates.json"] = updates;
+
+  Updater testee({server.url("/updates.json.zip"), server.url("/updates.json")});
+  QSignalSpy checked(&testee, &Updater::checkedForUpdates);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.checkForUpdates();
+  ASSERT_TRUE(checked.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(QStringList({"/updates.json.zip", "/updates.json"}),
+            server.requests);
+}
+
+TEST(UpdateUpdater, InstallByPatch)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  const auto base = QByteArray("sample data\n");
+  const auto target = QByteArray("sample data\nmore data\n");
+  ASSERT_TRUE(writeFile(t1, base));
+
+  HttpStandIn server;
+  server.files["/to1.txt.zip"] = pack("to1.txt", target);
+  server.files["/to1.txt.patch.zip"] =
+      pack("patch", makePatch(base.size(), "more data\n"));
+
+  File file = toFile(t1);
+  file.urls = {server.url("/to1.txt.zip")};
+  file.md5 = md5(target);
+  file.patches = {{{server.url("/other.patch.zip")}, QByteArray(32, '0')},
+                  {{server.url("/to1.txt.patch.zip")}, md5(base)}};
+
+  Updater testee({});
+  QSignalSpy updated(&testee, &Updater::updated);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.applyAction(Action::Install, {file});
+  ASSERT_FALSE(testee.digests().cached(t1));  // hashed in background
+  ASSERT_TRUE(updated.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(target, readFile(t1));
+  ASSERT_EQ(QStringList({"/to1.txt.patch.zip"}), server.requests);
+}
+
+TEST(UpdateUpdater, InstallStreamedDownload)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(removeFile(t1));
+  QByteArray target;
+  for (auto i = 0; target.size() < 8 * 1024 * 1024; ++i)
+    target += QByteArray::number(i * 7919) + '\n';
+
+  HttpStandIn server;
+  server.files["/to1.txt.zip"] = pack("to1.txt", target);
+
+  File file = toFile(t1);
+  file.urls = {server.url("/to1.txt.zip")};
+  file.md5 = md5(target);
+
+  Updater testee({});
+  QSignalSpy updated(&testee, &Updater::updated);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.applyAction(Action::Install, {file});
+  ASSERT_TRUE(updated.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(target, readFile(t1));
+  ASSERT_EQ(md5(target), testee.digests().cached(t1).value_or(""));
+}
+
+TEST(UpdateUpdater, PatchFallbackToFullDownload)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  const auto base = QByteArray("sample data\n");
+  const auto target = QByteArray("sample data\nmore data\n");
+  ASSERT_TRUE(writeFile(t1, base));
+
+  HttpStandIn server;
+  server.files["/to1.txt.zip"] = pack("to1.txt", target);
+  // produces wrong contents
+  server.files["/to1.txt.patch.zip"] =
+      pack("patch", makePatch(base.size(), "other data\n"));
+
+  File file = toFile(t1);
+  file.urls = {server.url("/to1.txt.zip")};
+  file.md5 = md5(target);
+  file.patches = {{{server.url("/to1.txt.patch.zip")}, md5(base)}};
+
+  Updater testee({});
+  QSignalSpy updated(&testee, &Updater::updated);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.applyAction(Action::Install, {file});
+  ASSERT_TRUE(updated.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(target, readFile(t1));
+  ASSERT_EQ(QStringList({"/to1.txt.patch.zip", "/to1.txt.zip"}),
+            server.requests);
+}
+
+TEST(UpdateMirrorStats, RankByMeasuredSpeed)
+{
+  const QUrl slow("http://slow.example.com/f");
+  const QUrl fast("http://fast.example.com/f");
+  const QUrl unknown("https://new.example.com/f");
+
+  MirrorStats testee;
+  testee.addTransfer("slow.example.com:80", 300, 4 << 20, 8000);
+  testee.addTransfer("fast.example.com:80", 50, 4 << 20, 1000);
+  ASSERT_EQ(QVector<QUrl>({unknown, fast, slow}),
+            testee.ranked({slow, fast, unknown}));
+
+  testee.addFailure("fast.example.com:80");
+  ASSERT_EQ(QVector<QUrl>({unknown, slow, fast}),
+            testee.ranked({fast, slow, unknown}));
+}
+
+TEST(UpdateLoader, PreferFastMirror)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(removeFile(t1));
+
+  HttpStandIn slow, fast;
+  slow.files["/to1.txt"] = fast.files["/to1.txt"] = data;
+
+  File file = toFile(t1);
+  file.urls = {slow.url("/to1.txt"), fast.url("/to1.txt")};
+
+  Updater testee({});
+  auto& stats = testee.loader().stats();
+  stats.addTransfer(MirrorStats::hostKey(file.urls[0]), 500, 1 << 20, 2000);
+  stats.addTransfer(MirrorStats::hostKey(file.urls[1]), 5, 1 << 20, 100);
+  QSignalSpy updated(&testee, &Updater::updated);
+
+  testee.applyAction(Action::Install, {file});
+  ASSERT_TRUE(updated.wait());
+  ASSERT_EQ(data, readFile(t1));
+  ASSERT_TRUE(slow.requests.isEmpty());
+  ASSERT_EQ(QStringList({"/to1.txt"}), fast.requests);
+}
+
+TEST(UpdateLoader, RaceStalledMirror)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(removeFile(t1));
+
+  HttpStandIn stalled, spare;
+  stalled.files["/to1.txt"] = spare.files["/to1.txt"] = data;
+  stalled.delays["/to1.txt"] = 5000;
+
+  File file = toFile(t1);
+  file.urls = {stalled.url("/to1.txt"), spare.url("/to1.txt")};
+
+  Updater testee({});
+  testee.loader().setStallTimeout(200);
+  QSignalSpy updated(&testee, &Updater::updated);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  QElapsedTimer timer;
+  timer.start();
+  testee.applyAction(Action::Install, {file});
+  ASSERT_TRUE(updated.wait());
+  ASSERT_LT(timer.elapsed(), 3000);
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(data, readFile(t1));
+  ASSERT_EQ(QStringList({"/to1.txt"}), stalled.requests);
+  ASSERT_EQ(QStringList({"/to1.txt"}), spare.requests);
+
+  const auto& stats = testee.loader().stats();
+  ASSERT_GT(stats.score(MirrorStats::hostKey(file.urls[0])),
+            stats.score(MirrorStats::hostKey(file.urls[1])));
+}
+
+TEST(UpdateLoader, RaceAgainAfterRacerFailed)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(removeFile(t1));
+
+  HttpStandIn stalled, missing, spare;
+  stalled.files["/to1.txt"] = spare.files["/to1.txt"] = data;
+  stalled.delays["/to1.txt"] = 5000;
+
+  File file = toFile(t1);
+  file.urls = {stalled.url("/to1.txt"), missing.url("/to1.txt"),
+               spare.url("/to1.txt")};
+
+  Updater testee({});
+  testee.loader().setStallTimeout(200);
+  QSignalSpy updated(&testee, &Updater::updated);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  QElapsedTimer timer;
+  timer.start();
+  testee.applyAction(Action::Install, {file});
+  ASSERT_TRUE(updated.wait());
+  ASSERT_LT(timer.elapsed(), 3000);
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(data, readFile(t1));
+  ASSERT_EQ(QStringList({"/to1.txt"}), missing.requests);
+  ASSERT_EQ(QStringList({"/to1.txt"}), spare.requests);
+
+  // 404 is not a mirror failure
+  const auto& stats = testee.loader().stats();
+  ASSERT_EQ(0, stats.score(MirrorStats::hostKey(file.urls[1])));
+}
+
+TEST(UpdateLoader, TransferTimeout)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  ASSERT_TRUE(removeFile(t1));
+
+  HttpStandIn stalled;
+  stalled.files["/to1.txt"] = data;
+  stalled.delays["/to1.txt"] = 5000;
+
+  File file = toFile(t1);
+  file.urls = {stalled.url("/to1.txt")};
+
+  Updater testee({});
+  testee.loader().setTransferTimeout(300);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  QElapsedTimer timer;
+  timer.start();
+  testee.applyAction(Action::Install, {file});
+  ASSERT_TRUE(errors.wait());
+  ASSERT_LT(timer.elapsed(), 3000);
+  ASSERT_FALSE(QFile::exists(t1));
+
+  const auto& stats = testee.loader().stats();
+  ASSERT_GT(stats.score(MirrorStats::hostKey(file.urls[0])), 0);
+}
+
+TEST(UpdateLoader, LimitTransfersPerHost)
+{
+  ASSERT_TRUE(QDir().mkpath("test"));
+  HttpStandIn server;
+  QVector<File> files;
+  for (auto i = 0; i < 6; ++i) {
+    const auto name = QString("/bulk%1.txt").arg(i);
+    server.files[name] = data;
+    server.delays[name] = 100;
+    File file = toFile("test" + name);
+    ASSERT_TRUE(removeFile(file.expandedPath));
+    file.urls = {server.url(name)};
+    files.append(file);
+  }
+
+  Updater testee({});
+  testee.loader().setMaxPerHost(2);
+  QSignalSpy updated(&testee, &Updater::updated);
+  QSignalSpy errors(&testee, &Updater::error);
+
+  testee.applyAction(Action::Install, files);
+  while (updated.count() < files.size()) ASSERT_TRUE(updated.wait());
+  ASSERT_EQ(0, errors.count());
+  ASSERT_EQ(6, server.requests.size());
+  ASSERT_LE(server.maxPending, 2);
+  for (const auto& file : files) ASSERT_EQ(data, readFile(file.expandedPath));
+}